@@ -0,0 +1,155 @@
+# Record/replay for AI completions.
+#
+# In record mode every completion still goes to the model; the request, the
+# response (or error) and how long it took are appended to a gzip'd NDJSON
+# cassette in the cassette directory (one file per worker process, one gzip
+# member per entry so a killed worker loses nothing).
+#
+# In replay mode no network call is made. A request is matched by a hash of its
+# model, messages and parameters; repeated identical requests get their
+# recordings back in the order they were made. With loose matching, a request
+# that was never recorded exactly (e.g. a prompt that embeds the user's past
+# ideas) falls back to a recording with the same model and system prompt, which
+# keeps payload sizes realistic for offline profiling. Replay pacing: speed 0
+# answers immediately, 1 takes as long as the original call, 10 is ten times
+# faster.
+
+import glob
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+MODES = ('off', 'record', 'replay')
+
+
+class CassetteMiss(Exception):
+    pass
+
+
+class RecordedError(Exception):
+    # Replayed failure of the original call
+    pass
+
+
+def request_key(request):
+    payload = {k: v for k, v in request.items() if k != 'extra_headers'}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def loose_key(request):
+    system = next((m.get('content') for m in request.get('messages', []) if m.get('role') == 'system'), '')
+    return request_key({'model': request.get('model'), 'system': system})
+
+
+class Cassette:
+    def __init__(self, mode='off', path='cassettes', speed=0.0, match='exact'):
+        if mode not in MODES:
+            raise ValueError(f"AI_CASSETTE_MODE must be one of {', '.join(MODES)} (got '{mode}')")
+        self.mode = mode
+        self.path = path
+        self.speed = speed
+        self.loose = match == 'loose'
+        self.stats = {'recorded': 0, 'replayed': 0, 'loose': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_pid = None
+        self._index = None
+        self._positions = {}
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def complete(self, create, request):
+        # create: the real call (client.chat.completions.create); request: its kwargs
+        if self.mode == 'replay':
+            return self._replay(request)
+        if self.mode == 'record':
+            return self._record(create, request)
+        return _result(create(**request))
+
+    # --- Recording ---
+
+    def _record(self, create, request):
+        started = time.perf_counter()
+        entry = {'key': request_key(request), 'loose_key': loose_key(request),
+                 'request': {k: v for k, v in request.items() if k != 'extra_headers'},
+                 'recorded_at': time.time()}
+        try:
+            result = _result(create(**request))
+        except Exception as e:
+            entry.update(elapsed=time.perf_counter() - started, error={'type': type(e).__name__, 'message': str(e)})
+            self._append(entry)
+            raise
+        entry.update(elapsed=time.perf_counter() - started, response=result)
+        self._append(entry)
+        return result
+
+    def _append(self, entry):
+        line = (json.dumps(entry, ensure_ascii=False) + '\n').encode()
+        with self._lock:
+            try:
+                if self._file is None or self._file_pid != os.getpid():
+                    os.makedirs(self.path, exist_ok=True)
+                    self._file = os.path.join(self.path, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.ndjson.gz")
+                    self._file_pid = os.getpid()
+                with open(self._file, 'ab') as f:
+                    f.write(gzip.compress(line))
+                self.stats['recorded'] += 1
+            except OSError as e:
+                print(f"AI cassette write failed: {e}")
+
+    # --- Replay ---
+
+    def load(self):
+        files = [self.path] if os.path.isfile(self.path) else sorted(glob.glob(os.path.join(self.path, '*.ndjson.gz')))
+        entries = []
+        for name in files:
+            with gzip.open(name, 'rt', encoding='utf-8') as f:
+                entries.extend(json.loads(line) for line in f if line.strip())
+        entries.sort(key=lambda entry: entry.get('recorded_at', 0))
+        index = {}
+        for entry in entries:
+            index.setdefault(entry['key'], []).append(entry)
+            index.setdefault('~' + entry['loose_key'], []).append(entry)
+        print(f"AI cassette: {len(entries)} recordings from {len(files)} file(s) in {self.path}")
+        return index
+
+    def _next(self, key):
+        with self._lock:
+            if self._index is None:
+                self._index = self.load()
+            recordings = self._index.get(key)
+            if not recordings:
+                return None
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            return recordings[position % len(recordings)]
+
+    def _replay(self, request):
+        entry = self._next(request_key(request))
+        counter = 'replayed'
+        if entry is None and self.loose:
+            entry, counter = self._next('~' + loose_key(request)), 'loose'
+        with self._lock:
+            self.stats[counter if entry else 'misses'] += 1
+        if entry is None:
+            raise CassetteMiss(f"No recording for {request.get('model')} request {request_key(request)[:12]}")
+        if self.speed > 0:
+            time.sleep(entry['elapsed'] / self.speed)
+        if 'error' in entry:
+            raise RecordedError(f"{entry['error']['type']}: {entry['error']['message']}")
+        return entry['response']
+
+
+def _result(response):
+    usage = getattr(response, 'usage', None)
+    return {
+        'content': response.choices[0].message.content,
+        'model': getattr(response, 'model', None),
+        'finish_reason': response.choices[0].finish_reason,
+        'usage': usage.model_dump() if usage is not None else None
+    }
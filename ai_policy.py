@@ -0,0 +1,200 @@
+# Which model, output budget and temperature each AI call gets, and what it used.
+#
+# POLICIES maps mode -> plan -> settings. A call in mode M for plan P is built
+# from four layers, later ones winning field by field:
+#
+#     ['*']['*']  ->  ['*'][P]  ->  [M]['*']  ->  [M][P]
+#
+# Modes are the AI_Engine tasks (idea, script, ..., support); plans are the
+# scheduler's (admin, business, pro, starter, free, anonymous). `model` is a tier
+# name (economy / standard / premium, set by AI_MODEL_ECONOMY, AI_MODEL and
+# AI_MODEL_PREMIUM) or a literal OpenRouter model id. With no tier variables set,
+# every tier is AI_MODEL, so only the budgets change.
+#
+# AI_POLICY_FILE points at a JSON file of the same shape, merged over the
+# built-in table, e.g. {"script": {"business": {"model": "anthropic/claude-3.5-sonnet"}}}.
+# It is validated at startup.
+#
+# Every call is written to the `ai_usage` ledger with the policy that applied and
+# the tokens the provider reports, so /admin/ai-usage can show realized spend per
+# policy (and how often a budget cut an answer short). Failed calls are written
+# too, with the error type and the estimated prompt size (a timed-out call may
+# still be billed, and a failing model should show up next to its spend).
+
+import json
+import os
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+import metrics
+
+AI_MODEL = os.getenv('AI_MODEL', 'google/gemini-2.0-flash-001')
+MODEL_TIERS = {
+    'economy': os.getenv('AI_MODEL_ECONOMY', AI_MODEL),
+    'standard': AI_MODEL,
+    'premium': os.getenv('AI_MODEL_PREMIUM', AI_MODEL),
+}
+AI_POLICY_FILE = os.getenv('AI_POLICY_FILE', '')
+AI_USAGE_RETENTION_DAYS = int(os.getenv('AI_USAGE_RETENTION_DAYS', 90))
+CLEANUP_INTERVAL = 3600
+
+MODES = ['idea', 'script', 'viral_analyzer', 'competitor_scanner', 'content_scorer', 'weekly_plan',
+         'optimize_cta', 'rewrite_hook', 'support']
+PLANS = ['admin', 'business', 'pro', 'starter', 'free', 'anonymous']
+FIELDS = {'model', 'max_tokens', 'temperature'}
+
+POLICIES = {
+    '*': {
+        '*': {'model': 'standard', 'max_tokens': 800, 'temperature': 0.7},
+        'free': {'model': 'economy'},
+        'anonymous': {'model': 'economy'},
+    },
+    'idea': {'*': {'max_tokens': 700, 'temperature': 0.9}},
+    'script': {
+        '*': {'max_tokens': 1300, 'temperature': 0.8},
+        'business': {'model': 'premium'},
+        'admin': {'model': 'premium'},
+    },
+    'viral_analyzer': {'*': {'max_tokens': 900, 'temperature': 0.5}},
+    'competitor_scanner': {
+        '*': {'max_tokens': 1200, 'temperature': 0.5},
+        'business': {'model': 'premium'},
+        'admin': {'model': 'premium'},
+    },
+    'content_scorer': {'*': {'max_tokens': 600, 'temperature': 0.3}},
+    'weekly_plan': {
+        '*': {'max_tokens': 1800, 'temperature': 0.7},
+        'business': {'model': 'premium'},
+        'admin': {'model': 'premium'},
+    },
+    'optimize_cta': {'*': {'max_tokens': 300, 'temperature': 0.8}},
+    'rewrite_hook': {'*': {'max_tokens': 300, 'temperature': 0.9}},
+    'support': {'*': {'max_tokens': 350, 'temperature': 0.4}},
+}
+
+Policy = namedtuple('Policy', 'name model max_tokens temperature')
+
+
+class PolicyTable:
+    def __init__(self, overrides=None):
+        self.table = {mode: {plan: dict(settings) for plan, settings in plans.items()}
+                      for mode, plans in POLICIES.items()}
+        for mode, plans in (overrides or {}).items():
+            layers = self.table.setdefault(mode, {})
+            for plan, settings in plans.items():
+                layers.setdefault(plan, {}).update(settings)
+        self._validate()
+        self.resolve = lru_cache(maxsize=None)(self._resolve)
+
+    @classmethod
+    def from_file(cls, path):
+        if not path:
+            return cls()
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _validate(self):
+        for mode, plans in self.table.items():
+            if mode != '*' and mode not in MODES:
+                raise ValueError(f"AI policy: unknown mode '{mode}' (expected one of {', '.join(MODES)})")
+            for plan, settings in plans.items():
+                if plan != '*' and plan not in PLANS:
+                    raise ValueError(f"AI policy: unknown plan '{plan}' in mode '{mode}'")
+                unknown = set(settings) - FIELDS
+                if unknown:
+                    raise ValueError(f"AI policy: unknown field(s) {', '.join(sorted(unknown))} for {mode}/{plan}")
+                if 'max_tokens' in settings and not (isinstance(settings['max_tokens'], int) and settings['max_tokens'] > 0):
+                    raise ValueError(f"AI policy: max_tokens for {mode}/{plan} must be a positive integer")
+                if 'temperature' in settings and not 0 <= settings['temperature'] <= 2:
+                    raise ValueError(f"AI policy: temperature for {mode}/{plan} must be between 0 and 2")
+
+    def _resolve(self, mode, plan):
+        settings = {}
+        for m, p in (('*', '*'), ('*', plan), (mode, '*'), (mode, plan)):
+            settings.update(self.table.get(m, {}).get(p, {}))
+        model = MODEL_TIERS.get(settings['model'], settings['model'])
+        return Policy(f"{mode}/{plan}", model, settings['max_tokens'], settings['temperature'])
+
+
+# --- Usage ledger ---
+
+SQLITE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS ai_usage
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at REAL NOT NULL,
+        user_id INTEGER,
+        plan TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        policy TEXT NOT NULL,
+        model TEXT,
+        max_tokens INTEGER,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        truncated INTEGER DEFAULT 0,
+        elapsed_ms INTEGER,
+        error TEXT)''',
+    "CREATE INDEX IF NOT EXISTS idx_ai_usage_created ON ai_usage(created_at)",
+]
+
+
+class UsageLedger:
+    def __init__(self, connect, retention_days=AI_USAGE_RETENTION_DAYS):
+        self.connect = connect
+        self.retention = retention_days * 86400
+        self._last_cleanup = 0
+
+    def record(self, user_id, plan, mode, policy, result, seconds, error=None, prompt_estimate=None):
+        # result is None when the call failed; error is its exception type then
+        result = result or {}
+        usage = result.get('usage') or {}
+        prompt_tokens = usage.get('prompt_tokens', prompt_estimate if error else None)
+        completion_tokens = usage.get('completion_tokens')
+        truncated = result.get('finish_reason') == 'length'
+        metrics.AI_TOKENS.labels(policy.name, 'prompt').inc(prompt_tokens or 0)
+        metrics.AI_TOKENS.labels(policy.name, 'completion').inc(completion_tokens or 0)
+        if truncated:
+            metrics.AI_TRUNCATED.labels(policy.name).inc()
+        if error:
+            metrics.AI_FAILED.labels(policy.name, error).inc()
+
+        now = time.time()
+        conn = self.connect()
+        try:
+            if now - self._last_cleanup > CLEANUP_INTERVAL:
+                self._last_cleanup = now
+                conn.execute("DELETE FROM ai_usage WHERE created_at < ?", (now - self.retention,))
+            conn.execute('''INSERT INTO ai_usage (created_at, user_id, plan, mode, policy, model, max_tokens,
+                                                  prompt_tokens, completion_tokens, truncated, elapsed_ms, error)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                         (now, user_id, plan, mode, policy.name, result.get('model') or policy.model,
+                          policy.max_tokens, prompt_tokens, completion_tokens, int(truncated),
+                          int(seconds * 1000), error))
+            conn.commit()
+        except Exception as e:
+            # Accounting must never fail the user's request
+            print(f"AI usage ledger write failed: {e}")
+        finally:
+            conn.close()
+
+    def summary(self, days=7):
+        # One row per policy and model: calls, failures, tokens, truncation rate and latency
+        conn = self.connect()
+        try:
+            rows = conn.execute('''SELECT policy, model, COUNT(*), MAX(max_tokens),
+                                          SUM(prompt_tokens), SUM(completion_tokens),
+                                          AVG(completion_tokens), MAX(completion_tokens),
+                                          SUM(truncated), AVG(elapsed_ms),
+                                          SUM(CASE WHEN error IS NOT NULL THEN 1 ELSE 0 END)
+                                   FROM ai_usage WHERE created_at >= ?
+                                   GROUP BY policy, model
+                                   ORDER BY SUM(COALESCE(prompt_tokens, 0) + COALESCE(completion_tokens, 0)) DESC''',
+                                (time.time() - days * 86400,)).fetchall()
+        finally:
+            conn.close()
+        return [{
+            'policy': row[0], 'model': row[1], 'calls': row[2], 'max_tokens': row[3],
+            'prompt_tokens': row[4] or 0, 'completion_tokens': row[5] or 0,
+            'avg_completion': float(row[6] or 0), 'max_completion': row[7] or 0,
+            'truncated': row[8] or 0, 'avg_ms': float(row[9] or 0), 'failed': row[10] or 0,
+        } for row in rows]
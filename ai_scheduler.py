@@ -0,0 +1,268 @@
+# Bounded, plan-aware scheduler for upstream AI calls (one per worker process).
+#
+# Every model call (AI_Engine._complete) takes a slot first. Slots are limited:
+#
+# - globally, by a concurrency limit that adapts to OpenRouter's latency. It
+#   grows by one per "round" while calls come back at their usual speed, and is
+#   cut by BACKOFF when the smoothed latency climbs past LATENCY_TOLERANCE times
+#   the baseline, or a call times out or gets a 5xx/429. A slow upstream
+#   therefore gets fewer concurrent calls instead of a growing pile of blocked
+#   threads. Other failures (a 400 for a bad model id) leave the limit alone;
+# - per user (AI_PER_USER_CONCURRENCY), so one account cannot take every slot.
+#
+# Callers that cannot get a slot wait in a queue ordered by plan (admin, then
+# business, pro, starter, free, and anonymous support chat last), FIFO within
+# a plan. Each plan has a queue deadline. A caller is turned away with
+# Overloaded (503 + Retry-After) straight away when the queue is full and
+# nobody lower in priority can be evicted, or when the estimated wait already
+# exceeds its deadline. Otherwise it is turned away once the deadline passes.
+#
+# The limits apply per gunicorn worker: the server as a whole runs up to
+# GUNICORN_WORKERS x AI_MAX_CONCURRENCY model calls. Queued callers still hold a
+# gunicorn thread, so running plus queued calls are capped at GUNICORN_THREADS - 1
+# (one thread stays free for the rest of the site); the queue is "full" at that
+# point, whatever AI_QUEUE_MAX says. More threads mean a longer queue, and plan
+# priority only matters when callers can wait.
+
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# gunicorn.conf.py exports its thread count; the default matches its default
+WORKER_THREADS = int(os.getenv('GUNICORN_THREADS', 8))
+AI_THREAD_BUDGET = max(2, WORKER_THREADS - 1)     # Running + queued calls per worker
+# Default: half the threads run model calls, the rest of the budget can queue
+AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', max(1, WORKER_THREADS // 2)))
+AI_MIN_CONCURRENCY = int(os.getenv('AI_MIN_CONCURRENCY', 2))
+AI_INITIAL_CONCURRENCY = int(os.getenv('AI_INITIAL_CONCURRENCY', 2))
+AI_PER_USER_CONCURRENCY = int(os.getenv('AI_PER_USER_CONCURRENCY', 2))
+AI_QUEUE_MAX = int(os.getenv('AI_QUEUE_MAX', AI_THREAD_BUDGET))
+
+PRIORITIES = {'admin': 0, 'business': 1, 'pro': 2, 'starter': 3, 'free': 4, 'anonymous': 5}
+QUEUE_DEADLINES = {          # Seconds a caller may wait for a slot
+    'admin': 60,
+    'business': 45,
+    'pro': 30,
+    'starter': 15,
+    'free': 8,
+    'anonymous': 5,
+}
+
+LATENCY_SMOOTHING = 0.2      # EWMA weight of the newest call
+BASELINE_DRIFT = 0.02        # How fast the baseline follows a lasting change in latency
+LATENCY_TOLERANCE = 2.0      # Smoothed latency above baseline x this counts as congestion
+BACKOFF = 0.75               # Limit multiplier on congestion or upstream errors
+DEFAULT_RETRY_AFTER = 5
+
+
+def is_congestion(exc):
+    # Only an upstream that is slow or overloaded should shrink the limit
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    if status is not None:
+        return status >= 500 or status == 429
+    return isinstance(exc, TimeoutError) or any(word in type(exc).__name__ for word in ('Timeout', 'Connection'))
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"AI capacity exhausted ({reason})")
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class _Waiter:
+    __slots__ = ('priority', 'seq', 'user', 'plan', 'event', 'granted', 'evicted')
+
+    def __init__(self, priority, seq, user, plan):
+        self.priority, self.seq, self.user, self.plan = priority, seq, user, plan
+        self.event = threading.Event()
+        self.granted = False
+        self.evicted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AIScheduler:
+    def __init__(self, max_concurrency=AI_MAX_CONCURRENCY, min_concurrency=AI_MIN_CONCURRENCY,
+                 initial_concurrency=AI_INITIAL_CONCURRENCY, per_user=AI_PER_USER_CONCURRENCY,
+                 queue_max=AI_QUEUE_MAX, thread_budget=AI_THREAD_BUDGET):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.per_user = max(1, per_user)
+        self.queue_max = queue_max
+        self.thread_budget = thread_budget
+        self.latency = None          # Smoothed seconds per call
+        self.baseline = None         # Latency when OpenRouter is healthy
+        self.in_flight = 0
+        self.by_user = {}
+        self._queue = []             # Heap of _Waiter; granted/evicted ones are dropped lazily
+        self._queued = 0
+        self._seq = itertools.count()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        metrics.AI_CONCURRENCY_LIMIT.set(int(self.limit))
+
+    @contextmanager
+    def slot(self, user, plan):
+        plan = plan if plan in PRIORITIES else 'free'
+        waited = self._acquire(user, plan)
+        metrics.AI_QUEUE_WAIT.labels(plan).observe(waited)
+        started = time.monotonic()
+        outcome = 'ok'
+        try:
+            yield
+        except Exception as e:
+            outcome = 'congested' if is_congestion(e) else 'error'
+            raise
+        finally:
+            self._release(user, time.monotonic() - started, outcome)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'queued': self._queued,
+                'latency': self.latency,
+                'baseline': self.baseline,
+            }
+
+    # --- Admission ---
+
+    def _acquire(self, user, plan):
+        priority = PRIORITIES[plan]
+        deadline = QUEUE_DEADLINES[plan]
+        with self._lock:
+            if not self._queued and self._has_room(user):
+                self._take(user)
+                return 0.0
+
+            estimate = self._estimated_wait(priority)
+            if estimate > deadline:
+                self._shed(plan, 'deadline', estimate)
+            if self._queue_full() and not self._evict_below(priority):
+                self._shed(plan, 'queue_full', estimate)
+
+            waiter = _Waiter(priority, next(self._seq), user, plan)
+            heapq.heappush(self._queue, waiter)
+            self._queued += 1
+            metrics.AI_QUEUED.inc()
+            # Free slots may be held back only by other queued users' caps
+            self._dispatch()
+
+        started = time.monotonic()
+        waiter.event.wait(deadline)
+        with self._lock:
+            if waiter.granted:
+                return time.monotonic() - started
+            if not waiter.evicted:
+                waiter.evicted = True
+                self._queued -= 1
+                metrics.AI_QUEUED.dec()
+                self._shed(plan, 'timeout', self._estimated_wait(priority))
+            self._shed(plan, 'evicted', self._estimated_wait(priority))
+
+    def _queue_full(self):
+        return self._queued >= self.queue_max or self.in_flight + self._queued >= self.thread_budget
+
+    def _has_room(self, user):
+        return self.in_flight < int(self.limit) and self.by_user.get(user, 0) < self.per_user
+
+    def _take(self, user):
+        self.in_flight += 1
+        self.by_user[user] = self.by_user.get(user, 0) + 1
+        metrics.AI_SLOTS_IN_USE.inc()
+
+    def _estimated_wait(self, priority):
+        # Callers at this priority or better go first; each slot clears one per `latency`
+        ahead = sum(1 for w in self._queue if not (w.granted or w.evicted) and w.priority <= priority)
+        return (ahead + 1) * (self.latency or DEFAULT_RETRY_AFTER) / max(int(self.limit), 1)
+
+    def _evict_below(self, priority):
+        # Makes room by turning away the lowest-priority, most recent waiter below `priority`
+        victims = [w for w in self._queue if not (w.granted or w.evicted) and w.priority > priority]
+        if not victims:
+            return False
+        victim = max(victims)
+        victim.evicted = True
+        self._queued -= 1
+        metrics.AI_QUEUED.dec()
+        victim.event.set()
+        return True
+
+    def _shed(self, plan, reason, estimate):
+        metrics.AI_SHED.labels(plan, reason).inc()
+        retry_after = min(max(estimate, self.latency or DEFAULT_RETRY_AFTER), 60)
+        raise Overloaded(reason, retry_after)
+
+    # --- Completion ---
+
+    def _release(self, user, seconds, outcome):
+        with self._lock:
+            self.in_flight -= 1
+            if self.by_user.get(user, 0) <= 1:
+                self.by_user.pop(user, None)
+            else:
+                self.by_user[user] -= 1
+            metrics.AI_SLOTS_IN_USE.dec()
+            self._adapt(seconds, outcome)
+            self._dispatch()
+
+    def _adapt(self, seconds, outcome):
+        now = time.monotonic()
+        limit = self.limit
+        if outcome == 'error':
+            # Says nothing about upstream capacity (and its latency isn't a real call's)
+            return
+        if outcome == 'congested':
+            congested = True
+        else:
+            self.latency = seconds if self.latency is None else \
+                self.latency + LATENCY_SMOOTHING * (seconds - self.latency)
+            if self.baseline is None or self.latency < self.baseline:
+                self.baseline = self.latency
+            else:
+                self.baseline += BASELINE_DRIFT * (self.latency - self.baseline)
+            congested = self.latency > self.baseline * LATENCY_TOLERANCE
+
+        if congested:
+            # At most one cut per round trip, so one slow burst doesn't collapse the limit
+            if now - self._last_decrease >= (self.latency or 0):
+                self.limit = max(self.min_concurrency, self.limit * BACKOFF)
+                self._last_decrease = now
+        elif self.in_flight + 1 >= int(self.limit) or self._queued:
+            # Only grow a limit that is actually being used
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+        if int(limit) != int(self.limit):
+            metrics.AI_CONCURRENCY_LIMIT.set(int(self.limit))
+            print(f"AI concurrency limit {int(limit)} -> {int(self.limit)} "
+                  f"(latency {self.latency or 0:.2f}s, baseline {self.baseline or 0:.2f}s)")
+
+    def _dispatch(self):
+        # Hands free slots to waiters in priority order, skipping users at their cap
+        skipped = []
+        while self._queue and self.in_flight < int(self.limit):
+            waiter = heapq.heappop(self._queue)
+            if waiter.granted or waiter.evicted:
+                continue
+            if self.by_user.get(waiter.user, 0) >= self.per_user:
+                skipped.append(waiter)
+                continue
+            self._take(waiter.user)
+            waiter.granted = True
+            self._queued -= 1
+            metrics.AI_QUEUED.dec()
+            waiter.event.set()
+        for waiter in skipped:
+            heapq.heappush(self._queue, waiter)
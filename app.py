@@ -1,12 +1,22 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_from_directory, Response, abort
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_from_directory, send_file, Response, abort, stream_with_context, g
 import sqlite3
 import random
 import os
+import re
+import html
 import json
+import csv
+import io
+import zlib
+import tempfile
+import hmac
+import hashlib
 import time
-import requests
+import threading
+import mimetypes
+from urllib.parse import quote
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, safe_join
 from functools import wraps
 
 import firebase_admin
@@ -17,13 +27,32 @@ import cloudinary.uploader
 from cloudinary.utils import cloudinary_url
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from datetime import timedelta
+from datetime import datetime, timedelta
 from flask_talisman import Talisman
 from dotenv import load_dotenv
 
-# Load environment variables at the very beginning
+# Load environment variables at the very beginning: the local modules below read
+# their settings (FIREBASE_CERT_URL, RECEIPT_*, AI_*, ...) when they are imported
 load_dotenv()
 
+from firebase_tokens import FirebaseTokenVerifier, CertificatesUnavailable
+from shared_state import SharedStateStore
+import http_client
+from receipts import InvalidReceipt, ReceiptUploader, stage_receipt
+from static_assets import AssetManifest
+from compression import Compression
+from page_cache import AnonymousPageCache, deploy_timestamp
+from lifecycle import ProcessLocal, startup
+import metrics
+from profiler import SamplingProfiler
+import query_log
+from ai_cassette import Cassette
+from idempotency import IdempotencyStore, SQLITE_SCHEMA as IDEMPOTENCY_SCHEMA
+from ai_scheduler import AIScheduler, Overloaded
+from ai_policy import AI_POLICY_FILE, PolicyTable, UsageLedger, SQLITE_SCHEMA as AI_USAGE_SCHEMA
+import token_budget
+from token_budget import InputTooLarge
+
 # Universal Project Root (For VPS absolute paths)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -84,14 +113,33 @@ csp = {
 }
 # VPS Ready: Detect if HTTPS should be forced (off for local testing, on for VPS with SSL)
 force_https = os.getenv('FORCE_HTTPS', 'False').lower() == 'true'
-Talisman(app, content_security_policy=csp, force_https=force_https)
+Talisman(app, content_security_policy=csp, force_https=force_https,
+         session_cookie_secure=app.config['SESSION_COOKIE_SECURE'])
+
+# Shared state across gunicorn workers (rate limits, PIN lockouts)
+SHARED_STATE_DB = os.getenv('SHARED_STATE_DB', os.path.join(BASE_DIR, 'shared_state.db'))
+shared_state = SharedStateStore(SHARED_STATE_DB)
+query_log.init(shared_state)
+
+# Prometheus metrics (registered before compression so its time is included)
+metrics.init_app(app)
 
-# Rate Limiting
+# On-demand request profiler, toggled from /admin/profiler (idle unless switched on)
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+# X-Profile is honoured for the same clients as /metrics (allowlisted IPs, PIN-verified admins)
+profiler = SamplingProfiler(PROFILE_DIR, shared_state, trusted_client=lambda: metrics_client_allowed())
+profiler.init_app(app)
+
+# Response compression (brotli/gzip negotiated per request, tunable per route)
+compression = Compression(app)
+
+# Rate Limiting (counters live in the shared SQLite store unless overridden, e.g. redis://)
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'True').lower() == 'true'
 limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
+    storage_uri=os.getenv('RATELIMIT_STORAGE_URI', f"sqlite:///{SHARED_STATE_DB}")
 )
 
 # Cloudinary Configuration
@@ -101,22 +149,74 @@ cloudinary.config(
     api_secret = os.getenv('CLOUDINARY_API_SECRET'),
     secure = True
 )
+# Fingerprinted static assets (built by `python static_assets.py` on deploy)
+asset_manifest = AssetManifest()
+asset_manifest.init_app(app)
+limiter.exempt(app.view_functions['fingerprinted_asset'])
+
+# Anonymous landing/auth pages are rendered once per worker and served from memory
+# (set PAGE_CACHE_TTL=0 to disable). Logged-in visitors carry a session cookie and bypass it.
+PAGE_CACHE_PATHS = ['/', '/login', '/register', '/sitemap.xml']
+PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 300))
+if PAGE_CACHE_TTL > 0:
+    page_cache = AnonymousPageCache(
+        app.wsgi_app,
+        PAGE_CACHE_PATHS,
+        session_cookie_name=app.config.get('SESSION_COOKIE_NAME', 'session'),
+        deploy_time=deploy_timestamp(os.path.abspath(__file__), os.path.join(BASE_DIR, 'templates'),
+                                     os.path.join(asset_manifest.dist_dir, 'asset-manifest.json')),
+        ttl=PAGE_CACHE_TTL
+    )
+    app.wsgi_app = page_cache
+
 app.secret_key = os.getenv('SECRET_KEY', 'default_secret_key_for_dev_only')
 app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, 'uploads')
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Initialize Firebase (Using Absolute Path)
 service_account_path = os.path.join(BASE_DIR, 'serviceAccountKey.json')
-cred = credentials.Certificate(service_account_path)
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+with startup.timed('firebase credentials'):
+    cred = credentials.Certificate(service_account_path)
+    firebase_admin.initialize_app(cred)
+# gRPC channels aren't fork-safe: each worker opens its own Firestore client on first use
+db = ProcessLocal('firestore', firestore.client)
+FIRESTORE_HOST = 'firestore.googleapis.com'  # Label for http_client.track() around Firestore calls
+
+# Local ID-token verification (certs cached on disk, refreshed in the background)
+token_verifier = FirebaseTokenVerifier(
+    project_id=getattr(cred, 'project_id', None) or os.getenv('GOOGLE_CLOUD_PROJECT'),
+    cache_path=os.getenv('FIREBASE_CERT_CACHE', os.path.join(tempfile.gettempdir(), 'manager-ai-firebase-certs.json'))
+)
 
 # Database setup (Using Absolute Path)
-DB_NAME = os.path.join(BASE_DIR, 'content_ideas.db')
+DB_NAME = os.getenv('DATABASE_PATH', os.path.join(BASE_DIR, 'content_ideas.db'))
+
+# DATABASE_URL=postgresql://... moves the data to PostgreSQL (pg_database.py) so
+# several app nodes can share it; psycopg is only needed in that case.
+DATABASE_URL = os.getenv('DATABASE_URL', '')
+if DATABASE_URL.startswith(('postgres://', 'postgresql://')):
+    from pg_database import PostgresDatabase
+    pg = PostgresDatabase(DATABASE_URL)
+    DB_ERRORS = (sqlite3.Error, PostgresDatabase.Error)
+else:
+    pg = None
+    DB_ERRORS = (sqlite3.Error,)
+
+def connect_db():
+    # Every statement is timed (metrics) and slow ones land in the /admin/queries report
+    if pg:
+        return pg.connect()
+    return query_log.connect(DB_NAME, timeout=10)
+
+# Retried generate/payment calls carrying the same Idempotency-Key replay the first response
+idempotency = IdempotencyStore(connect_db)
 
 def init_db():
+    if pg:
+        print(f"Initializing database: {pg.display_url}...")
+        pg.init_schema()
+        return
     print(f"Initializing database: {DB_NAME}...")
-    conn = sqlite3.connect(DB_NAME, timeout=10)
+    conn = connect_db()
     c = conn.cursor()
     # User table
     c.execute('''CREATE TABLE IF NOT EXISTS users
@@ -155,6 +255,23 @@ def init_db():
         except Exception as e:
             print(f"Migration warning: {e}")
 
+    # Columns used by history search (mode, Firestore doc link, soft-delete flag)
+    c.execute("PRAGMA table_info(ideas)")
+    idea_columns = [column[1] for column in c.fetchall()]
+    idea_migrations = [
+        ('mode', "ALTER TABLE ideas ADD COLUMN mode TEXT DEFAULT 'idea'"),
+        ('doc_id', "ALTER TABLE ideas ADD COLUMN doc_id TEXT"),
+        ('hidden', "ALTER TABLE ideas ADD COLUMN hidden BOOLEAN DEFAULT 0")
+    ]
+    for col_name, alter_stmt in idea_migrations:
+        if col_name not in idea_columns:
+            try:
+                c.execute(alter_stmt)
+            except Exception as e:
+                print(f"Migration warning (ideas - {col_name}): {e}")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ideas_doc_id ON ideas(doc_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ideas_user_id ON ideas(user_id, id)")
+
     # Check for columns in users table
     c.execute("PRAGMA table_info(users)")
     user_columns = [column[1] for column in c.fetchall()]
@@ -219,20 +336,187 @@ def init_db():
             except Exception as e:
                 print(f"Migration warning (payment_requests - {col_name}): {e}")
 
+    # Paystack payments keyed by reference (idempotent plan activation)
+    c.execute('''CREATE TABLE IF NOT EXISTS payment_events
+                 (reference TEXT PRIMARY KEY,
+                  user_id INTEGER,
+                  plan_type TEXT,
+                  amount INTEGER,
+                  status TEXT DEFAULT 'pending',
+                  source TEXT,
+                  payload TEXT,
+                  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                  processed_at DATETIME,
+                  FOREIGN KEY(user_id) REFERENCES users(id))''')
+
+    init_admin_events(c)
+    init_search_index(c)
+    for statement in IDEMPOTENCY_SCHEMA + AI_USAGE_SCHEMA:
+        c.execute(statement)
+
+    # Failed calls are in the AI usage ledger since it gained an error column
+    c.execute("PRAGMA table_info(ai_usage)")
+    if 'error' not in [column[1] for column in c.fetchall()]:
+        try:
+            c.execute("ALTER TABLE ai_usage ADD COLUMN error TEXT")
+        except Exception as e:
+            print(f"Migration warning (ai_usage - error): {e}")
+
     conn.commit()
     conn.close()
 
+def init_admin_events(c):
+    # Append-only change log for the live admin queue. Triggers record every new
+    # submission/payment request and every submission status change, whichever
+    # code path made it, so the SSE feed only has to poll `id > last_seen`.
+    c.execute('''CREATE TABLE IF NOT EXISTS admin_events
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  kind TEXT NOT NULL,
+                  ref_id INTEGER,
+                  payload TEXT,
+                  created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+
+    c.execute('''CREATE TRIGGER IF NOT EXISTS admin_events_submission_insert AFTER INSERT ON submissions BEGIN
+                     INSERT INTO admin_events (kind, ref_id, payload) VALUES ('submission_created', new.id,
+                         json_object('id', new.id, 'username', new.username, 'full_name', new.full_name,
+                                     'plan_type', new.plan_type, 'screenshot_path', new.screenshot_path,
+                                     'status', new.status, 'timestamp', new.timestamp));
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS admin_events_submission_update AFTER UPDATE OF status, screenshot_path ON submissions
+                 WHEN new.status IS NOT old.status OR new.screenshot_path IS NOT old.screenshot_path BEGIN
+                     INSERT INTO admin_events (kind, ref_id, payload) VALUES ('submission_updated', new.id,
+                         json_object('id', new.id, 'status', new.status, 'screenshot_path', new.screenshot_path));
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS admin_events_payment_request_insert AFTER INSERT ON payment_requests BEGIN
+                     INSERT INTO admin_events (kind, ref_id, payload) VALUES ('payment_request_created', new.id,
+                         json_object('id', new.id, 'username', new.username, 'plan_type', new.plan_type,
+                                     'preferred_method', new.preferred_method, 'contact_method', new.contact_method,
+                                     'contact_info', new.contact_info, 'timestamp', new.timestamp));
+                 END''')
+
+    # Clients only ever need recent events
+    c.execute("DELETE FROM admin_events WHERE created_at < datetime('now', '-2 days')")
+
+def init_search_index(c):
+    # FTS5 index over generated content. Kept in sync by triggers on `ideas`, so
+    # every insert/delete/hide is indexed incrementally inside the same transaction.
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'ideas_fts'")
+    is_new = c.fetchone() is None
+
+    c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS ideas_fts USING fts5(
+                     idea_content,
+                     business_type,
+                     mode UNINDEXED,
+                     user_id UNINDEXED,
+                     timestamp UNINDEXED,
+                     tokenize = 'unicode61 remove_diacritics 2')''')
+
+    c.execute('''CREATE TRIGGER IF NOT EXISTS ideas_fts_insert AFTER INSERT ON ideas
+                 WHEN COALESCE(new.hidden, 0) = 0 BEGIN
+                     INSERT INTO ideas_fts (rowid, idea_content, business_type, mode, user_id, timestamp)
+                     VALUES (new.id, new.idea_content, new.business_type, new.mode, new.user_id, new.timestamp);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS ideas_fts_delete AFTER DELETE ON ideas BEGIN
+                     DELETE FROM ideas_fts WHERE rowid = old.id;
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS ideas_fts_hide AFTER UPDATE OF hidden ON ideas
+                 WHEN new.hidden = 1 AND COALESCE(old.hidden, 0) = 0 BEGIN
+                     DELETE FROM ideas_fts WHERE rowid = old.id;
+                 END''')
+
+    if is_new:
+        # One-off backfill of rows generated before the index existed
+        c.execute('''INSERT INTO ideas_fts (rowid, idea_content, business_type, mode, user_id, timestamp)
+                     SELECT id, idea_content, business_type, COALESCE(mode, 'idea'), user_id, timestamp
+                     FROM ideas WHERE COALESCE(hidden, 0) = 0''')
+        print(f"Search index built ({c.rowcount} items).")
+
 from openai import OpenAI
 # load_dotenv() moved to top
 
 # --- REAL AI INTEGRATION ---
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv("OPENAI_API_KEY")
-)
+# Any OpenAI-compatible endpoint works (e.g. the bench/ stand-in server)
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', 'https://openrouter.ai/api/v1')
+
+def create_ai_client():
+    return OpenAI(
+        base_url=OPENROUTER_BASE_URL,
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=http_client.build_httpx_client('openrouter'),
+        timeout=http_client.httpx_timeout('openrouter'),
+        max_retries=2
+    )
+
+# Built per worker on first use (its httpx connection pool must not cross a fork)
+client = ProcessLocal('openai', create_ai_client)
+
+# Record/replay of AI calls (see ai_cassette.py): off | record | replay
+AI_CASSETTE_MODE = os.getenv('AI_CASSETTE_MODE', 'off').lower()
+AI_CASSETTE_PATH = os.getenv('AI_CASSETTE_PATH', os.path.join(BASE_DIR, 'cassettes'))
+ai_cassette = Cassette(AI_CASSETTE_MODE, AI_CASSETTE_PATH,
+                       speed=float(os.getenv('AI_CASSETTE_SPEED', 0)),
+                       match=os.getenv('AI_CASSETTE_MATCH', 'exact').lower())
+if ai_cassette.enabled:
+    print(f"AI cassette: {AI_CASSETTE_MODE} ({AI_CASSETTE_PATH})")
+
+# Model, max_tokens and temperature per (mode, plan), and the usage ledger (ai_policy.py)
+ai_policies = PolicyTable.from_file(AI_POLICY_FILE)
+ai_usage = UsageLedger(connect_db)
+AI_EXTRA_HEADERS = {
+    "HTTP-Referer": "http://localhost:5000",
+    "X-Title": "ContentIdeaApp",
+}
+
+# Plan-priority queueing, per-user caps and load shedding for model calls (ai_scheduler.py)
+ai_scheduler = AIScheduler()
+
+def ai_caller():
+    # Who a model call is queued for: the user and plan (generate_content sets the
+    # fresh plan in g.ai_plan), or the client IP for the anonymous support chat
+    if 'user_id' in session:
+        plan = 'admin' if session.get('is_admin') else session.get('plan_type') or 'free'
+        return session['user_id'], g.get('ai_plan', plan)
+    return get_remote_address(), 'anonymous'
 
 class AI_Engine:
+    def _complete(self, mode, messages):
+        # Every model call goes through here (and the cassette, when one is active)
+        user, plan = ai_caller()
+        policy = ai_policies.resolve(mode, plan)
+        # Oversized prompts are refused here, before they cost a queue slot or an upstream call
+        prompt_tokens = token_budget.check_prompt(mode, messages, policy.max_tokens)
+        request = {'model': policy.model, 'messages': messages, 'max_tokens': policy.max_tokens,
+                   'temperature': policy.temperature, 'extra_headers': AI_EXTRA_HEADERS}
+        started = result = error = None
+        try:
+            with ai_scheduler.slot(user, plan):
+                started = time.perf_counter()
+                # Resolved lazily so replay never builds the OpenAI client
+                result = ai_cassette.complete(lambda **kwargs: client.chat.completions.create(**kwargs), request)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            # Failed calls are recorded too; calls the scheduler turned away never reached upstream
+            if started is not None:
+                ai_usage.record(session.get('user_id'), plan, mode, policy, result,
+                                time.perf_counter() - started, error=error, prompt_estimate=prompt_tokens)
+        return result['content']
+
     def generate(self, business_type, platform, mood, goal, people, language, existing_ideas, location=None, refinement=None, previous_idea=None, brand_tone=None, mode='idea'):
+        # User-supplied text is held to the mode's token budgets (token_budget.py)
+        business_type = token_budget.fit(mode, 'business_type', business_type)
+        platform = token_budget.fit(mode, 'platform', platform)
+        mood = token_budget.fit(mode, 'mood', mood)
+        goal = token_budget.fit(mode, 'goal', goal)
+        people = token_budget.fit(mode, 'people', people)
+        language = token_budget.fit(mode, 'language', language)
+        location = token_budget.fit(mode, 'location', location)
+        refinement = token_budget.fit(mode, 'refinement', refinement)
+        previous_idea = token_budget.fit(mode, 'previous_idea', previous_idea)
+        brand_tone = token_budget.fit(mode, 'brand_tone', brand_tone)
+        existing_ideas = token_budget.fit_list(mode, 'past_ideas', existing_ideas)
+
         # Determine language style
         lang_instruction = "SPEAK IN VERY SIMPLE, BEGINNER ENGLISH (A1/A2 level). Use short sentences. Use simple words. No big grammar."
         if language == 'pidgin':
@@ -372,23 +656,19 @@ class AI_Engine:
             """
         
         try:
-            response = client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": "http://localhost:5000",
-                    "X-Title": "ContentIdeaApp",
-                },
-                model="google/gemini-2.0-flash-001",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ]
-            )
-            return response.choices[0].message.content.strip()
+            return self._complete(mode, [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]).strip()
+        except (Overloaded, InputTooLarge):
+            raise
         except Exception as e:
             print(f"AI API Error: {e}")
             return f"A {mood} video showcasing your {business_type} to help {goal}. (Backup: AI service temporarily unavailable)"
 
     def analyze_viral(self, link, platform, language):
+        link = token_budget.fit('viral_analyzer', 'link', link)
+        platform = token_budget.fit('viral_analyzer', 'platform', platform)
         system_prompt = "You are a Viral Content Analyst. Break down why a specific video link went viral based on the content description or platform context provided."
         user_prompt = f"""
         Analyzing a video from {platform}. 
@@ -413,18 +693,21 @@ class AI_Engine:
         3. [Actionable way 3]
         """
         try:
-            response = client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ]
-            )
-            return response.choices[0].message.content.strip()
+            return self._complete('viral_analyzer', [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]).strip()
+        except (Overloaded, InputTooLarge):
+            raise
         except Exception as e:
             return "Unable to analyze link at this time."
 
     def scan_competitor(self, competitor_handle, platform, language, brand_tone=None, user_business=None, competitor_niche=None):
+        competitor_handle = token_budget.fit('competitor_scanner', 'handle', competitor_handle)
+        brand_tone = token_budget.fit('competitor_scanner', 'brand_tone', brand_tone)
+        user_business = token_budget.fit('competitor_scanner', 'business_type', user_business)
+        competitor_niche = token_budget.fit('competitor_scanner', 'niche', competitor_niche)
+        platform = token_budget.fit('competitor_scanner', 'platform', platform)
         system_prompt = "You are a Competitive Intelligence Lead at a top-tier marketing agency. You specialize in 'Gap Analysis'—finding where competitors are failing so your client can win."
         
         user_context = f"Our Client's Business: {user_business or 'Similar niche'}"
@@ -460,18 +743,20 @@ class AI_Engine:
         Remember: Use clear, simple language.
         """
         try:
-            response = client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ]
-            )
-            return response.choices[0].message.content.strip()
+            return self._complete('competitor_scanner', [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]).strip()
+        except (Overloaded, InputTooLarge):
+            raise
         except Exception as e:
             return "Unable to scan competitor at this time."
 
     def score_content(self, content_body, content_type, platform, language):
+        # Scoring a trimmed post would score a different post: too long is rejected
+        content_body = token_budget.fit('content_scorer', 'content', content_body)
+        content_type = token_budget.fit('content_scorer', 'content_type', content_type)
+        platform = token_budget.fit('content_scorer', 'platform', platform)
         system_prompt = "You are a Content Auditor. Score social media content objectively."
         user_prompt = f"""
         Content to Score ({content_type}): "{content_body}"
@@ -490,18 +775,20 @@ class AI_Engine:
         3. [Suggestion 3]
         """
         try:
-            response = client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ]
-            )
-            return response.choices[0].message.content.strip()
+            return self._complete('content_scorer', [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]).strip()
+        except (Overloaded, InputTooLarge):
+            raise
         except Exception as e:
             return "Unable to score content right now."
 
     def generate_weekly_plan(self, business_type, platform, language, location=None, brand_tone=None):
+        business_type = token_budget.fit('weekly_plan', 'business_type', business_type)
+        location = token_budget.fit('weekly_plan', 'location', location)
+        brand_tone = token_budget.fit('weekly_plan', 'brand_tone', brand_tone)
+        platform = token_budget.fit('weekly_plan', 'platform', platform)
         lang_instruction = "Use simple English."
         if language == 'pidgin':
             lang_instruction = "Use Naija Pidgin Style."
@@ -523,18 +810,18 @@ class AI_Engine:
     """
         
         try:
-            response = client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ]
-            )
-            return response.choices[0].message.content.strip()
+            return self._complete('weekly_plan', [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]).strip()
+        except (Overloaded, InputTooLarge):
+            raise
         except Exception as e:
             return "Unable to generate weekly plan right now."
 
     def optimize_cta(self, current_content, platform, language, brand_tone=None):
+        current_content = token_budget.fit('optimize_cta', 'content', current_content)
+        brand_tone = token_budget.fit('optimize_cta', 'brand_tone', brand_tone)
         system_prompt = f"You are a Copywriting Expert. Your job is to rewrite the Call to Action (CTA) of a post to increase sales. Use {language}."
         if brand_tone:
             system_prompt += f" Brand Tone: {brand_tone}"
@@ -542,18 +829,18 @@ class AI_Engine:
         user_prompt = f"Here is the content: '{current_content}'. Platform: {platform}. Give me 3 high-converting versions of a CTA for this. Format as a clean bulleted list using Markdown."
         
         try:
-            response = client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ]
-            )
-            return response.choices[0].message.content.strip()
+            return self._complete('optimize_cta', [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]).strip()
+        except (Overloaded, InputTooLarge):
+            raise
         except Exception as e:
             return "Unable to optimize CTA right now."
 
     def rewrite_hook(self, current_content, platform, language, brand_tone=None):
+        current_content = token_budget.fit('rewrite_hook', 'content', current_content)
+        brand_tone = token_budget.fit('rewrite_hook', 'brand_tone', brand_tone)
         system_prompt = f"You are a Viral Content Specialist. Rewrite the 'Hook' (first 3 seconds/lines) of this content to stop people from scrolling. Use {language}."
         if brand_tone:
             system_prompt += f" Brand Tone: {brand_tone}"
@@ -561,14 +848,12 @@ class AI_Engine:
         user_prompt = f"Content: '{current_content}'. Platform: {platform}. Give me 3 viral hooks for this. Format as a clean numbered list using Markdown."
         
         try:
-            response = client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt},
-                ]
-            )
-            return response.choices[0].message.content.strip()
+            return self._complete('rewrite_hook', [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]).strip()
+        except (Overloaded, InputTooLarge):
+            raise
         except Exception as e:
             return "Unable to rewrite hooks right now."
 
@@ -586,17 +871,23 @@ class AI_Engine:
         - Payment: gtbank Card/Transfer then upload receipt.
         """
         
+        user_question = token_budget.fit('support', 'question', user_question)
         messages = [{"role": "system", "content": system_prompt}]
+        # Client-supplied: only well-formed user/assistant turns, and nothing but role and content
+        history = [m for m in history if isinstance(m, dict) and m.get('role') in ('user', 'assistant')
+                   and isinstance(m.get('content'), str)] if isinstance(history, list) else []
         if history:
-            messages.extend(history[-10:])
+            history = history[-10:]
+            # Older turns are dropped first once the history outgrows its budget
+            contents = token_budget.fit_list('support', 'history', [m['content'] for m in history])
+            history = history[len(history) - len(contents):]
+            messages.extend({'role': m['role'], 'content': content} for m, content in zip(history, contents))
         messages.append({"role": "user", "content": user_question})
         
         try:
-            response = client.chat.completions.create(
-                model="google/gemini-2.0-flash-001",
-                messages=messages
-            )
-            return response.choices[0].message.content.strip()
+            return self._complete('support', messages).strip()
+        except (Overloaded, InputTooLarge):
+            raise
         except Exception as e:
             return "Hi there! I'm having a small technical issue. DM @rae__hub if urgent."
 ai_engine = AI_Engine()
@@ -614,10 +905,15 @@ def login_required(f):
 
 app.secret_key = os.getenv('SECRET_KEY', 'default_dev_key')
 PAYSTACK_SECRET_KEY = os.getenv('PAYSTACK_SECRET_KEY')
+PAYSTACK_BASE_URL = os.getenv('PAYSTACK_BASE_URL', 'https://api.paystack.co')
+PAYSTACK_PLANS = {
+    'starter': 500000,   # 5000 * 100 kobo
+    'pro': 2500000,      # 25000 * 100
+    'business': 7500000  # 75000 * 100
+}
 # app.config['UPLOAD_FOLDER'] already set at top
 
-# PIN Rate Limiter
-PIN_ATTEMPTS = {}  # {user_id: [timestamp, count]}
+# PIN Rate Limiter (failed attempts are counted in shared_state, expiring 5 min after the last one)
 PIN_LOCKOUT_TIME = 300  # 5 minutes
 MAX_PIN_ATTEMPTS = 5
 
@@ -642,18 +938,13 @@ def admin_login():
         return redirect(url_for('dashboard'))
         
     user_id = session['user_id']
-    current_time = time.time()
+    attempts_key = f"admin_pin:{user_id}"
     
-    # Check lockout
-    if user_id in PIN_ATTEMPTS:
-        last_time, count = PIN_ATTEMPTS[user_id]
-        if count >= MAX_PIN_ATTEMPTS:
-            if current_time - last_time < PIN_LOCKOUT_TIME:
-                flash(f'Too many attempts. Please wait {int((PIN_LOCKOUT_TIME - (current_time - last_time)) / 60)} minutes.')
-                return render_template('admin_login.html')
-            else:
-                # Reset after lockout expires
-                PIN_ATTEMPTS[user_id] = [current_time, 0]
+    # Check lockout (shared by all workers; expires on its own)
+    if shared_state.get(attempts_key) >= MAX_PIN_ATTEMPTS:
+        remaining = shared_state.get_expiry(attempts_key) - time.time()
+        flash(f'Too many attempts. Please wait {int(remaining / 60)} minutes.')
+        return render_template('admin_login.html')
 
     if request.method == 'POST':
         pin = request.form.get('pin', '').strip()
@@ -668,27 +959,25 @@ def admin_login():
         if pin == correct_pin:
             session['admin_authenticated'] = True
             # Clear attempts on success
-            if user_id in PIN_ATTEMPTS:
-                del PIN_ATTEMPTS[user_id]
+            shared_state.clear(attempts_key)
             return redirect(url_for('admin_dashboard'))
         else:
-            # Increment attempts
-            if user_id in PIN_ATTEMPTS:
-                PIN_ATTEMPTS[user_id] = [current_time, PIN_ATTEMPTS[user_id][1] + 1]
-            else:
-                PIN_ATTEMPTS[user_id] = [current_time, 1]
+            # Increment attempts (each failure restarts the lockout window)
+            shared_state.incr(attempts_key, PIN_LOCKOUT_TIME, elastic_expiry=True)
                 
             flash('Incorrect Admin PIN')
             
     return render_template('admin_login.html')
 
 @app.route('/')
+@compression.options(gzip_level=9, br_quality=11)  # Rendered once, then served from the page cache
 def intro():
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
     return render_template('intro.html')
 
 @app.route('/login', methods=['GET', 'POST'])
+@compression.options(gzip_level=9, br_quality=11)
 @limiter.limit("10 per minute")
 def login():
     if 'user_id' in session:
@@ -701,17 +990,13 @@ def login():
             return jsonify({"error": "No token provided"}), 400
         
         try:
-            # Verify Firebase Token with Retry for network issues
-            decoded_token = None
-            for attempt in range(3):
-                try:
-                    # check_revoked=False is faster and avoids one extra network call
-                    decoded_token = auth.verify_id_token(id_token, check_revoked=False)
-                    break
-                except Exception as e:
-                    if attempt == 2: raise e
-                    print(f"Auth attempt {attempt+1} failed: {e}. Retrying...")
-                    time.sleep(1)
+            # Verify Firebase Token locally against the cached Google certificates
+            try:
+                decoded_token = token_verifier.verify(id_token)
+            except CertificatesUnavailable as e:
+                # Cold cache (Google unreachable since boot): fall back to the SDK
+                print(f"Local token verification unavailable ({e}). Using Firebase SDK.")
+                decoded_token = auth.verify_id_token(id_token, check_revoked=False)
             
             uid = decoded_token['uid']
             email = decoded_token.get('email')
@@ -720,7 +1005,7 @@ def login():
             username = email.split('@')[0] if email else f"user_{uid[:6]}"
             
             # Sync with Local DB
-            conn = sqlite3.connect(DB_NAME, timeout=10)
+            conn = connect_db()
             c = conn.cursor()
             
             c.execute("SELECT id, is_subscribed, is_admin, plan_type FROM users WHERE username = ?", (username,))
@@ -756,7 +1041,7 @@ def login():
                 session['plan_type'] = 'business'
             
             # Ensure DB reflects this (self-correcting security & access)
-            conn = sqlite3.connect(DB_NAME, timeout=10)
+            conn = connect_db()
             c = conn.cursor()
             
             # 1. Update Admin status
@@ -793,6 +1078,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@compression.options(gzip_level=9, br_quality=11)
 def register():
     if 'user_id' in session:
         return redirect(url_for('dashboard'))
@@ -803,13 +1089,16 @@ def register():
 @app.route('/logout')
 def logout():
     session.clear()
-    return redirect(url_for('intro'))
+    response = redirect(url_for('intro'))
+    # Drops anything a browser cached while logged in (older service workers kept per-user pages)
+    response.headers['Clear-Site-Data'] = '"cache"'
+    return response
 
 @app.route('/dashboard')
 @login_required
 def dashboard():
     user_id = session['user_id']
-    conn = sqlite3.connect(DB_NAME, timeout=10)
+    conn = connect_db()
     c = conn.cursor()
     c.execute("SELECT plan_type, brand_tone FROM users WHERE id = ?", (user_id,))
     row = c.fetchone()
@@ -854,17 +1143,12 @@ def choose_plan(plan_name):
 
 @app.route('/api/pay/initialize/<plan_id>', methods=['POST'])
 @login_required
+@idempotency.idempotent
 def initialize_payment(plan_id):
     if not PAYSTACK_SECRET_KEY:
         return jsonify({'error': 'Payment gateway not configured'}), 500
         
-    plans = {
-        'starter': 500000,   # 5000 * 100 kobo
-        'pro': 2500000,      # 25000 * 100
-        'business': 7500000  # 75000 * 100
-    }
-    
-    amount = plans.get(plan_id.lower())
+    amount = PAYSTACK_PLANS.get(plan_id.lower())
     if not amount:
         return jsonify({'error': 'Invalid plan'}), 400
         
@@ -872,7 +1156,7 @@ def initialize_payment(plan_id):
     if not email:
         return jsonify({'error': 'User email not found'}), 400
         
-    url = "https://api.paystack.co/transaction/initialize"
+    url = f"{PAYSTACK_BASE_URL}/transaction/initialize"
     headers = {
         "Authorization": f"Bearer {PAYSTACK_SECRET_KEY}",
         "Content-Type": "application/json"
@@ -893,10 +1177,16 @@ def initialize_payment(plan_id):
     }
     
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = http_client.post('paystack', url, json=payload, headers=headers)
         res_data = response.json()
         
         if res_data.get('status'):
+            # Record the pending reference so the webhook/callback can trust our own data
+            conn = connect_db()
+            conn.execute("INSERT OR IGNORE INTO payment_events (reference, user_id, plan_type, amount) VALUES (?, ?, ?, ?)",
+                         (reference, session['user_id'], plan_id.lower(), amount))
+            conn.commit()
+            conn.close()
             return jsonify({
                 'authorization_url': res_data['data']['authorization_url'],
                 'reference': reference
@@ -906,34 +1196,124 @@ def initialize_payment(plan_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def activate_paid_plan(reference, user_id, plan_id, amount, source, payload=None):
+    # Idempotent: a reference activates a plan at most once, whichever of the
+    # webhook or the browser callback gets here first. Returns (user_id, plan_id)
+    # of the activated plan, or None if the payment doesn't check out.
+    conn = connect_db()
+    try:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT status, user_id, plan_type FROM payment_events WHERE reference = ?", (reference,))
+        row = c.fetchone()
+        if row and row[0] == 'success':
+            conn.rollback()
+            return row[1], row[2]
+
+        # Prefer what we recorded at initialization over the echoed metadata
+        if row and row[1]:
+            user_id, plan_id = row[1], row[2]
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            user_id = None
+        expected_amount = PAYSTACK_PLANS.get(plan_id)
+        if not user_id or not expected_amount or (amount or 0) < expected_amount:
+            print(f"Payment {reference} rejected: user={user_id} plan={plan_id} amount={amount}")
+            c.execute('''INSERT INTO payment_events (reference, user_id, plan_type, amount, status, source, payload)
+                         VALUES (?, ?, ?, ?, 'failed', ?, ?)
+                         ON CONFLICT(reference) DO UPDATE SET status = 'failed', source = excluded.source,
+                             payload = excluded.payload''',
+                      (reference, user_id, plan_id, amount, source, payload))
+            conn.commit()
+            return None
+
+        c.execute('''INSERT INTO payment_events (reference, user_id, plan_type, amount, status, source, payload, processed_at)
+                     VALUES (?, ?, ?, ?, 'success', ?, ?, CURRENT_TIMESTAMP)
+                     ON CONFLICT(reference) DO UPDATE SET status = 'success', amount = excluded.amount,
+                         source = excluded.source, payload = excluded.payload, processed_at = CURRENT_TIMESTAMP''',
+                  (reference, user_id, plan_id, amount, source, payload))
+        c.execute("UPDATE users SET is_subscribed = 1, subscription_start = CURRENT_TIMESTAMP, plan_type = ? WHERE id = ?", (plan_id, user_id))
+        conn.commit()
+        print(f"Payment {reference}: user {user_id} upgraded to {plan_id} via {source}.")
+        return user_id, plan_id
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@app.route('/api/pay/webhook', methods=['POST'])
+@limiter.exempt
+def paystack_webhook():
+    if not PAYSTACK_SECRET_KEY:
+        return jsonify({'error': 'Payment gateway not configured'}), 503
+
+    # Paystack signs the raw body with HMAC-SHA512 using our secret key
+    raw_body = request.get_data()
+    expected = hmac.new(PAYSTACK_SECRET_KEY.encode('utf-8'), raw_body, hashlib.sha512).hexdigest()
+    if not hmac.compare_digest(expected, request.headers.get('X-Paystack-Signature', '')):
+        return jsonify({'error': 'Invalid signature'}), 401
+
+    try:
+        event = json.loads(raw_body)
+    except ValueError:
+        return jsonify({'error': 'Invalid payload'}), 400
+
+    # Acknowledge everything else so Paystack doesn't keep retrying
+    if event.get('event') != 'charge.success':
+        return jsonify({'received': True})
+
+    data = event.get('data') or {}
+    reference = data.get('reference')
+    if not reference or data.get('status') != 'success':
+        return jsonify({'received': True})
+
+    metadata = data.get('metadata') or {}
+    try:
+        activate_paid_plan(reference, metadata.get('user_id'), metadata.get('plan_id'),
+                           data.get('amount'), 'webhook', raw_body.decode('utf-8', 'replace'))
+    except Exception as e:
+        # Non-2xx makes Paystack retry later
+        print(f"Paystack Webhook Error: {e}")
+        return jsonify({'error': 'Processing failed'}), 500
+    return jsonify({'received': True})
+
 @app.route('/api/pay/callback')
 def pay_callback():
     reference = request.args.get('reference')
     if not reference:
         flash("No payment reference found.")
         return redirect(url_for('pricing'))
-        
-    url = f"https://api.paystack.co/transaction/verify/{reference}"
-    headers = {
-        "Authorization": f"Bearer {PAYSTACK_SECRET_KEY}"
-    }
-    
+
     try:
-        response = requests.get(url, headers=headers)
-        res_data = response.json()
-        
-        if res_data.get('status') and res_data['data']['status'] == 'success':
-            metadata = res_data['data']['metadata']
-            user_id = metadata['user_id']
-            plan_id = metadata['plan_id']
-            
-            # Update user plan in DB
-            conn = sqlite3.connect(DB_NAME)
-            c = conn.cursor()
-            c.execute("UPDATE users SET is_subscribed = 1, subscription_start = CURRENT_TIMESTAMP, plan_type = ? WHERE id = ?", (plan_id, user_id))
-            conn.commit()
-            conn.close()
-            
+        # Normally the webhook has already activated the plan: no outbound call needed
+        conn = connect_db()
+        c = conn.cursor()
+        c.execute("SELECT status, user_id, plan_type FROM payment_events WHERE reference = ?", (reference,))
+        row = c.fetchone()
+        conn.close()
+
+        if row and row[0] == 'success':
+            activated = (row[1], row[2])
+        elif row and row[0] == 'failed':
+            activated = None
+        else:
+            # Webhook not in yet: verify directly (activation stays idempotent)
+            url = f"{PAYSTACK_BASE_URL}/transaction/verify/{reference}"
+            headers = {
+                "Authorization": f"Bearer {PAYSTACK_SECRET_KEY}"
+            }
+            response = http_client.get('paystack', url, headers=headers)
+            res_data = response.json()
+            activated = None
+            if res_data.get('status') and res_data['data']['status'] == 'success':
+                metadata = res_data['data'].get('metadata') or {}
+                activated = activate_paid_plan(reference, metadata.get('user_id'), metadata.get('plan_id'),
+                                               res_data['data'].get('amount'), 'callback')
+
+        if activated:
+            user_id, plan_id = activated
             # Refresh session plan type
             if session.get('user_id') == user_id:
                 session['is_subscribed'] = True
@@ -983,40 +1363,57 @@ def submit_payment():
 
     if file:
         try:
-            # Upload to Cloudinary
-            upload_result = cloudinary.uploader.upload(
-                file,
-                folder="manager_ai_payments/",
-                resource_type="image"
-            )
-            screenshot_url = upload_result.get('secure_url')
+            # Stage a downscaled copy locally; Cloudinary upload happens in the background
+            screenshot_file = stage_receipt(file, app.config['UPLOAD_FOLDER'])
             
             target_user_id = session['user_id']
             
-            conn = sqlite3.connect(DB_NAME, timeout=10)
+            conn = connect_db()
             c = conn.cursor()
             c.execute('''INSERT INTO submissions (user_id, username, full_name, plan_type, screenshot_path)
                          VALUES (?, ?, ?, ?, ?)''', 
-                      (target_user_id, app_username, full_name, plan_id, screenshot_url))
+                      (target_user_id, app_username, full_name, plan_id, screenshot_file))
+            submission_id = c.lastrowid
             conn.commit()
             conn.close()
             
+            receipt_uploader.enqueue(submission_id, screenshot_file)
             return render_template('payment_success.html')
+        except InvalidReceipt as e:
+            flash(str(e))
+            return redirect(request.url)
         except Exception as e:
             flash(f"Upload failed: {str(e)}")
             return redirect(request.url)
 
+# Receipt downloads can be handed to the front server after the auth check:
+# 'nginx' answers with X-Accel-Redirect into an `internal` location, 'sendfile' uses
+# X-Sendfile (Apache/lighttpd). Unset, Flask streams the file itself.
+FILE_OFFLOAD_MODE = os.getenv('FILE_OFFLOAD_MODE', '').lower()
+UPLOADS_INTERNAL_PREFIX = os.getenv('UPLOADS_INTERNAL_PREFIX', '/protected-uploads/')
+
 @app.route('/uploads/<filename>')
 @login_required 
 def uploaded_file(filename):
     if not session.get('is_admin'):
          return "Access Denied", 403
+    if FILE_OFFLOAD_MODE in ('nginx', 'sendfile'):
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if not path or not os.path.isfile(path):
+            abort(404)
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        # Set on this response only (not app-wide USE_X_SENDFILE), so no other send_file is offloaded
+        if FILE_OFFLOAD_MODE == 'nginx':
+            response.headers['X-Accel-Redirect'] = UPLOADS_INTERNAL_PREFIX.rstrip('/') + '/' + quote(filename)
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(path)
+        return response
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 @app.route('/admin')
 @admin_required
 def admin_dashboard():
-    conn = sqlite3.connect(DB_NAME, timeout=10)
+    conn = connect_db()
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     
@@ -1037,10 +1434,105 @@ def admin_dashboard():
     conn.close()
     return render_template('admin.html', submissions=submissions, history=history, users=users, payment_requests=payment_requests)
 
+# Live admin queue (Server-Sent Events). Each poll is a single indexed range query;
+# streams are recycled periodically and clients resume via Last-Event-ID.
+ADMIN_STREAM_POLL_INTERVAL = 2
+ADMIN_STREAM_KEEPALIVE = 15
+ADMIN_STREAM_MAX_SECONDS = 300
+
+@app.route('/admin/events')
+@compression.exempt
+@admin_required
+@limiter.exempt
+def admin_events():
+    conn = connect_db()
+    c = conn.cursor()
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        last_id = int(last_id)
+    except (TypeError, ValueError):
+        # Fresh connection: only stream what happens from now on
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM admin_events")
+        last_id = c.fetchone()[0]
+
+    def stream(last_id):
+        try:
+            yield "retry: 3000\n\n"
+            deadline = time.time() + ADMIN_STREAM_MAX_SECONDS
+            last_sent = time.time()
+            while time.time() < deadline:
+                c.execute("SELECT id, kind, payload FROM admin_events WHERE id > ? ORDER BY id LIMIT 100", (last_id,))
+                for event_id, kind, payload in c.fetchall():
+                    last_id = event_id
+                    last_sent = time.time()
+                    yield f"id: {event_id}\nevent: {kind}\ndata: {payload}\n\n"
+                if time.time() - last_sent >= ADMIN_STREAM_KEEPALIVE:
+                    last_sent = time.time()
+                    yield ": keepalive\n\n"
+                time.sleep(ADMIN_STREAM_POLL_INTERVAL)
+        finally:
+            conn.close()
+
+    return Response(stream_with_context(stream(last_id)), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Tell nginx not to buffer the stream
+    })
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+@admin_required
+def admin_profiler():
+    if request.method == 'POST':
+        if request.form.get('action') == 'disable':
+            profiler.disable()
+            flash('Profiler switched off.')
+            return redirect(url_for('admin_profiler'))
+        try:
+            sample_rate = float(request.form.get('sample_rate', 0)) / 100
+            minutes = max(1, min(int(request.form.get('minutes', 30)), 240))
+        except ValueError:
+            flash('Invalid profiler settings.')
+            return redirect(url_for('admin_profiler'))
+        endpoints = [name.strip() for name in request.form.get('endpoints', '').split(',')
+                     if name.strip() in app.view_functions]
+        profiler.enable(sample_rate, endpoints, minutes)
+        flash(f'Profiling {sample_rate:.1%} of requests for {minutes} minutes.')
+        return redirect(url_for('admin_profiler'))
+
+    return render_template('admin_profiler.html',
+                           config=profiler.config(),
+                           profiles=profiler.list_profiles(),
+                           endpoints=sorted(name for name in app.view_functions if name != 'static'))
+
+@app.route('/admin/profiler/<profile_id>.folded')
+@admin_required
+def admin_profile_download(profile_id):
+    path = profiler.folded_path(profile_id)
+    if not path:
+        abort(404)
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=f"{profile_id}.folded")
+
+@app.route('/admin/queries', methods=['GET', 'POST'])
+@admin_required
+def admin_queries():
+    if request.method == 'POST':
+        query_log.reset()
+        flash('Slow query log cleared.')
+        return redirect(url_for('admin_queries'))
+    return render_template('admin_queries.html', queries=query_log.report(), threshold_ms=query_log.SLOW_QUERY_MS)
+
+@app.route('/admin/ai-usage')
+@admin_required
+def admin_ai_usage():
+    try:
+        days = max(1, min(int(request.args.get('days', 7)), 90))
+    except ValueError:
+        days = 7
+    return render_template('admin_ai_usage.html', rows=ai_usage.summary(days), days=days)
+
 @app.route('/admin/approve/<int:submission_id>')
 @admin_required
 def approve_submission(submission_id):
-    conn = sqlite3.connect(DB_NAME, timeout=10)
+    conn = connect_db()
     c = conn.cursor()
     
     c.execute("SELECT user_id, plan_type FROM submissions WHERE id = ?", (submission_id,))
@@ -1064,6 +1556,70 @@ def approve_submission(submission_id):
     conn.close()
     return redirect(url_for('admin_dashboard'))
 
+BULK_ACTION_LIMIT = 500
+
+def is_submission_id(value):
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, int) or (isinstance(value, str) and value.isascii() and value.isdigit())
+
+@app.route('/admin/submissions/bulk', methods=['POST'])
+@admin_required
+def bulk_update_submissions():
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action not in ('approve', 'reject'):
+        return jsonify({"error": "Invalid action", "message": "Use approve or reject."}), 400
+    ids = data.get('ids')
+    # A list of ids only: a string would otherwise be read digit by digit
+    if not isinstance(ids, list) or not all(is_submission_id(i) for i in ids):
+        return jsonify({"error": "Invalid ids", "message": "Send ids as a list of submission ids."}), 400
+    submission_ids = sorted({int(i) for i in ids})
+    if not submission_ids or len(submission_ids) > BULK_ACTION_LIMIT:
+        return jsonify({"error": "Invalid ids", "message": f"Send between 1 and {BULK_ACTION_LIMIT} ids."}), 400
+
+    new_status = 'approved' if action == 'approve' else 'rejected'
+    conn = connect_db()
+    try:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        placeholders = ','.join('?' * len(submission_ids))
+        # Only pending submissions are touched, so repeated clicks are harmless
+        c.execute(f"SELECT id, user_id, plan_type FROM submissions WHERE status = 'pending' AND id IN ({placeholders}) ORDER BY id",
+                  submission_ids)
+        pending = c.fetchall()
+
+        c.executemany("UPDATE submissions SET status = ? WHERE id = ?",
+                      [(new_status, sub_id) for sub_id, _, _ in pending])
+
+        user_plans = {}
+        if action == 'approve':
+            # If a user has several receipts in the batch, the latest one sets the plan
+            for _, user_id, plan_type in pending:
+                user_plans[user_id] = plan_type
+            c.executemany("""UPDATE users 
+                             SET is_subscribed = 1, 
+                                 subscription_start = CURRENT_TIMESTAMP, 
+                                 plan_type = ? 
+                             WHERE id = ?""", [(plan_type, user_id) for user_id, plan_type in user_plans.items()])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"Bulk {action} Error: {e}")
+        return jsonify({"error": "Server Error", "message": str(e)}), 500
+    finally:
+        conn.close()
+
+    processed = [sub_id for sub_id, _, _ in pending]
+    processed_set = set(processed)
+    return jsonify({
+        "success": True,
+        "action": action,
+        "processed": processed,
+        "skipped": [sub_id for sub_id in submission_ids if sub_id not in processed_set],
+        "users_updated": len(user_plans)
+    })
+
 @app.route('/api/save_brand_tone', methods=['POST'])
 @login_required
 def save_brand_tone():
@@ -1074,7 +1630,7 @@ def save_brand_tone():
     if not brand_tone:
         return jsonify({"error": "Brand tone description is required"}), 400
         
-    conn = sqlite3.connect(DB_NAME, timeout=10)
+    conn = connect_db()
     try:
         c = conn.cursor()
         # Check if user is on Business plan
@@ -1107,7 +1663,7 @@ def notify_payment_method():
     if not method or not contact_info:
         return jsonify({"success": False, "error": "All fields required"}), 400
         
-    conn = sqlite3.connect(DB_NAME, timeout=10)
+    conn = connect_db()
     try:
         c = conn.cursor()
         c.execute("INSERT INTO payment_requests (user_id, username, plan_type, preferred_method, contact_method, contact_info) VALUES (?, ?, ?, ?, ?, ?)",
@@ -1123,7 +1679,7 @@ def notify_payment_method():
 @app.route('/admin/reject/<int:submission_id>')
 @admin_required
 def reject_submission(submission_id):
-    conn = sqlite3.connect(DB_NAME, timeout=10)
+    conn = connect_db()
     c = conn.cursor()
     c.execute("UPDATE submissions SET status = 'rejected' WHERE id = ?", (submission_id,))
     conn.commit()
@@ -1134,7 +1690,7 @@ def reject_submission(submission_id):
 @app.route('/admin/terminate/<int:user_id>')
 @admin_required
 def terminate_plan(user_id):
-    conn = sqlite3.connect(DB_NAME, timeout=10)
+    conn = connect_db()
     c = conn.cursor()
     c.execute("UPDATE users SET is_subscribed = 0, subscription_start = NULL, plan_type = 'free' WHERE id = ?", (user_id,))
     conn.commit()
@@ -1149,7 +1705,7 @@ def delete_user(user_id):
          flash('You cannot delete your own admin account.')
          return redirect(url_for('admin_dashboard'))
 
-    conn = sqlite3.connect(DB_NAME, timeout=10)
+    conn = connect_db()
     c = conn.cursor()
     # Delete related data first
     c.execute("DELETE FROM ideas WHERE user_id = ?", (user_id,))
@@ -1168,7 +1724,7 @@ def check_status():
     trial_used = False
     if 'user_id' in session and not is_subscribed:
         try:
-            conn = sqlite3.connect(DB_NAME, timeout=10)
+            conn = connect_db()
             c = conn.cursor()
             c.execute("SELECT COUNT(*) FROM ideas WHERE user_id = ?", (session['user_id'],))
             count = c.fetchone()[0]
@@ -1185,15 +1741,40 @@ def check_status():
 def subscribe():
     return jsonify({"redirect": url_for('pricing')})
 
+def save_history(conn, user_id, business, result, mode):
+    # Every tool's result is kept locally (history search and export read the
+    # `ideas` table; the search index is updated by trigger) and in Firestore
+    # (the history sidebar). `business` is what the result is about: the business
+    # type, or the link, handle or content type for the analysis tools.
+    c = conn.cursor()
+    c.execute("INSERT INTO ideas (user_id, business_type, idea_content, mode) VALUES (?, ?, ?, ?)", (user_id, business, result, mode))
+    idea_id = c.lastrowid
+    conn.commit()
+
+    try:
+        with http_client.track('firestore', FIRESTORE_HOST):
+            _, doc_ref = db.collection('history').add({
+                'user_id': str(user_id),
+                'business': business,
+                'content': result,
+                'mode': mode,
+                'timestamp': firestore.SERVER_TIMESTAMP
+            })
+        # Link the local row to its Firestore doc so deletes reach the search index
+        c.execute("UPDATE ideas SET doc_id = ? WHERE id = ?", (doc_ref.id, idea_id))
+        conn.commit()
+    except: pass
+
 @app.route('/api/generate', methods=['POST'])
 @login_required
 @limiter.limit("5 per minute")
+@idempotency.idempotent
 def generate_content():
     data = request.get_json(silent=True) or {}
     mode = data.get('mode', 'idea') # 'idea', 'script', 'viral_analyzer', 'competitor_scanner', 'content_scorer', 'weekly_plan'
     
     user_id = session['user_id']
-    conn = sqlite3.connect(DB_NAME, timeout=10)
+    conn = connect_db()
     try:
         c = conn.cursor()
         c.execute("SELECT is_subscribed, plan_type, brand_tone, is_admin FROM users WHERE id = ?", (user_id,))
@@ -1202,6 +1783,7 @@ def generate_content():
         plan_type = user_info[1] or 'free'
         brand_tone = user_info[2]
         is_admin = bool(user_info[3])
+        g.ai_plan = 'admin' if is_admin else plan_type
 
         # Plan-based access control
         allowed_free_starter = ['idea']
@@ -1237,28 +1819,17 @@ def generate_content():
             refinement = data.get('refinement', '').strip()
             previous_idea = data.get('previous_idea', '').strip()
             
-            c.execute("SELECT idea_content FROM ideas WHERE business_type = ? AND user_id = ?", (business_type, user_id))
+            # Only earlier ideas and scripts are worth steering away from
+            c.execute("SELECT idea_content FROM ideas WHERE business_type = ? AND user_id = ? AND COALESCE(mode, 'idea') IN ('idea', 'script')", (business_type, user_id))
             past_ideas = [row[0] for row in c.fetchall()]
             result = ai_engine.generate(business_type, platform, mood, goal, people, language, past_ideas, location, refinement, previous_idea, brand_tone, mode)
-            
-            # Store in DB
-            c.execute("INSERT INTO ideas (user_id, business_type, idea_content) VALUES (?, ?, ?)", (user_id, business_type, result))
-            conn.commit()
-            
-            try:
-                db.collection('history').add({
-                    'user_id': str(user_id),
-                    'business': business_type,
-                    'content': result,
-                    'mode': mode,
-                    'timestamp': firestore.SERVER_TIMESTAMP
-                })
-            except: pass
+            save_history(conn, user_id, business_type, result, mode)
 
         elif mode == 'viral_analyzer':
             link = data.get('link', '').strip()
             platform = data.get('platform', 'instagram').strip()
             result = ai_engine.analyze_viral(link, platform, 'simple')
+            save_history(conn, user_id, link, result, mode)
             
         elif mode == 'competitor_scanner':
             handle = data.get('handle', '').strip()
@@ -1266,12 +1837,14 @@ def generate_content():
             platform = data.get('platform', 'instagram').strip()
             business_type = data.get('businessType', '').strip()
             result = ai_engine.scan_competitor(handle, platform, 'simple', brand_tone, business_type, niche)
+            save_history(conn, user_id, handle, result, mode)
 
         elif mode == 'content_scorer':
             content = data.get('content', '').strip()
             content_type = data.get('contentType', 'caption').strip()
             platform = data.get('platform', 'instagram').strip()
             result = ai_engine.score_content(content, content_type, platform, 'simple')
+            save_history(conn, user_id, content_type, result, mode)
 
         elif mode == 'weekly_plan':
             business_type = data.get('businessType', '').strip()
@@ -1279,9 +1852,14 @@ def generate_content():
             language = data.get('language', 'simple').strip()
             location = data.get('location', 'Global').strip()
             result = ai_engine.generate_weekly_plan(business_type, platform, language, location, brand_tone)
+            save_history(conn, user_id, business_type, result, mode)
 
         return jsonify({"idea": result})
-        
+
+    except Overloaded as e:
+        return ai_overloaded(e)
+    except InputTooLarge as e:
+        return jsonify({"error": "INPUT_TOO_LARGE", "message": str(e)}), 413
     except Exception as e:
         print(f"Server Error: {e}")
         return jsonify({"error": "Server Error", "message": str(e)}), 500
@@ -1299,18 +1877,20 @@ def get_history():
                      .where('user_id', '==', user_id)\
                      .order_by('timestamp', direction=firestore.Query.DESCENDING)\
                      .limit(40)
-            docs = docs_query.stream()
-            history_data = list(docs)
+            with http_client.track('firestore', FIRESTORE_HOST):
+                docs = docs_query.stream()
+                history_data = list(docs)
         except Exception as query_err:
             # Fallback: Fetch without ordering if index is missing, then sort in memory
             if "requires an index" in str(query_err):
                 print("⚠️ Firestore index missing. Falling back to in-memory sort.")
-                docs = db.collection('history')\
-                         .where('user_id', '==', user_id)\
-                         .limit(60)\
-                         .stream()
+                with http_client.track('firestore', FIRESTORE_HOST):
+                    docs = list(db.collection('history')\
+                             .where('user_id', '==', user_id)\
+                             .limit(60)\
+                             .stream())
                 # Sort by timestamp descending in memory
-                history_data = sorted(list(docs), key=lambda x: x.to_dict().get('timestamp') or 0, reverse=True)[:20]
+                history_data = sorted(docs, key=lambda x: x.to_dict().get('timestamp') or 0, reverse=True)[:20]
             else:
                 raise query_err
         
@@ -1335,6 +1915,242 @@ def get_history():
         print(f"Fetch History Error: {e}")
         return jsonify({"history": []})
 
+SEARCH_HIGHLIGHT_START = '\x02'
+SEARCH_HIGHLIGHT_END = '\x03'
+
+def build_match_query(raw_query):
+    # Quote every term so user input can never hit FTS5 query syntax errors;
+    # the last term is a prefix match to support search-as-you-type.
+    terms = re.findall(r'\w+', raw_query, re.UNICODE)[:8]
+    if not terms:
+        return None
+    quoted = ['"%s"' % t for t in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+# PostgreSQL equivalents of the FTS5 query and snippet() call
+SEARCH_HEADLINE_OPTIONS = (f'StartSel="{SEARCH_HIGHLIGHT_START}", StopSel="{SEARCH_HIGHLIGHT_END}", '
+                           'MaxWords=24, MinWords=12, MaxFragments=1, FragmentDelimiter="…"')
+
+def build_tsquery(match_query):
+    # '"foo" "bar"*' -> 'foo & bar:*' (terms are \w+ only, so nothing needs escaping)
+    terms = re.findall(r'"(\w+)"(\*?)', match_query, re.UNICODE)
+    return ' & '.join(term + (':*' if prefix else '') for term, prefix in terms)
+
+def parse_search_date(value):
+    # Real calendar dates only, normalised to YYYY-MM-DD (SQLite compares them as text)
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d') if value else ''
+
+def is_search_query_error(e):
+    # Errors caused by what was searched for (FTS5/tsquery syntax, a bad date), not by the database
+    sqlstate = getattr(e, 'sqlstate', None) or ''
+    if sqlstate.startswith('22') or sqlstate == '42601':
+        return True
+    message = str(e).lower()
+    return isinstance(e, sqlite3.OperationalError) and ('fts5' in message or 'syntax error' in message)
+
+def render_snippet(snippet):
+    # Escape stored content, then turn the FTS5 markers into <mark> tags
+    escaped = html.escape(snippet or '')
+    return escaped.replace(SEARCH_HIGHLIGHT_START, '<mark>').replace(SEARCH_HIGHLIGHT_END, '</mark>')
+
+@app.route('/api/history/search', methods=['GET'])
+@login_required
+def search_history():
+    started = time.perf_counter()
+    user_id = session['user_id']
+    match_query = build_match_query(request.args.get('q', ''))
+    if not match_query:
+        return jsonify({"error": "Search query is required"}), 400
+
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 50)
+    except ValueError:
+        limit = 20
+
+    try:
+        since = parse_search_date(request.args.get('since', '').strip())
+        until = parse_search_date(request.args.get('until', '').strip())
+    except ValueError:
+        return jsonify({"error": "Invalid date", "message": "Use YYYY-MM-DD for since and until."}), 400
+
+    if pg:
+        # tsvector column + GIN index (see pg_database.SCHEMA); `search` weights content above business type
+        sql = '''SELECT i.id, i.doc_id, i.business_type, i.mode, i.timestamp,
+                        ts_headline('simple', i.idea_content, q, ?) AS snippet
+                 FROM ideas i, to_tsquery('simple', ?) q
+                 WHERE i.search @@ q AND COALESCE(i.hidden, 0) = 0 AND i.user_id = ?'''
+        params = [SEARCH_HEADLINE_OPTIONS, build_tsquery(match_query), user_id]
+        alias = 'i'
+        until_sql = " AND i.timestamp < CAST(? AS date) + 1"
+        order_sql = " ORDER BY ts_rank(i.search, q) DESC LIMIT ?"
+    else:
+        sql = '''SELECT f.rowid, i.doc_id, f.business_type, f.mode, f.timestamp,
+                        snippet(ideas_fts, 0, ?, ?, '…', 24) AS snippet
+                 FROM ideas_fts f JOIN ideas i ON i.id = f.rowid
+                 WHERE ideas_fts MATCH ? AND f.user_id = ?'''
+        params = [SEARCH_HIGHLIGHT_START, SEARCH_HIGHLIGHT_END, match_query, user_id]
+        alias = 'f'
+        until_sql = " AND f.timestamp < date(?, '+1 day')"
+        # Content matches weigh more than business-type matches
+        order_sql = " ORDER BY bm25(ideas_fts, 1.0, 0.5) LIMIT ?"
+
+    mode = request.args.get('mode', '').strip()
+    if mode:
+        sql += f" AND {alias}.mode = ?"
+        params.append(mode)
+    business = request.args.get('business', '').strip()
+    if business:
+        sql += f" AND {alias}.business_type = ?"
+        params.append(business)
+    if since:
+        sql += f" AND {alias}.timestamp >= ?"
+        params.append(since)
+    if until:
+        sql += until_sql
+        params.append(until)
+
+    sql += order_sql
+    params.append(limit)
+
+    conn = connect_db()
+    try:
+        c = conn.cursor()
+        c.execute(sql, params)
+        results = [{
+            "id": row[1],
+            "idea_id": row[0],
+            "business": row[2],
+            "mode": row[3],
+            "time": (row[4] or '')[:16],
+            "snippet": render_snippet(row[5])
+        } for row in c.fetchall()]
+    except DB_ERRORS as e:
+        # Details stay in the log; the client only learns whether to rephrase or retry
+        print(f"History Search Error: {e} (query {match_query!r})")
+        if is_search_query_error(e):
+            return jsonify({"error": "Invalid search query", "message": "Try different search terms."}), 400
+        return jsonify({"error": "Search unavailable", "message": "Please try again later."}), 500
+    finally:
+        conn.close()
+
+    return jsonify({
+        "results": results,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+
+# History export: rows are read in keyset-paginated batches so no read lock is held
+# across the whole download, and each batch is serialized and sent before the next.
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'md': 'text/markdown'
+}
+
+def iter_history_rows(user_id):
+    conn = connect_db()
+    try:
+        c = conn.cursor()
+        last_id = 0
+        while True:
+            c.execute('''SELECT id, business_type, mode, timestamp, idea_content FROM ideas
+                         WHERE user_id = ? AND id > ? AND COALESCE(hidden, 0) = 0
+                         ORDER BY id LIMIT ?''', (user_id, last_id, EXPORT_BATCH_SIZE))
+            rows = c.fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield row
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+
+# Cells starting with these run as formulas when the CSV is opened in a spreadsheet
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def csv_safe(value):
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def iter_export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['id', 'business', 'mode', 'created_at', 'content'])
+    for row in rows:
+        writer.writerow([csv_safe(value) for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+def iter_export_ndjson(rows):
+    for row_id, business, mode, created_at, content in rows:
+        yield json.dumps({
+            "id": row_id,
+            "business": business,
+            "mode": mode or 'idea',
+            "created_at": created_at,
+            "content": content
+        }, ensure_ascii=False) + "\n"
+
+def iter_export_markdown(rows):
+    yield "# Manager AI - Content History\n\n"
+    for row_id, business, mode, created_at, content in rows:
+        yield f"## {business or 'General'} - {(mode or 'idea').title()} ({created_at})\n\n{content}\n\n---\n\n"
+
+def iter_chunked(pieces, compress=False):
+    # Coalesce small pieces into ~64KB chunks, optionally gzip-compressing on the fly
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending = []
+    pending_size = 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        pending.append(data)
+        pending_size += len(data)
+        if pending_size >= EXPORT_CHUNK_SIZE:
+            chunk = b''.join(pending)
+            pending, pending_size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    chunk = b''.join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+@app.route('/api/history/export', methods=['GET'])
+@compression.options(gzip_level=1, br_quality=1)
+@login_required
+@limiter.limit("10 per hour")
+def export_history():
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Invalid format", "message": "Use csv, ndjson or md."}), 400
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    serializers = {
+        'csv': iter_export_csv,
+        'ndjson': iter_export_ndjson,
+        'md': iter_export_markdown
+    }
+    rows = iter_history_rows(session['user_id'])
+    body = iter_chunked(serializers[export_format](rows), compress=use_gzip)
+
+    filename = f"manager-ai-history-{time.strftime('%Y%m%d')}.{export_format}"
+    mimetype = EXPORT_FORMATS[export_format]
+    if use_gzip:
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Cache-Control': 'no-store'
+    })
+
 @app.route('/api/history/delete/<doc_id>', methods=['DELETE'])
 @login_required
 def delete_history(doc_id):
@@ -1342,14 +2158,24 @@ def delete_history(doc_id):
     print(f"Attempting to delete history item: {doc_id} for user: {user_id}")
     try:
         doc_ref = db.collection('history').document(doc_id)
-        doc = doc_ref.get()
+        with http_client.track('firestore', FIRESTORE_HOST):
+            doc = doc_ref.get()
         if not doc.exists:
             print(f"Delete failed: Document {doc_id} not found.")
             return jsonify({"error": "Not found"}), 404
             
         stored_user_id = str(doc.to_dict().get('user_id'))
         if stored_user_id == user_id:
-            doc_ref.delete()
+            with http_client.track('firestore', FIRESTORE_HOST):
+                doc_ref.delete()
+            # Hide the local copy (keeps trial accounting intact, drops it from search)
+            try:
+                conn = connect_db()
+                conn.execute("UPDATE ideas SET hidden = 1 WHERE doc_id = ? AND user_id = ?", (doc_id, int(user_id)))
+                conn.commit()
+                conn.close()
+            except Exception as e:
+                print(f"Search index delete warning: {e}")
             print(f"Successfully deleted history item: {doc_id}")
             return jsonify({"success": True})
         else:
@@ -1367,6 +2193,14 @@ def delete_history(doc_id):
 def ratelimit_handler(e):
     return jsonify({"error": "TOO_MANY_REQUESTS", "message": "Slow down! You're making requests too fast."}), 429
 
+def ai_overloaded(e):
+    # Shed early instead of letting the request time out behind a slow upstream
+    response = jsonify({"error": "SERVER_BUSY",
+                        "message": "We're handling a lot of requests right now. Please try again in a moment."})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
 @app.errorhandler(500)
 def internal_error(e):
     original_exception = getattr(e, 'original_exception', e)
@@ -1379,18 +2213,22 @@ def internal_error(e):
 @app.route('/api/support', methods=['POST'])
 def support_api():
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_question = data.get('question')
         history = data.get('history', [])
         
-        if not user_question:
+        if not isinstance(user_question, str) or not user_question.strip():
             return jsonify({"error": "Question is required"}), 400
             
         answer = ai_engine.support_chat(user_question, history)
         return jsonify({"answer": answer})
+    except Overloaded as e:
+        return ai_overloaded(e)
+    except InputTooLarge as e:
+        return jsonify({"error": "INPUT_TOO_LARGE", "message": str(e)}), 413
     except Exception as e:
         print(f"Support API Error: {e}")
-        return jsonify({"error": "Internal Server Error", "message": str(e)}), 500
+        return jsonify({"error": "Internal Server Error", "message": "Please try again later."}), 500
 
 @app.route('/robots.txt')
 def robots():
@@ -1400,11 +2238,77 @@ def robots():
 def manifest():
     return send_from_directory(os.path.join(app.root_path, 'static'), 'manifest.json')
 
+# Service worker caching strategies, derived from the URL map. Anything not listed
+# (all API calls, the dashboard and other per-user pages, payments, admin, auth) is
+# network-only and not intercepted: the cache is shared by whoever uses the browser
+# next, so only public pages and assets may go in it.
+SW_ENDPOINT_STRATEGIES = {
+    'fingerprinted_asset': 'cache-first',
+    'static': 'stale-while-revalidate',
+    'intro': 'network-first',
+    'pricing': 'network-first',
+    'manifest': 'stale-while-revalidate'
+}
+SW_PRECACHE_ENDPOINTS = ['intro', 'manifest']
+SW_EXTERNAL_ORIGINS = ['https://fonts.googleapis.com', 'https://fonts.gstatic.com', 'https://cdnjs.cloudflare.com']
+
+def rule_to_pattern(rule):
+    # /api/history/delete/<doc_id> -> ^/api/history/delete/[^/]+$
+    pattern = ''
+    pos = 0
+    for match in re.finditer(r'<(?:(\w+)(?:\([^)]*\))?:)?\w+>', rule.rule):
+        pattern += re.escape(rule.rule[pos:match.start()])
+        pattern += '.+' if match.group(1) == 'path' else '[^/]+'
+        pos = match.end()
+    return '^' + pattern + re.escape(rule.rule[pos:]) + '$'
+
+def build_sw_config():
+    routes = []
+    for rule in app.url_map.iter_rules():
+        strategy = SW_ENDPOINT_STRATEGIES.get(rule.endpoint)
+        if strategy and 'GET' in rule.methods:
+            routes.append({'pattern': rule_to_pattern(rule), 'strategy': strategy})
+    # Most specific first (e.g. /static/dist/... before /static/...)
+    routes.sort(key=lambda r: len(r['pattern']), reverse=True)
+
+    precache = [url_for(endpoint) for endpoint in SW_PRECACHE_ENDPOINTS]
+    precache += ['/static/' + path for path in asset_manifest.assets.values()]
+    return {
+        'version': asset_manifest.version,
+        'routes': routes,
+        'precache': precache,
+        'external_origins': SW_EXTERNAL_ORIGINS
+    }
+
 @app.route('/sw.js')
 def service_worker():
-    return send_from_directory(os.path.join(app.root_path, 'static'), 'sw.js')
+    response = Response(render_template('sw.js', sw_config=build_sw_config()), mimetype='application/javascript')
+    # Browsers must re-check the worker on every visit so new deploys are picked up
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# Scrapers on the allowlist (direct, or through nginx's X-Real-IP) or a PIN-verified admin
+METRICS_ALLOWED_IPS = {ip.strip() for ip in os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()}
+LOCAL_PROXY_ADDRS = {None, '', '127.0.0.1', '::1'}
+
+def metrics_client_allowed():
+    client_ip = request.remote_addr
+    if client_ip in LOCAL_PROXY_ADDRS:
+        client_ip = request.headers.get('X-Real-IP', client_ip)
+    if client_ip in METRICS_ALLOWED_IPS:
+        return True
+    return bool(session.get('is_admin') and session.get('admin_authenticated'))
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    if not metrics_client_allowed():
+        abort(403)
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type, headers={'Cache-Control': 'no-store'})
 
 @app.route('/sitemap.xml')
+@compression.options(gzip_level=9, br_quality=11)
 def sitemap():
     sitemap_xml = """<?xml version="1.0" encoding="UTF-8"?>
 <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
@@ -1415,9 +2319,53 @@ def sitemap():
 </urlset>"""
     return Response(sitemap_xml, mimetype='application/xml')
 
-# Initialize DB on startup
-with app.app_context():
-    init_db()
+# Background Cloudinary uploads for staged payment receipts
+receipt_uploader = ReceiptUploader(connect_db, app.config['UPLOAD_FOLDER'], shared_state)
+
+# --- STARTUP ---
+# create_app() does the one-time, fork-safe setup. Under `gunicorn --preload` it runs
+# once in the master and workers inherit the result; start_worker_services() then
+# starts the per-process background threads after the fork (gunicorn.conf.py).
+_app_ready = False
+_worker_pid = None
+_startup_lock = threading.Lock()
+
+def create_app():
+    global _app_ready
+    with _startup_lock:
+        if _app_ready:
+            return app
+        with startup.timed('uploads dir'):
+            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        with startup.timed('init_db'):
+            with app.app_context():
+                init_db()
+        with startup.timed('templates'):
+            # Compile every template now so forked workers share the bytecode
+            for name in app.jinja_env.list_templates():
+                app.jinja_env.get_template(name)
+        _app_ready = True
+    print(startup.summary('App ready'))
+    return app
+
+def start_worker_services():
+    global _worker_pid
+    create_app()
+    with _startup_lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+        with startup.timed('firebase certs'):
+            token_verifier.start()
+        with startup.timed('receipt uploader'):
+            receipt_uploader.start()
+    print(startup.summary('Worker ready'))
+
+@app.before_request
+def ensure_worker_services():
+    # Covers servers without the gunicorn hook (flask run, `gunicorn app:app`)
+    if _worker_pid != os.getpid():
+        start_worker_services()
 
 if __name__ == '__main__':
     # VPS Ready Run Configuration
@@ -1426,4 +2374,5 @@ if __name__ == '__main__':
     debug = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     
     # SECURITY: Disable debug mode in production to prevent crashes/hacks
+    create_app()
     app.run(host=host, port=port, debug=debug)
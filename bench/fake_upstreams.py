@@ -0,0 +1,266 @@
+# Local stand-ins for the services the app calls, for benchmarking.
+#
+# One threaded HTTP server provides:
+#   POST /v1/chat/completions          OpenAI-compatible (OPENROUTER_BASE_URL=<url>/v1),
+#                                      with a configurable latency distribution,
+#                                      error rate and token streaming (stream=true)
+#   GET  /certs                        Firebase-style signing certificates
+#                                      (FIREBASE_CERT_URL=<url>/certs)
+#   POST /paystack/transaction/initialize, GET /paystack/transaction/verify/<ref>
+#                                      (PAYSTACK_BASE_URL=<url>/paystack)
+#
+# ID tokens signed with the server's key (minted in-process, or over
+# GET /bench/token?uid=..&email=..) let the app run its normal offline RS256
+# verification during a login storm.
+#
+#     python -m bench.fake_upstreams --port 8900 --ai-latency lognormal:1.5,0.4
+
+import argparse
+import datetime
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+PROJECT_ID = 'bench-project'
+KEY_ID = 'bench-key-1'
+WORDS = ('post', 'reel', 'story', 'hook', 'customers', 'brand', 'offer', 'today', 'fresh', 'local',
+         'behind', 'scenes', 'video', 'caption', 'trend', 'audience', 'share', 'save', 'launch', 'weekend')
+
+
+# --- Latency distributions ---
+
+def parse_latency(spec):
+    # none | fixed:S | uniform:MIN,MAX | lognormal:MEDIAN,SIGMA  (seconds)
+    kind, _, args = spec.partition(':')
+    values = [float(v) for v in args.split(',')] if args else []
+    if kind == 'none':
+        return lambda: 0.0
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'lognormal':
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+# --- Firebase ID tokens ---
+
+class TokenMinter:
+    def __init__(self, project_id=PROJECT_ID):
+        self.project_id = project_id
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'bench-securetoken')])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cert = (x509.CertificateBuilder()
+                .subject_name(name).issuer_name(name)
+                .public_key(key.public_key())
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(now - datetime.timedelta(days=1))
+                .not_valid_after(now + datetime.timedelta(days=7))
+                .sign(key, hashes.SHA256()))
+        self.certs = {KEY_ID: cert.public_bytes(serialization.Encoding.PEM).decode()}
+        private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                        serialization.NoEncryption())
+        self._signer = crypt.RSASigner.from_string(private_pem, key_id=KEY_ID)
+
+    def mint(self, uid, email):
+        now = int(time.time())
+        claims = {
+            'iss': f'https://securetoken.google.com/{self.project_id}',
+            'aud': self.project_id,
+            'sub': uid,
+            'email': email,
+            'iat': now,
+            'exp': now + 3600,
+            'auth_time': now
+        }
+        return jwt.encode(self._signer, claims).decode()
+
+
+# --- HTTP server ---
+
+class FakeUpstreams:
+    def __init__(self, host='127.0.0.1', port=8900, ai_latency='lognormal:1.2,0.4', ai_error_rate=0.0,
+                 tokens_per_second=60.0, completion_words=160, paystack_latency='uniform:0.2,0.6'):
+        self.ai_latency = parse_latency(ai_latency)
+        self.paystack_latency = parse_latency(paystack_latency)
+        self.ai_error_rate = ai_error_rate
+        self.tokens_per_second = tokens_per_second
+        self.completion_words = completion_words
+        self.minter = TokenMinter()
+        self.transactions = {}
+        self._lock = threading.Lock()
+        self.stats = {'chat': 0, 'chat_errors': 0, 'certs': 0, 'paystack': 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+
+    def start(self):
+        thread = threading.Thread(target=self.server.serve_forever, name='fake-upstreams', daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def completion_text(self):
+        words = [random.choice(WORDS) for _ in range(self.completion_words)]
+        return 'IDEA: ' + ' '.join(words).capitalize() + '.'
+
+    def _handler_class(self):
+        upstreams = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+            def _json(self, status, payload, headers=None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path.startswith('/bench/token'):
+                    query = parse_qs(urlparse(self.path).query)
+                    uid = query.get('uid', [uuid.uuid4().hex])[0]
+                    email = query.get('email', [f"{uid}@bench.local"])[0]
+                    return self._json(200, {'idToken': upstreams.minter.mint(uid, email)})
+                if self.path.startswith('/certs'):
+                    upstreams._count('certs')
+                    return self._json(200, upstreams.minter.certs, {'Cache-Control': 'public, max-age=3600'})
+                match = re.match(r'^/paystack/transaction/verify/(.+)$', self.path)
+                if match:
+                    upstreams._count('paystack')
+                    time.sleep(upstreams.paystack_latency())
+                    with upstreams._lock:
+                        transaction = upstreams.transactions.get(match.group(1))
+                    if not transaction:
+                        return self._json(404, {'status': False, 'message': 'Transaction reference not found'})
+                    return self._json(200, {'status': True, 'data': dict(transaction, status='success')})
+                self._json(404, {'error': 'not found'})
+
+            def do_POST(self):
+                if self.path.rstrip('/').endswith('/chat/completions'):
+                    return self._chat(self._body())
+                if self.path == '/paystack/transaction/initialize':
+                    upstreams._count('paystack')
+                    body = self._body()
+                    time.sleep(upstreams.paystack_latency())
+                    reference = body.get('reference') or uuid.uuid4().hex
+                    with upstreams._lock:
+                        upstreams.transactions[reference] = {
+                            'reference': reference, 'amount': body.get('amount'),
+                            'metadata': body.get('metadata') or {}, 'customer': {'email': body.get('email')}
+                        }
+                    return self._json(200, {'status': True, 'data': {
+                        'authorization_url': f"{upstreams.url}/paystack/checkout/{reference}",
+                        'reference': reference, 'access_code': uuid.uuid4().hex[:12]}})
+                self._json(404, {'error': 'not found'})
+
+            def _chat(self, body):
+                upstreams._count('chat')
+                delay = upstreams.ai_latency()
+                if random.random() < upstreams.ai_error_rate:
+                    upstreams._count('chat_errors')
+                    time.sleep(min(delay, 0.5))
+                    return self._json(503, {'error': {'message': 'Upstream overloaded (bench)', 'type': 'server_error'}})
+
+                text = upstreams.completion_text()
+                finish_reason = 'stop'
+                if body.get('max_tokens') and len(text) // 4 > body['max_tokens']:
+                    text, finish_reason = text[:body['max_tokens'] * 4], 'length'
+                model = body.get('model', 'bench-model')
+                prompt_tokens = sum(len(str(m.get('content', ''))) for m in body.get('messages', [])) // 4
+                completion_id = f"chatcmpl-bench-{uuid.uuid4().hex[:12]}"
+                created = int(time.time())
+
+                if not body.get('stream'):
+                    time.sleep(delay)
+                    return self._json(200, {
+                        'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text},
+                                     'finish_reason': finish_reason}],
+                        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(text) // 4,
+                                  'total_tokens': prompt_tokens + len(text) // 4}
+                    })
+
+                # Streaming: the latency draw is time to first token, then a steady token rate
+                time.sleep(delay)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                interval = 1.0 / upstreams.tokens_per_second if upstreams.tokens_per_second > 0 else 0
+                for piece in re.findall(r'\S+\s*', text):
+                    chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                             'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+                    self._chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+                    time.sleep(interval)
+                final = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                         'choices': [{'index': 0, 'delta': {}, 'finish_reason': finish_reason}]}
+                self._chunk(f"data: {json.dumps(final)}\n\n".encode())
+                self._chunk(b"data: [DONE]\n\n")
+                self._chunk(b"")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark stand-in upstream server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--ai-latency', default='lognormal:1.2,0.4',
+                        help='none | fixed:S | uniform:MIN,MAX | lognormal:MEDIAN,SIGMA (seconds)')
+    parser.add_argument('--ai-error-rate', type=float, default=0.0)
+    parser.add_argument('--tokens-per-second', type=float, default=60.0)
+    parser.add_argument('--completion-words', type=int, default=160)
+    parser.add_argument('--paystack-latency', default='uniform:0.2,0.6')
+    args = parser.parse_args()
+
+    upstreams = FakeUpstreams(args.host, args.port, args.ai_latency, args.ai_error_rate,
+                              args.tokens_per_second, args.completion_words, args.paystack_latency)
+    print(f"Fake upstreams on {upstreams.url}")
+    print(f"  OPENROUTER_BASE_URL={upstreams.url}/v1")
+    print(f"  FIREBASE_CERT_URL={upstreams.url}/certs")
+    print(f"  PAYSTACK_BASE_URL={upstreams.url}/paystack")
+    try:
+        upstreams.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
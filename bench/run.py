@@ -0,0 +1,323 @@
+# Load-test runner: drives the scripted scenarios against gunicorn and reports
+# throughput, p50/p95/p99 latency and worker saturation.
+#
+# By default it starts the stand-in upstreams in-process and spawns
+# `gunicorn -c gunicorn.conf.py bench.stub_app:app` on a scratch database, so
+# results depend only on this code and the chosen upstream latencies:
+#
+#     python -m bench.run --scenarios generate_burst,history_polling --users 24 --duration 60 \
+#         --save bench/results/after.json --baseline bench/results/before.json
+#
+# --target http://host:port benchmarks an app that is already running instead
+# (it must have been started against the same fake upstreams; see bench/README.md).
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from bench.fake_upstreams import FakeUpstreams
+from bench.scenarios import SCENARIOS, AdminBrowsing, BenchClient, Recorder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_PIN = 'bench-pin'
+
+
+# --- App process ---
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def spawn_app(upstreams, workdir, workers, threads, firestore_latency_ms):
+    port = _free_port()
+    env = dict(os.environ,
+               GUNICORN_BIND=f"127.0.0.1:{port}",
+               GUNICORN_WORKERS=str(workers),
+               GUNICORN_THREADS=str(threads),
+               DATABASE_PATH=os.path.join(workdir, 'content_ideas.db'),
+               SHARED_STATE_DB=os.path.join(workdir, 'shared_state.db'),
+               PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'metrics'),
+               PROFILE_DIR=os.path.join(workdir, 'profiles'),
+               FIREBASE_CERT_CACHE=os.path.join(workdir, 'certs.json'),
+               FIREBASE_CERT_URL=f"{upstreams.url}/certs",
+               OPENROUTER_BASE_URL=f"{upstreams.url}/v1",
+               OPENAI_API_KEY='bench',
+               PAYSTACK_BASE_URL=f"{upstreams.url}/paystack",
+               PAYSTACK_SECRET_KEY='sk_bench',
+               ADMIN_PIN=ADMIN_PIN,
+               RATELIMIT_ENABLED='False',
+               FORCE_HTTPS='False',
+               SESSION_COOKIE_SECURE='False',
+               METRICS_ALLOWED_IPS='127.0.0.1,::1',
+               BENCH_FIRESTORE_LATENCY_MS=str(firestore_latency_ms))
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'bench.stub_app:app'],
+                               cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}; see {log.name}")
+        try:
+            if requests.get(url + '/login', timeout=2).status_code == 200:
+                return process, url, log
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"gunicorn did not come up within 60s; see {log.name}")
+
+
+# --- Saturation sampling ---
+
+class SaturationSampler:
+    # Polls /metrics for requests in progress across all workers
+    def __init__(self, url, capacity, interval=0.5):
+        self.url = url + '/metrics'
+        self.capacity = capacity
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='saturation-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        if not self.samples:
+            return None
+        busy = sorted(self.samples)
+        result = {'mean_busy': sum(busy) / len(busy), 'max_busy': busy[-1], 'capacity': self.capacity}
+        if self.capacity:
+            result['mean_utilisation'] = result['mean_busy'] / self.capacity
+            result['saturated_fraction'] = sum(1 for b in busy if b >= self.capacity) / len(busy)
+        return result
+
+    def _run(self):
+        session = requests.Session()
+        while not self._stop.wait(self.interval):
+            try:
+                text = session.get(self.url, timeout=5).text
+            except requests.RequestException:
+                continue
+            busy = sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+                       if line.startswith('http_requests_in_progress{'))
+            # Don't count the scrape itself
+            self.samples.append(max(busy - 1, 0))
+
+
+# --- Running scenarios ---
+
+def run_scenario(name, url, tokens, users, duration, think, recorder):
+    stop_at = time.monotonic() + duration
+    ready = threading.Barrier(users + 1)
+
+    def virtual_user(index):
+        scenario = SCENARIOS[name](index)
+        client = BenchClient(url, recorder, name, tokens)
+        try:
+            scenario.setup(client)
+        finally:
+            ready.wait()
+        while time.monotonic() < stop_at:
+            scenario.step(client)
+            if think:
+                time.sleep(think)
+
+    threads = [threading.Thread(target=virtual_user, args=(n,), name=f"{name}-{n}", daemon=True)
+               for n in range(users)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.monotonic()
+    stop_at = started + duration
+    for thread in threads:
+        thread.join()
+    return time.monotonic() - started
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarise(samples, elapsed):
+    endpoints = {}
+    all_latencies, total_errors = [], 0
+    for name, entries in sorted(samples.items()):
+        if name.startswith('setup '):
+            continue
+        latencies = sorted(seconds * 1000 for seconds, _ in entries)
+        errors = sum(1 for _, status in entries if status == 0 or status >= 400)
+        all_latencies.extend(latencies)
+        total_errors += errors
+        endpoints[name] = _stats(latencies, errors, elapsed)
+        endpoints[name]['statuses'] = _status_counts(entries)
+    all_latencies.sort()
+    return {'elapsed': elapsed, 'total': _stats(all_latencies, total_errors, elapsed), 'endpoints': endpoints}
+
+
+def _status_counts(entries):
+    counts = {}
+    for _, status in entries:
+        counts[str(status)] = counts.get(str(status), 0) + 1
+    return counts
+
+
+def _stats(latencies, errors, elapsed):
+    return {
+        'count': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else 0.0
+    }
+
+
+# --- Reporting ---
+
+def print_report(results):
+    header = f"  {'endpoint':<30} {'count':>7} {'err':>5} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+    for name, result in results['scenarios'].items():
+        print(f"\n{name}: {result['users']} users, {result['elapsed']:.1f}s")
+        print(header + '   (ms)')
+        rows = list(result['endpoints'].items()) + [('TOTAL', result['total'])]
+        for endpoint, s in rows:
+            print(f"  {endpoint:<30} {s['count']:>7} {s['errors']:>5} {s['rps']:>8.1f} "
+                  f"{s['p50']:>8.1f} {s['p95']:>8.1f} {s['p99']:>8.1f} {s['max']:>8.1f}")
+        for endpoint, s in result['endpoints'].items():
+            failed = {status: n for status, n in s['statuses'].items() if status == '0' or int(status) >= 400}
+            if failed:
+                print(f"  ! {endpoint} failures by status (0 = connection error): {failed}")
+        sat = result.get('saturation')
+        if sat:
+            line = f"  workers busy: mean {sat['mean_busy']:.1f}, max {sat['max_busy']:.0f}"
+            if sat.get('capacity'):
+                line += (f" of {sat['capacity']} threads ({sat['mean_utilisation']:.0%} mean utilisation, "
+                         f"saturated {sat['saturated_fraction']:.0%} of the time)")
+            print(line)
+    if results.get('upstreams'):
+        print(f"\nupstream calls: {results['upstreams']}")
+
+
+def _delta(before, after):
+    if not before:
+        return '   n/a'
+    return f"{(after - before) / before:+6.0%}"
+
+
+def compare(results, baseline):
+    print(f"\nCompared with baseline ({baseline.get('label') or baseline.get('started')}):")
+    print(f"  {'scenario':<20} {'req/s':>16} {'p50':>18} {'p95':>18} {'p99':>18}")
+    for name, result in results['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old:
+            print(f"  {name:<20} (not in baseline)")
+            continue
+        now, was = result['total'], old['total']
+        cells = [f"{now['rps']:>8.1f} {_delta(was['rps'], now['rps'])}"]
+        cells += [f"{now[key]:>9.1f}ms {_delta(was[key], now[key])}" for key in ('p50', 'p95', 'p99')]
+        print(f"  {name:<20} " + ' '.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the app under scripted load.')
+    parser.add_argument('--scenarios', default='login_storm,generate_burst,admin_browsing,history_polling',
+                        help=f"comma separated, from: {', '.join(SCENARIOS)} (or 'all')")
+    parser.add_argument('--users', type=int, default=20, help='concurrent virtual users per scenario')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per scenario')
+    parser.add_argument('--think', type=float, default=0.0, help='pause between a user\'s iterations (s)')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ai-latency', default='lognormal:1.2,0.4')
+    parser.add_argument('--ai-error-rate', type=float, default=0.0)
+    parser.add_argument('--tokens-per-second', type=float, default=60.0)
+    parser.add_argument('--paystack-latency', default='uniform:0.2,0.6')
+    parser.add_argument('--firestore-latency-ms', type=float, default=20.0)
+    parser.add_argument('--target', help='benchmark an already running app at this URL instead of spawning one')
+    parser.add_argument('--upstreams', help='with --target: URL of the fake upstreams the app was started against')
+    parser.add_argument('--capacity', type=int, help='with --target: total worker threads, for saturation')
+    parser.add_argument('--label', help='name stored with the results (e.g. a commit)')
+    parser.add_argument('--save', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against results saved earlier with --save')
+    args = parser.parse_args()
+
+    names = list(SCENARIOS) if args.scenarios == 'all' else [n.strip() for n in args.scenarios.split(',') if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    AdminBrowsing.admin_pin = os.getenv('ADMIN_PIN', ADMIN_PIN) if args.target else ADMIN_PIN
+
+    upstreams, process, log = None, None, None
+    if args.target:
+        if not args.upstreams:
+            parser.error('--target needs --upstreams (the fake upstream server the app trusts for tokens)')
+        url, capacity = args.target.rstrip('/'), args.capacity
+        token_url = args.upstreams.rstrip('/') + '/bench/token'
+        token_session = requests.Session()
+
+        def tokens(uid, email):
+            return token_session.get(token_url, params={'uid': uid, 'email': email}, timeout=10).json()['idToken']
+    else:
+        upstreams = FakeUpstreams(port=0, ai_latency=args.ai_latency, ai_error_rate=args.ai_error_rate,
+                                  tokens_per_second=args.tokens_per_second,
+                                  paystack_latency=args.paystack_latency).start()
+        workdir = tempfile.mkdtemp(prefix='manager-ai-bench-')
+        print(f"Starting gunicorn ({args.workers} workers x {args.threads} threads) in {workdir} ...")
+        process, url, log = spawn_app(upstreams, workdir, args.workers, args.threads, args.firestore_latency_ms)
+        capacity = args.workers * args.threads
+        tokens = upstreams.minter.mint
+
+    results = {'label': args.label, 'started': time.strftime('%Y-%m-%d %H:%M:%S'), 'target': url,
+               'config': {k: v for k, v in vars(args).items() if k not in ('save', 'baseline', 'label')},
+               'scenarios': {}}
+    try:
+        for name in names:
+            print(f"Running {name} ({args.users} users, {args.duration:.0f}s) ...")
+            recorder = Recorder()
+            sampler = SaturationSampler(url, capacity).start()
+            elapsed = run_scenario(name, url, tokens, args.users, args.duration, args.think, recorder)
+            result = summarise(recorder.samples.get(name, {}), elapsed)
+            result['users'] = args.users
+            result['saturation'] = sampler.stop()
+            results['scenarios'][name] = result
+        if upstreams:
+            results['upstreams'] = dict(upstreams.stats)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+            log.close()
+        if upstreams:
+            upstreams.stop()
+
+    print_report(results)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
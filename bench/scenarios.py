@@ -0,0 +1,141 @@
+# Scripted load scenarios. Each virtual user runs setup() once, then step() in a
+# loop until the scenario's time is up; every HTTP call is timed by BenchClient.
+
+import random
+import threading
+import time
+import uuid
+
+import requests
+
+ADMIN_EMAIL = 'patricknigel33@gmail.com'   # The app's hard-wired admin account
+BUSINESSES = ('bakery', 'barbershop', 'fashion boutique', 'restaurant', 'fitness studio', 'phone repair')
+SEARCH_TERMS = ('post', 'reel', 'customers', 'brand', 'weekend')
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, scenario, name, seconds, status):
+        with self._lock:
+            self.samples.setdefault(scenario, {}).setdefault(name, []).append((seconds, status))
+
+
+class BenchClient:
+    def __init__(self, base_url, recorder, scenario, tokens):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.scenario = scenario
+        self.tokens = tokens
+        self.session = requests.Session()
+
+    def request(self, method, path, name=None, **kwargs):
+        kwargs.setdefault('timeout', 120)
+        kwargs.setdefault('allow_redirects', False)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+        self.recorder.add(self.scenario, name or f"{method} {path}", time.perf_counter() - started, status)
+        return response
+
+    def login(self, email, uid=None, name='POST /login'):
+        token = self.tokens(uid or email.split('@')[0], email)
+        response = self.request('POST', '/login', name=name, json={'idToken': token})
+        return response is not None and response.status_code == 200
+
+
+# --- Scenarios ---
+
+class Scenario:
+    name = None
+
+    def __init__(self, user_index):
+        self.user_index = user_index
+
+    def setup(self, client):
+        pass
+
+    def step(self, client):
+        raise NotImplementedError
+
+
+class LoginStorm(Scenario):
+    # Fresh visitors signing in for the first time, then landing on the dashboard
+    name = 'login_storm'
+
+    def step(self, client):
+        client.session.cookies.clear()
+        uid = uuid.uuid4().hex[:20]
+        if client.login(f"storm_{uid}@bench.local", uid):
+            client.request('GET', '/dashboard', name='GET /dashboard')
+
+
+class GenerateBurst(Scenario):
+    # Subscribed users hammering the AI generator
+    name = 'generate_burst'
+
+    def setup(self, client):
+        client.login(f"bench_user_{self.user_index}@bench.local", name='setup /login')
+
+    def step(self, client):
+        client.request('POST', '/api/generate', name='POST /api/generate', json={
+            'mode': 'idea',
+            'businessType': random.choice(BUSINESSES),
+            'platform': random.choice(('instagram', 'tiktok', 'facebook')),
+            'language': 'simple',
+            'location': 'Lagos'
+        })
+
+
+class AdminBrowsing(Scenario):
+    # An admin clicking through the queue and reports
+    name = 'admin_browsing'
+    admin_pin = None
+
+    def setup(self, client):
+        client.login(ADMIN_EMAIL, uid=f"admin{self.user_index}", name='setup /login')
+        client.request('POST', '/admin/login', name='setup /admin/login', data={'pin': self.admin_pin})
+
+    def step(self, client):
+        client.request('GET', '/admin', name='GET /admin')
+        client.request('GET', '/admin/queries', name='GET /admin/queries')
+        client.request('GET', f"/api/history/search?q={random.choice(SEARCH_TERMS)}",
+                       name='GET /api/history/search')
+
+
+class HistoryPolling(Scenario):
+    # Dashboards left open, refreshing history and account status
+    name = 'history_polling'
+
+    def setup(self, client):
+        client.login(f"bench_user_{self.user_index}@bench.local", name='setup /login')
+        client.request('POST', '/api/generate', name='setup /api/generate',
+                       json={'mode': 'idea', 'businessType': random.choice(BUSINESSES)})
+
+    def step(self, client):
+        client.request('GET', '/api/history', name='GET /api/history')
+        client.request('GET', '/api/check_status', name='GET /api/check_status')
+        client.request('GET', f"/api/history/search?q={random.choice(SEARCH_TERMS)}",
+                       name='GET /api/history/search')
+
+
+class Checkout(Scenario):
+    # Paystack checkout: initialize, then the return callback verifies the payment
+    name = 'checkout'
+
+    def setup(self, client):
+        client.login(f"bench_user_{self.user_index}@bench.local", name='setup /login')
+
+    def step(self, client):
+        response = client.request('POST', '/api/pay/initialize/pro', name='POST /api/pay/initialize')
+        if response is not None and response.status_code == 200:
+            reference = response.json()['reference']
+            client.request('GET', f"/api/pay/callback?reference={reference}", name='GET /api/pay/callback')
+
+
+SCENARIOS = {cls.name: cls for cls in (LoginStorm, GenerateBurst, AdminBrowsing, HistoryPolling, Checkout)}
@@ -0,0 +1,135 @@
+# The real app with Firebase Admin replaced by in-memory stand-ins, for benchmarks.
+#
+#     gunicorn -c gunicorn.conf.py bench.stub_app:app
+#
+# Credentials and Firestore are stubbed (history lives in memory per worker, with
+# optional simulated latency via BENCH_FIRESTORE_LATENCY_MS); ID tokens are still
+# verified offline against FIREBASE_CERT_URL, which bench/fake_upstreams.py serves.
+# Benchmark users are seeded into the (separate) DATABASE_PATH or DATABASE_URL database:
+# bench_user_<n>@bench.local logs in on the Business plan.
+
+import datetime
+import itertools
+import os
+import threading
+import time
+from unittest import mock
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+PROJECT_ID = os.getenv('BENCH_PROJECT_ID', 'bench-project')
+FIRESTORE_LATENCY = float(os.getenv('BENCH_FIRESTORE_LATENCY_MS', 0)) / 1000
+SEED_USERS = int(os.getenv('BENCH_SEED_USERS', 200))
+
+
+# --- In-memory Firestore ---
+
+class _Snapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class _DocumentRef:
+    def __init__(self, store, collection, doc_id):
+        self._store, self._collection, self.id = store, collection, doc_id
+
+    def get(self):
+        self._store.wait()
+        with self._store.lock:
+            return _Snapshot(self.id, self._store.docs[self._collection].get(self.id))
+
+    def delete(self):
+        self._store.wait()
+        with self._store.lock:
+            self._store.docs[self._collection].pop(self.id, None)
+
+
+class _Query:
+    def __init__(self, store, collection, filters=(), order=None, limit=None):
+        self._store, self._collection = store, collection
+        self._filters, self._order, self._limit = list(filters), order, limit
+
+    def where(self, field, op, value):
+        if op != '==':
+            raise NotImplementedError(f"Bench Firestore stub only supports '==' (got {op})")
+        return _Query(self._store, self._collection, self._filters + [(field, value)], self._order, self._limit)
+
+    def order_by(self, field, direction=None):
+        descending = direction == firestore.Query.DESCENDING
+        return _Query(self._store, self._collection, self._filters, (field, descending), self._limit)
+
+    def limit(self, count):
+        return _Query(self._store, self._collection, self._filters, self._order, count)
+
+    def stream(self):
+        self._store.wait()
+        with self._store.lock:
+            items = [(doc_id, dict(data)) for doc_id, data in self._store.docs[self._collection].items()
+                     if all(data.get(field) == value for field, value in self._filters)]
+        if self._order:
+            field, descending = self._order
+            items.sort(key=lambda item: item[1].get(field) or 0, reverse=descending)
+        if self._limit is not None:
+            items = items[:self._limit]
+        return iter([_Snapshot(doc_id, data) for doc_id, data in items])
+
+
+class _Collection(_Query):
+    def add(self, data):
+        self._store.wait()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        data = {key: (now if value is firestore.SERVER_TIMESTAMP else value) for key, value in data.items()}
+        doc_id = f"bench{next(self._store.ids)}"
+        with self._store.lock:
+            self._store.docs[self._collection][doc_id] = data
+        return now, _DocumentRef(self._store, self._collection, doc_id)
+
+    def document(self, doc_id):
+        return _DocumentRef(self._store, self._collection, doc_id)
+
+
+class InMemoryFirestore:
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def wait(self):
+        if FIRESTORE_LATENCY:
+            time.sleep(FIRESTORE_LATENCY)
+
+    def collection(self, name):
+        with self.lock:
+            self.docs.setdefault(name, {})
+        return _Collection(self, name)
+
+
+# --- Patch Firebase Admin before the app imports it ---
+
+credentials.Certificate = lambda path: mock.MagicMock(project_id=PROJECT_ID)
+firebase_admin.initialize_app = lambda *args, **kwargs: None
+firestore.client = lambda *args, **kwargs: InMemoryFirestore()
+
+from app import connect_db, create_app  # noqa: E402
+
+app = create_app()
+
+
+def seed_users(count=SEED_USERS):
+    conn = connect_db()
+    try:
+        conn.executemany("""INSERT OR IGNORE INTO users (username, password_hash, is_subscribed, plan_type)
+                            VALUES (?, 'firebase_managed', 1, 'business')""",
+                         [(f"bench_user_{n}",) for n in range(count)])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+seed_users()
@@ -0,0 +1,130 @@
+# Response compression (brotli / gzip) for HTML and JSON/Markdown payloads.
+#
+# Negotiated from Accept-Encoding (q-values respected), skipped for small bodies,
+# non-text types, event streams, file passthroughs and anything already encoded.
+# Streamed responses are compressed chunk by chunk with a sync flush, so clients
+# still receive data progressively. Levels can be tuned per route:
+#
+#     @app.route('/api/history/export')
+#     @compression.options(gzip_level=1, br_quality=1)
+#     def export_history(): ...
+
+import os
+import zlib
+
+import brotli
+from flask import request
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/markdown', 'text/csv', 'text/xml',
+    'application/json', 'application/javascript', 'application/xml', 'application/x-ndjson',
+    'application/manifest+json', 'image/svg+xml'
+}
+DEFAULT_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+DEFAULT_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', 6))
+DEFAULT_BR_QUALITY = int(os.getenv('COMPRESSION_BR_QUALITY', 4))  # Fast enough for dynamic responses
+
+
+def _gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _brotli_stream(chunks, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class Compression:
+    def __init__(self, app=None, min_size=DEFAULT_MIN_SIZE, gzip_level=DEFAULT_GZIP_LEVEL,
+                 br_quality=DEFAULT_BR_QUALITY):
+        self.defaults = {'min_size': min_size, 'gzip_level': gzip_level, 'br_quality': br_quality,
+                         'enabled': True}
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.after_request(self.after_request)
+
+    # --- Per-route tuning (place directly under @app.route) ---
+
+    def options(self, **overrides):
+        def decorator(f):
+            f._compression_options = overrides
+            return f
+        return decorator
+
+    def exempt(self, f):
+        f._compression_options = {'enabled': False}
+        return f
+
+    def _route_options(self):
+        view = self.app.view_functions.get(request.endpoint)
+        return dict(self.defaults, **getattr(view, '_compression_options', {}))
+
+    # --- Negotiation ---
+
+    def _choose_encoding(self):
+        accepted = request.accept_encodings
+        best = accepted.best_match(['br', 'gzip'])
+        if best and accepted[best] > 0:
+            return best
+        return None
+
+    def _should_skip(self, response):
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return True
+        if 'Content-Encoding' in response.headers or response.direct_passthrough:
+            return True
+        if 'no-transform' in response.headers.get('Cache-Control', ''):
+            return True
+        return response.mimetype not in COMPRESSIBLE_TYPES
+
+    def after_request(self, response):
+        if self._should_skip(response):
+            return response
+        options = self._route_options()
+        if not options['enabled']:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self._choose_encoding()
+        if not encoding:
+            return response
+
+        if response.is_streamed:
+            chunks = response.iter_encoded()
+            if encoding == 'br':
+                response.response = _brotli_stream(chunks, options['br_quality'])
+            else:
+                response.response = _gzip_stream(chunks, options['gzip_level'])
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < options['min_size']:
+                return response
+            if encoding == 'br':
+                compressed = brotli.compress(data, quality=options['br_quality'])
+            else:
+                compressor = zlib.compressobj(options['gzip_level'], zlib.DEFLATED, 31)
+                compressed = compressor.compress(data) + compressor.flush()
+            if len(compressed) >= len(data):
+                return response
+            response.set_data(compressed)
+
+        response.headers['Content-Encoding'] = encoding
+        # Each encoding is a different representation, so it needs its own ETag
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak=weak)
+        return response
@@ -0,0 +1,169 @@
+# Offline verification of Firebase ID tokens.
+#
+# Google's signing certificates are cached in a file shared by every worker on the
+# host and refreshed in a background thread according to the Cache-Control max-age
+# Google sends with them. Verifying a token is then a local RS256 check plus claim
+# validation, with no network call on the login path.
+
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from google.auth import jwt
+
+import http_client
+
+CERT_URL = os.getenv('FIREBASE_CERT_URL',
+                     'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com')
+ISSUER_PREFIX = 'https://securetoken.google.com/'
+
+DEFAULT_MAX_AGE = 3600      # Used when Google sends no usable Cache-Control
+REFRESH_MARGIN = 300        # Refresh this long before the cached certs expire
+RETRY_INTERVAL = 60         # Back-off after a failed refresh
+UNKNOWN_KID_INTERVAL = 60   # At most one on-demand refresh per minute for rotated keys
+CLOCK_SKEW_SECONDS = 10
+
+
+class TokenVerificationError(ValueError):
+    pass
+
+
+class CertificatesUnavailable(Exception):
+    pass
+
+
+class FirebaseTokenVerifier:
+    def __init__(self, project_id, cache_path):
+        self.project_id = project_id
+        self.issuer = ISSUER_PREFIX + (project_id or '')
+        self.cache_path = cache_path
+
+        self._certs = {}
+        self._expires_at = 0
+        self._cache_mtime = 0
+        self._last_fetch = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    # --- Certificate cache ---
+
+    def start(self):
+        # Safe to call repeatedly; a new refresher is started after a fork
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._load_cache_file()
+        if time.time() >= self._expires_at:
+            try:
+                self._fetch()
+            except Exception as e:
+                print(f"Firebase cert prefetch failed: {e}")
+        self._thread = threading.Thread(target=self._refresh_loop, name='firebase-cert-refresh', daemon=True)
+        self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            # Jitter spreads refreshes from several workers sharing the cache file
+            wait = self._expires_at - REFRESH_MARGIN - time.time() + random.uniform(0, 30)
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                # Another worker may already have refreshed the shared file
+                self._load_cache_file()
+                if self._expires_at - REFRESH_MARGIN <= time.time():
+                    self._fetch()
+            except Exception as e:
+                print(f"Firebase cert refresh failed: {e}")
+                time.sleep(RETRY_INTERVAL)
+
+    def _load_cache_file(self):
+        try:
+            mtime = os.stat(self.cache_path).st_mtime
+        except OSError:
+            return
+        if mtime == self._cache_mtime:
+            return
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+            with self._lock:
+                self._certs = cached['certs']
+                self._expires_at = cached['expires_at']
+                self._cache_mtime = mtime
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable Firebase cert cache: {e}")
+
+    def _fetch(self):
+        self._last_fetch = time.time()
+        response = http_client.get('google_certs', CERT_URL, retries=1)
+        response.raise_for_status()
+        certs = response.json()
+
+        max_age = DEFAULT_MAX_AGE
+        match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+        if match:
+            max_age = int(match.group(1)) - int(response.headers.get('Age', 0) or 0)
+        expires_at = time.time() + max(max_age, REFRESH_MARGIN + RETRY_INTERVAL)
+
+        # Atomic replace so other workers never read a half-written file
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'certs': certs, 'expires_at': expires_at}, f)
+        os.replace(tmp_path, self.cache_path)
+
+        with self._lock:
+            self._certs = certs
+            self._expires_at = expires_at
+            self._cache_mtime = os.stat(self.cache_path).st_mtime
+
+    def certs(self):
+        self._load_cache_file()
+        return self._certs
+
+    # --- Verification ---
+
+    def verify(self, id_token):
+        if not self.project_id:
+            raise CertificatesUnavailable('Firebase project ID is not configured')
+        try:
+            header = jwt.decode_header(id_token)
+        except ValueError as e:
+            raise TokenVerificationError(f'Malformed ID token: {e}')
+
+        if header.get('alg') != 'RS256':
+            raise TokenVerificationError(f'Unexpected token algorithm "{header.get("alg")}"')
+        kid = header.get('kid')
+        if not kid:
+            raise TokenVerificationError('ID token has no "kid" header')
+
+        certs = self.certs()
+        if not certs:
+            raise CertificatesUnavailable('No cached Firebase signing certificates')
+        if kid not in certs and time.time() - self._last_fetch > UNKNOWN_KID_INTERVAL:
+            # Google rotated keys ahead of our schedule; refresh once and retry
+            try:
+                self._fetch()
+                certs = self._certs
+            except Exception as e:
+                print(f"Firebase cert refresh for unknown kid failed: {e}")
+
+        try:
+            claims = jwt.decode(id_token, certs=certs, audience=self.project_id,
+                                clock_skew_in_seconds=CLOCK_SKEW_SECONDS)
+        except ValueError as e:
+            raise TokenVerificationError(str(e))
+
+        if claims.get('iss') != self.issuer:
+            raise TokenVerificationError(f'Unexpected token issuer "{claims.get("iss")}"')
+        subject = claims.get('sub')
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise TokenVerificationError('ID token has an invalid "sub" claim')
+        if claims.get('auth_time', 0) > time.time() + CLOCK_SKEW_SECONDS:
+            raise TokenVerificationError('ID token "auth_time" is in the future')
+
+        claims['uid'] = subject
+        return claims
@@ -0,0 +1,46 @@
+# Gunicorn settings: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# With preload_app the master imports the app once (config, templates, SQLite
+# schema) and workers fork from it, sharing that memory. Anything that isn't
+# fork-safe (Firestore/OpenAI clients, background threads) is created per worker.
+import os
+import tempfile
+
+from dotenv import load_dotenv
+
+# GUNICORN_* may live in .env like the app's own settings
+load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
+bind = os.getenv('GUNICORN_BIND', 'unix:manager-ai.sock')
+umask = 0o007
+workers = int(os.getenv('GUNICORN_WORKERS', 3))
+# gthread keeps a long-lived SSE stream (/admin/events) from blocking a whole worker
+worker_class = 'gthread'
+# Model calls wait for OpenRouter on these threads (ai_scheduler.py sizes its queue from them)
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+os.environ['GUNICORN_THREADS'] = str(threads)
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+# Workers write their Prometheus samples here; /metrics merges them (see metrics.py).
+# Set before the app (and prometheus_client) is imported.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'manager-ai-metrics'))
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+
+def on_starting(server):
+    # Files left by a previous run would be merged into the fresh counters
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    for name in os.listdir(metrics_dir):
+        os.remove(os.path.join(metrics_dir, name))
+
+
+def post_worker_init(worker):
+    # Runs in each worker once the app is loaded (inherited or imported)
+    from app import start_worker_services
+    start_worker_services()
+
+
+def child_exit(server, worker):
+    # Drops the dead worker's live gauges (in-flight requests)
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,181 @@
+# Shared outbound HTTP layer for Paystack, Google certs, OpenRouter and Cloudinary.
+#
+# - One pooled keep-alive session per process (re-created after fork), so repeat
+#   calls to the same host skip the TCP/TLS handshake.
+# - Every call gets a per-service (connect, read) timeout; nothing can hang a worker.
+# - Bounded retries with full-jitter backoff. Connect timeouts are always safe to
+#   retry (nothing was sent); other failures and 5xx only for idempotent methods.
+# - Per-host latency/error counters, readable via latency_snapshot().
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+SERVICE_TIMEOUTS = {
+    # service: (connect seconds, read seconds)
+    'paystack': (3.05, 15),
+    'google_certs': (3.05, 10),
+    'openrouter': (5, float(os.getenv('OPENROUTER_READ_TIMEOUT', 60))),
+    'cloudinary': (5, 60),
+}
+DEFAULT_TIMEOUT = (3.05, 20)
+
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 2.0
+RETRY_STATUSES = {429, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+_stats = {}
+_stats_lock = threading.Lock()
+_observers = []
+
+
+def get_session():
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session, _session_pid = session, os.getpid()
+    return _session
+
+
+# --- Latency metrics ---
+
+def add_observer(callback):
+    # callback(service, host, seconds, error) is called after every outbound call
+    _observers.append(callback)
+
+
+def record(service, host, seconds, error=False):
+    with _stats_lock:
+        stats = _stats.setdefault(host, {'service': service, 'count': 0, 'errors': 0,
+                                         'total_ms': 0.0, 'max_ms': 0.0})
+        ms = seconds * 1000
+        stats['count'] += 1
+        stats['total_ms'] += ms
+        stats['max_ms'] = max(stats['max_ms'], ms)
+        if error:
+            stats['errors'] += 1
+    for callback in _observers:
+        try:
+            callback(service, host, seconds, error)
+        except Exception as e:
+            print(f"HTTP metrics observer error: {e}")
+
+
+def latency_snapshot():
+    with _stats_lock:
+        return {
+            host: dict(stats, avg_ms=round(stats['total_ms'] / stats['count'], 2) if stats['count'] else 0)
+            for host, stats in _stats.items()
+        }
+
+
+@contextmanager
+def track(service, host):
+    # For SDK calls we can't route through the session (e.g. Cloudinary uploads)
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record(service, host, time.perf_counter() - started, error)
+
+
+# --- Requests ---
+
+def _backoff(attempt):
+    time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt))))
+
+
+def request(service, method, url, retries=MAX_RETRIES, **kwargs):
+    method = method.upper()
+    kwargs.setdefault('timeout', SERVICE_TIMEOUTS.get(service, DEFAULT_TIMEOUT))
+    host = urlparse(url).netloc
+    idempotent = method in IDEMPOTENT_METHODS
+
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except requests.exceptions.ConnectTimeout:
+            # Never reached the server, so retrying is safe for any method
+            record(service, host, time.perf_counter() - started, error=True)
+            if attempt >= retries:
+                raise
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            # The request may have been processed; only retry when idempotent
+            record(service, host, time.perf_counter() - started, error=True)
+            if attempt >= retries or not idempotent:
+                raise
+        else:
+            failed = response.status_code >= 500
+            record(service, host, time.perf_counter() - started, error=failed)
+            if response.status_code not in RETRY_STATUSES or attempt >= retries or not idempotent:
+                return response
+        attempt += 1
+        _backoff(attempt)
+
+
+def get(service, url, **kwargs):
+    return request(service, 'GET', url, **kwargs)
+
+
+def post(service, url, **kwargs):
+    return request(service, 'POST', url, **kwargs)
+
+
+# --- OpenAI SDK (httpx) ---
+
+def httpx_timeout(service):
+    connect, read = SERVICE_TIMEOUTS.get(service, DEFAULT_TIMEOUT)
+    return httpx.Timeout(read, connect=connect)
+
+
+class TrackedTransport(httpx.BaseTransport):
+    # Times every request at the transport, so connect errors and timeouts are
+    # recorded too (response event hooks only see requests that got an answer)
+    def __init__(self, service, transport):
+        self.service = service
+        self.transport = transport
+
+    def handle_request(self, req):
+        started = time.perf_counter()
+        try:
+            response = self.transport.handle_request(req)
+        except Exception:
+            record(self.service, req.url.host, time.perf_counter() - started, error=True)
+            raise
+        record(self.service, req.url.host, time.perf_counter() - started, error=response.status_code >= 500)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+def build_httpx_client(service):
+    limits = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60)
+    return httpx.Client(
+        timeout=httpx_timeout(service),
+        transport=TrackedTransport(service, httpx.HTTPTransport(limits=limits))
+    )
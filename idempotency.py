@@ -0,0 +1,173 @@
+# Idempotency-Key support for endpoints that cost money or create records.
+#
+# A client that may retry (flaky mobile connections) sends the same
+# Idempotency-Key header with every attempt of one logical request. The first
+# attempt claims the key in the `idempotency_keys` table of the main database,
+# so a retry that lands on another worker (or node) sees it, runs the view and
+# stores the response. Repeats within the TTL get that stored response back,
+# marked `Idempotent-Replayed: true`, without running the view again. A repeat
+# that arrives while the first attempt is still running waits for its result
+# instead of starting a second one.
+#
+# Keys are scoped per user and endpoint. Reusing a key with a different request
+# is rejected with 422. Server errors (5xx) and 429s are not stored, so
+# retrying after those runs the request again.
+
+import hashlib
+import os
+import time
+from functools import wraps
+
+from flask import Response, jsonify, make_response, request, session
+
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', 24 * 3600))   # Seconds a stored response is replayed
+PENDING_TIMEOUT = 180           # A claim older than this without a response is considered abandoned
+WAIT_SECONDS = 20               # How long a repeat waits for the first attempt to finish
+WAIT_INTERVAL = 0.25
+CLEANUP_INTERVAL = 600
+MAX_KEY_LENGTH = 255
+
+SQLITE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS idempotency_keys
+       (user_id INTEGER NOT NULL,
+        endpoint TEXT NOT NULL,
+        key TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        status_code INTEGER,
+        body TEXT,
+        content_type TEXT,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (user_id, endpoint, key))''',
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)",
+]
+
+
+class IdempotencyStore:
+    def __init__(self, connect, ttl=IDEMPOTENCY_TTL):
+        self.connect = connect
+        self.ttl = ttl
+        self._last_cleanup = 0
+
+    def idempotent(self, f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key', '').strip()
+            if not key:
+                return f(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH or not key.isprintable():
+                return jsonify({"error": "INVALID_IDEMPOTENCY_KEY",
+                                "message": f"Idempotency-Key must be at most {MAX_KEY_LENGTH} printable characters"}), 400
+
+            scope = (session['user_id'], request.endpoint, key)
+            fingerprint = hashlib.sha256(request.method.encode() + b' ' + request.path.encode() + b'\n'
+                                         + request.get_data()).hexdigest()
+            for _ in range(3):
+                try:
+                    claimed, stored_fingerprint = self._claim(scope, fingerprint)
+                except Exception as e:
+                    # Never let the bookkeeping take the endpoint down
+                    print(f"Idempotency store unavailable ({e}); handling request without it.")
+                    return f(*args, **kwargs)
+                if claimed:
+                    return self._run(scope, f, args, kwargs)
+                if stored_fingerprint != fingerprint:
+                    return jsonify({"error": "IDEMPOTENCY_KEY_REUSED",
+                                    "message": "This Idempotency-Key was already used for a different request."}), 422
+                state, stored = self._wait(scope)
+                if state == 'done':
+                    status_code, body, content_type = stored
+                    response = Response(body, status=status_code, content_type=content_type)
+                    response.headers['Idempotent-Replayed'] = 'true'
+                    return response
+                if state == 'pending':
+                    break
+                # 'gone': the first attempt failed and let go of the key, so claim it again
+
+            response = jsonify({"error": "REQUEST_IN_PROGRESS",
+                                "message": "The original request is still being processed."})
+            response.status_code = 409
+            response.headers['Retry-After'] = '2'
+            return response
+        return decorated
+
+    def _run(self, scope, f, args, kwargs):
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            self._release(scope)
+            raise
+        if response.status_code >= 500 or response.status_code == 429 or response.is_streamed:
+            self._release(scope)
+        else:
+            self._store(scope, response)
+        return response
+
+    # --- Storage ---
+
+    def _claim(self, scope, fingerprint):
+        # Returns (claimed, fingerprint of the existing claim)
+        now = time.time()
+        conn = self.connect()
+        try:
+            c = conn.cursor()
+            if now - self._last_cleanup > CLEANUP_INTERVAL:
+                self._last_cleanup = now
+                c.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+            # An expired entry, or a claim whose worker died, no longer holds the key
+            c.execute('''DELETE FROM idempotency_keys WHERE user_id = ? AND endpoint = ? AND key = ?
+                         AND (expires_at < ? OR (status_code IS NULL AND created_at < ?))''',
+                      (*scope, now, now - PENDING_TIMEOUT))
+            c.execute('''INSERT OR IGNORE INTO idempotency_keys
+                             (user_id, endpoint, key, fingerprint, created_at, expires_at)
+                         VALUES (?, ?, ?, ?, ?, ?)''', (*scope, fingerprint, now, now + self.ttl))
+            claimed = c.rowcount == 1
+            existing = None
+            if not claimed:
+                c.execute("SELECT fingerprint FROM idempotency_keys WHERE user_id = ? AND endpoint = ? AND key = ?", scope)
+                row = c.fetchone()
+                existing = row[0] if row else None
+            conn.commit()
+        finally:
+            conn.close()
+        return claimed, existing
+
+    def _store(self, scope, response):
+        conn = self.connect()
+        try:
+            conn.execute('''UPDATE idempotency_keys SET status_code = ?, body = ?, content_type = ?
+                            WHERE user_id = ? AND endpoint = ? AND key = ?''',
+                         (response.status_code, response.get_data(as_text=True), response.content_type, *scope))
+            conn.commit()
+        except Exception as e:
+            print(f"Idempotency store: could not save response ({e})")
+        finally:
+            conn.close()
+
+    def _release(self, scope):
+        conn = self.connect()
+        try:
+            conn.execute("DELETE FROM idempotency_keys WHERE user_id = ? AND endpoint = ? AND key = ?", scope)
+            conn.commit()
+        except Exception as e:
+            print(f"Idempotency store: could not release key ({e})")
+        finally:
+            conn.close()
+
+    def _wait(self, scope):
+        # ('done', (status, body, content type)), ('pending', None) or ('gone', None)
+        deadline = time.monotonic() + WAIT_SECONDS
+        while True:
+            conn = self.connect()
+            try:
+                row = conn.execute('''SELECT status_code, body, content_type FROM idempotency_keys
+                                      WHERE user_id = ? AND endpoint = ? AND key = ?''', scope).fetchone()
+            finally:
+                conn.close()
+            if not row:
+                return 'gone', None
+            if row[0] is not None:
+                return 'done', row
+            if time.monotonic() >= deadline:
+                return 'pending', None
+            time.sleep(WAIT_INTERVAL)
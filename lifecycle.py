@@ -0,0 +1,60 @@
+# Process lifecycle helpers: per-process lazy clients and a startup timing report.
+#
+# Firestore (gRPC) and the OpenAI client (httpx) own sockets and background threads
+# that don't survive fork(). Wrapping them in ProcessLocal defers construction to
+# their first use inside each worker, so gunicorn can preload the app in the master
+# (imports, config, templates, schema) and fork cheap, memory-sharing workers.
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupReport:
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def timed(self, label):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((os.getpid(), label, time.perf_counter() - started))
+
+    def summary(self, title):
+        # Phases inherited from the master are listed with its pid
+        lines = [f"{title} (pid {os.getpid()}):"]
+        for pid, label, seconds in self.phases:
+            lines.append(f"  {label:<24} {seconds * 1000:8.1f} ms  [pid {pid}]")
+        return '\n'.join(lines)
+
+
+startup = StartupReport()
+
+
+class ProcessLocal:
+    # Lazy proxy: attribute access builds the client on first use in each process
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._instance = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    started = time.perf_counter()
+                    self._instance = self._factory()
+                    self._pid = pid
+                    elapsed = time.perf_counter() - started
+                    startup.phases.append((pid, f"{self._name} client", elapsed))
+                    print(f"{self._name} client ready in {elapsed * 1000:.0f} ms (pid {pid}).")
+        return self._instance
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
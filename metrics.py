@@ -0,0 +1,123 @@
+# Prometheus metrics for routes, SQLite and upstream services.
+#
+# Under gunicorn, gunicorn.conf.py points PROMETHEUS_MULTIPROC_DIR at a directory
+# that is cleared on startup; every worker writes its samples there and /metrics
+# merges them, so the numbers cover the whole server rather than one worker. The
+# variable must be set before prometheus_client is imported. Without it (flask run)
+# the process-local registry is exported instead.
+#
+# Route latency is measured until the view returns, so for streamed responses
+# (exports, /admin/events) it is time to first byte. SQLite timings are recorded
+# by the instrumented connections in query_log.py.
+
+import os
+import time
+
+from flask import g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+import http_client
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route',
+    ['method', 'endpoint', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'Requests currently being handled, by route',
+    ['method', 'endpoint'], multiprocess_mode='livesum'
+)
+DB_QUERY_LATENCY = Histogram(
+    'sqlite_query_duration_seconds', 'SQLite statement execution time, by statement type',
+    ['operation'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+DB_QUERY_ERRORS = Counter(
+    'sqlite_query_errors_total', 'SQLite statements that raised, by statement type', ['operation']
+)
+UPSTREAM_LATENCY = Histogram(
+    'upstream_request_duration_seconds', 'Outbound call latency, by service',
+    ['service'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+UPSTREAM_ERRORS = Counter(
+    'upstream_errors_total', 'Outbound calls that failed, by service', ['service']
+)
+AI_SLOTS_IN_USE = Gauge(
+    'ai_scheduler_in_flight', 'Model calls currently running', multiprocess_mode='livesum'
+)
+AI_QUEUED = Gauge(
+    'ai_scheduler_queued', 'Model calls waiting for a slot', multiprocess_mode='livesum'
+)
+AI_CONCURRENCY_LIMIT = Gauge(
+    'ai_scheduler_concurrency_limit', 'Adaptive limit on concurrent model calls', multiprocess_mode='livesum'
+)
+AI_QUEUE_WAIT = Histogram(
+    'ai_scheduler_queue_wait_seconds', 'Time a model call waited for a slot, by plan',
+    ['plan'],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60)
+)
+AI_SHED = Counter(
+    'ai_scheduler_shed_total', 'Model calls turned away with 503, by plan and reason', ['plan', 'reason']
+)
+AI_TOKENS = Counter(
+    'ai_tokens_total', 'Tokens reported by the model provider, by policy (mode/plan) and kind', ['policy', 'kind']
+)
+AI_TRUNCATED = Counter(
+    'ai_truncated_total', 'Answers cut off by their max_tokens budget, by policy', ['policy']
+)
+AI_FAILED = Counter(
+    'ai_failed_total', 'Model calls that raised, by policy and error type', ['policy', 'error']
+)
+AI_INPUT_BUDGET = Counter(
+    'ai_input_budget_total', 'Prompt inputs trimmed or rejected by token_budget, by mode and field',
+    ['mode', 'field', 'action']
+)
+
+
+# --- Upstream services (fed by http_client) ---
+
+def observe_upstream(service, host, seconds, error):
+    UPSTREAM_LATENCY.labels(service).observe(seconds)
+    if error:
+        UPSTREAM_ERRORS.labels(service).inc()
+
+
+# --- Flask ---
+
+def _labels():
+    return request.method, request.endpoint or 'unmatched'
+
+
+def init_app(app):
+    http_client.add_observer(observe_upstream)
+
+    @app.before_request
+    def start_request_timer():
+        g._metrics_started = time.perf_counter()
+        g._metrics_in_progress = _labels()
+        REQUESTS_IN_PROGRESS.labels(*g._metrics_in_progress).inc()
+
+    @app.after_request
+    def record_request_latency(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            REQUEST_LATENCY.labels(*_labels(), str(response.status_code)).observe(time.perf_counter() - started)
+        return response
+
+    @app.teardown_request
+    def finish_request(exc):
+        # Skipped when an earlier before_request hook answered first
+        labels = g.pop('_metrics_in_progress', None)
+        if labels:
+            REQUESTS_IN_PROGRESS.labels(*labels).dec()
+
+
+def render():
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,160 @@
+# In-memory cache for pages that render identically for every anonymous visitor.
+#
+# Sits in front of the Flask app as WSGI middleware, so a hit skips routing, the
+# view, Talisman's header work and compression entirely. Only GET/HEAD requests
+# without a query string or session cookie are eligible, and only 200 responses
+# that don't set cookies are stored. Entries are keyed on path, scheme and the
+# negotiated content encoding, carry an ETag and Last-Modified (the deploy time),
+# and answer conditional requests with 304. A deploy restarts the workers, which
+# starts every cache empty; entries also expire after a TTL. Cached pages are sent
+# with `no-cache`, so browsers revalidate (cheaply) instead of reusing an anonymous
+# copy after the visitor logs in.
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header, parse_cookie
+
+HOP_HEADERS = {'set-cookie', 'date', 'etag', 'last-modified'}
+NOT_MODIFIED_HEADERS = {'cache-control', 'vary', 'etag', 'last-modified', 'content-location'}
+
+
+def deploy_timestamp(*paths):
+    # Newest mtime among the files that shape the cached pages (code, templates, assets)
+    latest = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in files:
+                    latest = max(latest, os.stat(os.path.join(root, name)).st_mtime)
+        elif os.path.exists(path):
+            latest = max(latest, os.stat(path).st_mtime)
+    return latest or time.time()
+
+
+class AnonymousPageCache:
+    def __init__(self, wsgi_app, paths, session_cookie_name='session', deploy_time=None,
+                 ttl=300, max_entries=128):
+        self.wsgi_app = wsgi_app
+        self.paths = set(paths)
+        self.session_cookie_name = session_cookie_name
+        self.deploy_time = int(deploy_time or time.time())
+        self.last_modified = formatdate(self.deploy_time, usegmt=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # --- Eligibility & keys ---
+
+    def _is_cacheable_request(self, environ):
+        if environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return False
+        if environ.get('PATH_INFO') not in self.paths or environ.get('QUERY_STRING'):
+            return False
+        return self.session_cookie_name not in parse_cookie(environ.get('HTTP_COOKIE', ''))
+
+    def _cache_key(self, environ):
+        # Same negotiation as compression.py, so one entry per representation it can produce
+        accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING', ''), Accept)
+        encoding = accepted.best_match(['br', 'gzip'])
+        if not encoding or accepted[encoding] <= 0:
+            encoding = 'identity'
+        scheme = environ.get('HTTP_X_FORWARDED_PROTO', environ.get('wsgi.url_scheme', 'http'))
+        return (environ['PATH_INFO'], scheme, encoding)
+
+    # --- Conditional requests ---
+
+    def _not_modified(self, environ, entry):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            return entry['etag'] in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() >= self.deploy_time
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _serve(self, environ, start_response, entry):
+        if self._not_modified(environ, entry):
+            headers = [(k, v) for k, v in entry['headers'] if k.lower() in NOT_MODIFIED_HEADERS]
+            start_response('304 Not Modified', headers)
+            return [b'']
+        start_response(entry['status'], entry['headers'])
+        return [b''] if environ['REQUEST_METHOD'] == 'HEAD' else [entry['body']]
+
+    # --- WSGI ---
+
+    def __call__(self, environ, start_response):
+        if not self._is_cacheable_request(environ):
+            return self.wsgi_app(environ, start_response)
+
+        key = self._cache_key(environ)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['expires_at'] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                entry = None
+                self.misses += 1
+        if entry:
+            return self._serve(environ, start_response, entry)
+
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            return start_response(status, headers, exc_info) if exc_info else (lambda data: None)
+
+        # HEAD bodies are empty; render the page as a GET so the entry is usable for both
+        render_environ = dict(environ, REQUEST_METHOD='GET')
+        result = self.wsgi_app(render_environ, capture_start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        headers = captured['headers']
+        header_names = {k.lower(): v for k, v in headers}
+        storable = (captured['status'].startswith('200')
+                    and 'set-cookie' not in header_names
+                    and 'no-store' not in header_names.get('cache-control', '')
+                    and 'private' not in header_names.get('cache-control', ''))
+        if not storable:
+            start_response(captured['status'], headers)
+            return [b''] if environ['REQUEST_METHOD'] == 'HEAD' else [body]
+
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+        headers = [(k, v) for k, v in headers if k.lower() not in HOP_HEADERS]
+        headers += [('ETag', etag), ('Last-Modified', self.last_modified)]
+        if 'cache-control' not in header_names:
+            headers.append(('Cache-Control', 'no-cache'))
+        entry = {'status': captured['status'], 'headers': headers, 'body': body,
+                 'etag': etag, 'expires_at': now + self.ttl}
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return self._serve(environ, start_response, entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,389 @@
+# PostgreSQL storage backend (DATABASE_URL=postgresql://...), so several app
+# nodes can share one database instead of the local content_ideas.db file.
+#
+# The app's SQL is written for SQLite. PostgresDatabase hands out pooled psycopg
+# connections behind a small sqlite3-style adapter (cursor/execute/fetch*/
+# lastrowid/commit/close) that rewrites the few SQLite-isms the app relies on:
+#   ?                 -> %s placeholders (? is never used inside string literals)
+#   INSERT OR IGNORE  -> INSERT ... ON CONFLICT DO NOTHING
+#   BEGIN IMMEDIATE   -> a transaction-scoped advisory lock; like SQLite's write
+#                        lock it serialises the payment/approval critical sections
+#   lastrowid         -> INSERT ... RETURNING id on tables with a serial id
+# Transactions follow sqlite3's rules: reads run in autocommit, the first write
+# (or BEGIN IMMEDIATE) opens a transaction that lasts until commit()/rollback(),
+# so a long-polling reader never sits idle in a transaction. Sessions run in UTC
+# and timestamps come back as 'YYYY-MM-DD HH:MM:SS' text, as SQLite returns them.
+#
+# Where PostgreSQL behaves differently (see SCHEMA):
+# - History search uses a generated tsvector column with a GIN index instead of
+#   the FTS5 table: ts_rank/ts_headline stand in for bm25()/snippet(), and the
+#   'simple' configuration does not strip diacritics.
+# - The admin_events triggers are PL/pgSQL functions.
+# - Foreign keys are declared but not enforced by SQLite, and the app relies on
+#   that (deleting a user keeps their payment records), so the user_id columns
+#   here are plain indexed integers.
+# - Rate limits and the shared state store stay local to each node; point
+#   RATELIMIT_STORAGE_URI at a shared backend when running more than one.
+
+import functools
+import os
+import re
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import psycopg
+from psycopg.adapt import Loader
+from psycopg.rows import namedtuple_row
+from psycopg_pool import ConnectionPool
+
+import metrics
+import query_log
+from lifecycle import ProcessLocal
+
+PG_POOL_MIN = int(os.getenv('PG_POOL_MIN', 1))
+PG_POOL_MAX = int(os.getenv('PG_POOL_MAX', 10))
+PG_POOL_TIMEOUT = float(os.getenv('PG_POOL_TIMEOUT', 10))   # Seconds to wait for a free connection
+
+WRITE_LOCK_KEY = 0x4D414931     # Advisory lock standing in for SQLite's single writer
+SCHEMA_LOCK_KEY = 0x4D414932
+SERIAL_TABLES = {'users', 'ideas', 'submissions', 'payment_requests', 'admin_events'}
+OPENS_TRANSACTION = {'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'BEGIN'}
+
+Error = psycopg.Error
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users
+       (id SERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        is_subscribed INTEGER DEFAULT 0,
+        is_admin INTEGER DEFAULT 0,
+        subscription_start TIMESTAMP,
+        plan_type TEXT DEFAULT 'free',
+        brand_tone TEXT)''',
+
+    # `search` replaces the FTS5 ideas_fts table: content weighs more than business type
+    '''CREATE TABLE IF NOT EXISTS ideas
+       (id SERIAL PRIMARY KEY,
+        user_id INTEGER,
+        business_type TEXT,
+        idea_content TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        mode TEXT DEFAULT 'idea',
+        doc_id TEXT,
+        hidden INTEGER DEFAULT 0,
+        search TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', COALESCE(idea_content, '')), 'A') ||
+            setweight(to_tsvector('simple', COALESCE(business_type, '')), 'B')) STORED)''',
+    "CREATE INDEX IF NOT EXISTS idx_ideas_doc_id ON ideas(doc_id)",
+    "CREATE INDEX IF NOT EXISTS idx_ideas_user_id ON ideas(user_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_ideas_search ON ideas USING GIN (search) WHERE COALESCE(hidden, 0) = 0",
+
+    '''CREATE TABLE IF NOT EXISTS submissions
+       (id SERIAL PRIMARY KEY,
+        user_id INTEGER,
+        username TEXT,
+        full_name TEXT,
+        plan_type TEXT,
+        screenshot_path TEXT,
+        status TEXT DEFAULT 'pending',
+        admin_note TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+    "CREATE INDEX IF NOT EXISTS idx_submissions_user_id ON submissions(user_id)",
+
+    '''CREATE TABLE IF NOT EXISTS payment_requests
+       (id SERIAL PRIMARY KEY,
+        user_id INTEGER,
+        username TEXT,
+        plan_type TEXT,
+        preferred_method TEXT,
+        contact_method TEXT,
+        contact_info TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+
+    '''CREATE TABLE IF NOT EXISTS payment_events
+       (reference TEXT PRIMARY KEY,
+        user_id INTEGER,
+        plan_type TEXT,
+        amount INTEGER,
+        status TEXT DEFAULT 'pending',
+        source TEXT,
+        payload TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        processed_at TIMESTAMP)''',
+
+    '''CREATE TABLE IF NOT EXISTS admin_events
+       (id SERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        ref_id INTEGER,
+        payload TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''',
+
+    # idempotency.SQLITE_SCHEMA
+    '''CREATE TABLE IF NOT EXISTS idempotency_keys
+       (user_id INTEGER NOT NULL,
+        endpoint TEXT NOT NULL,
+        key TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        status_code INTEGER,
+        body TEXT,
+        content_type TEXT,
+        created_at DOUBLE PRECISION NOT NULL,
+        expires_at DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (user_id, endpoint, key))''',
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency_keys(expires_at)",
+
+    # ai_policy.SQLITE_SCHEMA
+    '''CREATE TABLE IF NOT EXISTS ai_usage
+       (id SERIAL PRIMARY KEY,
+        created_at DOUBLE PRECISION NOT NULL,
+        user_id INTEGER,
+        plan TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        policy TEXT NOT NULL,
+        model TEXT,
+        max_tokens INTEGER,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        truncated INTEGER DEFAULT 0,
+        elapsed_ms INTEGER,
+        error TEXT)''',
+    "ALTER TABLE ai_usage ADD COLUMN IF NOT EXISTS error TEXT",
+    "CREATE INDEX IF NOT EXISTS idx_ai_usage_created ON ai_usage(created_at)",
+
+    # Same events as the SQLite triggers in app.init_admin_events
+    '''CREATE OR REPLACE FUNCTION admin_events_submission() RETURNS trigger AS $$
+       BEGIN
+           IF TG_OP = 'INSERT' THEN
+               INSERT INTO admin_events (kind, ref_id, payload) VALUES ('submission_created', NEW.id,
+                   json_build_object('id', NEW.id, 'username', NEW.username, 'full_name', NEW.full_name,
+                                     'plan_type', NEW.plan_type, 'screenshot_path', NEW.screenshot_path,
+                                     'status', NEW.status,
+                                     'timestamp', to_char(NEW.timestamp, 'YYYY-MM-DD HH24:MI:SS'))::text);
+           ELSIF NEW.status IS DISTINCT FROM OLD.status
+                 OR NEW.screenshot_path IS DISTINCT FROM OLD.screenshot_path THEN
+               INSERT INTO admin_events (kind, ref_id, payload) VALUES ('submission_updated', NEW.id,
+                   json_build_object('id', NEW.id, 'status', NEW.status,
+                                     'screenshot_path', NEW.screenshot_path)::text);
+           END IF;
+           RETURN NULL;
+       END $$ LANGUAGE plpgsql''',
+    '''CREATE OR REPLACE FUNCTION admin_events_payment_request() RETURNS trigger AS $$
+       BEGIN
+           INSERT INTO admin_events (kind, ref_id, payload) VALUES ('payment_request_created', NEW.id,
+               json_build_object('id', NEW.id, 'username', NEW.username, 'plan_type', NEW.plan_type,
+                                 'preferred_method', NEW.preferred_method, 'contact_method', NEW.contact_method,
+                                 'contact_info', NEW.contact_info,
+                                 'timestamp', to_char(NEW.timestamp, 'YYYY-MM-DD HH24:MI:SS'))::text);
+           RETURN NULL;
+       END $$ LANGUAGE plpgsql''',
+    "DROP TRIGGER IF EXISTS admin_events_submission ON submissions",
+    '''CREATE TRIGGER admin_events_submission AFTER INSERT OR UPDATE OF status, screenshot_path ON submissions
+       FOR EACH ROW EXECUTE FUNCTION admin_events_submission()''',
+    "DROP TRIGGER IF EXISTS admin_events_payment_request ON payment_requests",
+    '''CREATE TRIGGER admin_events_payment_request AFTER INSERT ON payment_requests
+       FOR EACH ROW EXECUTE FUNCTION admin_events_payment_request()''',
+
+    # Clients only ever need recent events
+    "DELETE FROM admin_events WHERE created_at < CURRENT_TIMESTAMP - INTERVAL '2 days'",
+]
+
+
+# --- SQL translation ---
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql):
+    # Returns (postgres_sql, returns_id)
+    head = sql.lstrip()
+    if re.match(r'BEGIN\s+IMMEDIATE\b', head, re.IGNORECASE):
+        return f"SELECT pg_advisory_xact_lock({WRITE_LOCK_KEY})", False
+    sql = sql.rstrip().rstrip(';')
+    if re.match(r'INSERT\s+OR\s+IGNORE\s+INTO\b', head, re.IGNORECASE):
+        sql = re.sub(r'INSERT\s+OR\s+IGNORE\s+INTO', 'INSERT INTO', sql, count=1, flags=re.IGNORECASE)
+        sql += ' ON CONFLICT DO NOTHING'
+    returns_id = False
+    insert = re.match(r'\s*INSERT\s+INTO\s+(\w+)', sql, re.IGNORECASE)
+    if insert and insert.group(1).lower() in SERIAL_TABLES and not re.search(r'\bRETURNING\b', sql, re.IGNORECASE):
+        sql += ' RETURNING id'
+        returns_id = True
+    return sql.replace('%', '%%').replace('?', '%s'), returns_id
+
+
+def _explain(pg_conn, sql, params):
+    with pg_conn.cursor() as cur:
+        cur.execute('EXPLAIN ' + sql, params)
+        lines = [row[0] for row in cur.fetchall()]
+    return '\n'.join(lines), any('Seq Scan' in line for line in lines)
+
+
+class _SqliteTimestampLoader(Loader):
+    # '2026-01-31 09:15:02.123456' -> '2026-01-31 09:15:02', SQLite's CURRENT_TIMESTAMP format
+    def load(self, data):
+        return bytes(data[:19]).decode()
+
+
+# --- sqlite3-style adapter ---
+
+class Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection._conn.cursor(row_factory=namedtuple_row) if connection.row_factory \
+            else connection._conn.cursor()
+        self.lastrowid = None
+
+    def _begin(self, sql):
+        if (query_log.operation(sql) in OPENS_TRANSACTION
+                and self.connection._conn.info.transaction_status == psycopg.pq.TransactionStatus.IDLE):
+            self._cursor.execute('BEGIN')
+
+    def execute(self, sql, parameters=()):
+        statement, returns_id = translate(sql)
+        params = tuple(parameters)
+        query = query_log.new_query(sql, params)
+        started = time.perf_counter()
+        try:
+            self._begin(sql)
+            self._cursor.execute(statement, params)
+        except psycopg.Error:
+            metrics.DB_QUERY_ERRORS.labels(query_log.operation(sql)).inc()
+            raise
+        query['elapsed'] = time.perf_counter() - started
+        query['rows'] = max(self._cursor.rowcount, 0)
+        if returns_id:
+            row = self._cursor.fetchone()     # None when ON CONFLICT skipped the insert
+            self.lastrowid = row[0] if row else None
+        query_log.observe(query, lambda: _explain(self.connection._conn, statement, params))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        statement, _ = translate(sql)
+        statement = re.sub(r' RETURNING id$', '', statement)
+        seq_of_parameters = [tuple(p) for p in seq_of_parameters]
+        query = query_log.new_query(sql, seq_of_parameters[0] if seq_of_parameters else ())
+        started = time.perf_counter()
+        try:
+            self._begin(sql)
+            self._cursor.executemany(statement, seq_of_parameters)
+        except psycopg.Error:
+            metrics.DB_QUERY_ERRORS.labels(query_log.operation(sql)).inc()
+            raise
+        query['elapsed'] = time.perf_counter() - started
+        query['rows'] = max(self._cursor.rowcount, 0)
+        query_log.observe(query, lambda: _explain(self.connection._conn, statement, query['params']))
+        return self
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    def __init__(self, database, conn):
+        self._database = database
+        self._conn = conn
+        self.row_factory = None     # Set to sqlite3.Row (any truthy value) for named rows
+
+    def cursor(self):
+        return Cursor(self)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        # Like sqlite3, closing without commit() discards the transaction
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        if conn.info.transaction_status != psycopg.pq.TransactionStatus.IDLE:
+            conn.rollback()
+        self._database.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # sqlite3 semantics: commit or roll back, but don't close
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+# --- Pool ---
+
+class PostgresDatabase:
+    Error = psycopg.Error
+
+    def __init__(self, url, min_size=PG_POOL_MIN, max_size=PG_POOL_MAX):
+        self.url = url
+        self.min_size = min_size
+        self.max_size = max_size
+        # Sockets must not cross a fork: every worker opens its own pool on first use
+        self._pool = ProcessLocal('postgres pool', self._open_pool)
+
+    @property
+    def display_url(self):
+        parts = urlsplit(self.url)
+        if parts.password:
+            netloc = parts.netloc.replace(':' + parts.password + '@', ':***@')
+            parts = parts._replace(netloc=netloc)
+        return urlunsplit(parts)
+
+    def _configure(self, conn):
+        conn.adapters.register_loader('timestamp', _SqliteTimestampLoader)
+        conn.adapters.register_loader('timestamptz', _SqliteTimestampLoader)
+
+    def _open_pool(self):
+        pool = ConnectionPool(self.url, min_size=self.min_size, max_size=self.max_size,
+                              kwargs={'autocommit': True, 'options': '-c TimeZone=UTC'},
+                              configure=self._configure,
+                              name='manager-ai', open=False)
+        pool.open(wait=True, timeout=PG_POOL_TIMEOUT)
+        return pool
+
+    def connect(self):
+        return Connection(self, self._pool.getconn(timeout=PG_POOL_TIMEOUT))
+
+    def release(self, conn):
+        self._pool.putconn(conn)
+
+    def init_schema(self):
+        conn = self.connect()
+        try:
+            c = conn.cursor()._cursor
+            # Several nodes may boot at once; only one runs the DDL at a time
+            c.execute('BEGIN')
+            c.execute(f"SELECT pg_advisory_xact_lock({SCHEMA_LOCK_KEY})")
+            for statement in SCHEMA:
+                c.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
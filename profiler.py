@@ -0,0 +1,211 @@
+# On-demand wall-clock sampling profiler for live requests.
+#
+# Admins switch it on from /admin/profiler; the setting lives in the shared state
+# store so every worker sees it, and it switches itself off after a set time.
+# Selected requests (a random fraction, listed endpoints, or an `X-Profile: 1`
+# header from a trusted client, e.g. a PIN-verified admin) register their
+# thread with a per-process sampler thread, which reads sys._current_frames()
+# every few milliseconds. Because it samples wall-clock time, frames blocked on
+# sockets (OpenRouter, Firestore) or SQLite locks show up as much as CPU work.
+# Each profile is written to PROFILE_DIR as collapsed stacks
+# (`frame;frame;frame count`), ready for flamegraph.pl or speedscope, plus a
+# JSON summary for the admin viewer.
+#
+# When profiling is off the per-request cost is one cached flag check; the
+# sampler thread only runs while a profiled request is in flight.
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import g, request
+
+CONFIG_KEY = 'profiler:config'
+CONFIG_CACHE_SECONDS = 5          # How stale a worker's view of the toggle may be
+SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+MAX_PROFILES = int(os.getenv('PROFILE_MAX_FILES', 200))
+MAX_CONCURRENT = 4                # Per process; extra matching requests run unprofiled
+PROFILE_HEADER = 'X-Profile'
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(frame):
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class SamplingProfiler:
+    def __init__(self, profile_dir, shared_state, trusted_client=None):
+        self.profile_dir = profile_dir
+        self.shared_state = shared_state
+        # Callable deciding whether the current request may force a profile with
+        # X-Profile; without one the header is ignored
+        self.trusted_client = trusted_client
+        self._config = None
+        self._config_checked = 0
+        self._active = {}                 # thread ident -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    # --- Configuration (shared by all workers) ---
+
+    def config(self):
+        now = time.time()
+        if now - self._config_checked > CONFIG_CACHE_SECONDS:
+            raw = self.shared_state.get_value(CONFIG_KEY)
+            self._config = json.loads(raw) if raw else None
+            self._config_checked = now
+        return self._config
+
+    def enable(self, sample_rate, endpoints, minutes):
+        config = {'sample_rate': max(0.0, min(float(sample_rate), 1.0)),
+                  'endpoints': sorted(endpoints),
+                  'expires_at': time.time() + minutes * 60}
+        self.shared_state.set_value(CONFIG_KEY, json.dumps(config), minutes * 60)
+        self._config_checked = 0
+        return config
+
+    def disable(self):
+        self.shared_state.clear(CONFIG_KEY)
+        self._config_checked = 0
+
+    def _should_profile(self, config):
+        if request.headers.get(PROFILE_HEADER) == '1' and self.trusted_client and self.trusted_client():
+            return True
+        if request.endpoint in config['endpoints']:
+            return True
+        return random.random() < config['sample_rate']
+
+    # --- Sampling ---
+
+    def _ensure_sampler(self):
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._sample_loop, name='profiler-sampler', daemon=True)
+        self._thread.start()
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+            time.sleep(SAMPLE_INTERVAL)
+
+    def start(self):
+        config = self.config()
+        if not config or not self._should_profile(config):
+            return
+        with self._lock:
+            if len(self._active) >= MAX_CONCURRENT:
+                return
+            self._active[threading.get_ident()] = Counter()
+            self._ensure_sampler()
+        g._profile_started = time.perf_counter()
+        g._profile_started_at = time.time()
+
+    def stop(self, status=None):
+        started = g.pop('_profile_started', None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+        with self._lock:
+            stacks = self._active.pop(threading.get_ident(), Counter())
+        self._save(stacks, duration, status)
+
+    # --- Storage & viewer ---
+
+    def _save(self, stacks, duration, status):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profile_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+        summary = {
+            'id': profile_id,
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint or 'unmatched',
+            'status': status,
+            'duration_ms': round(duration * 1000, 1),
+            'samples': sum(stacks.values()),
+            'started_at': g.pop('_profile_started_at', time.time()),
+            'pid': os.getpid(),
+            'top_frames': self._top_frames(stacks)
+        }
+        with open(os.path.join(self.profile_dir, f"{profile_id}.folded"), 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(self.profile_dir, f"{profile_id}.json"), 'w') as f:
+            json.dump(summary, f)
+        self._prune()
+
+    def _top_frames(self, stacks, limit=8):
+        # Leaf frames by sample count: where the request was actually waiting or working
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [{'frame': frame, 'percent': round(count * 100 / total, 1)} for frame, count in leaves.most_common(limit)]
+
+    def _prune(self):
+        summaries = sorted(name for name in os.listdir(self.profile_dir) if name.endswith('.json'))
+        for name in summaries[:-MAX_PROFILES]:
+            for ext in ('.json', '.folded'):
+                try:
+                    os.remove(os.path.join(self.profile_dir, name[:-5] + ext))
+                except OSError:
+                    pass
+
+    def list_profiles(self, limit=50):
+        # Slowest first
+        profiles = []
+        if os.path.isdir(self.profile_dir):
+            for name in os.listdir(self.profile_dir):
+                if name.endswith('.json'):
+                    try:
+                        with open(os.path.join(self.profile_dir, name)) as f:
+                            profiles.append(json.load(f))
+                    except (OSError, ValueError):
+                        continue
+        profiles.sort(key=lambda p: p['duration_ms'], reverse=True)
+        return profiles[:limit]
+
+    def folded_path(self, profile_id):
+        path = os.path.join(self.profile_dir, f"{os.path.basename(profile_id)}.folded")
+        return path if os.path.exists(path) else None
+
+    def init_app(self, app):
+        profiler = self
+
+        @app.before_request
+        def start_profile():
+            profiler.start()
+
+        @app.after_request
+        def record_profile_status(response):
+            if '_profile_started' in g:
+                g._profile_status = response.status_code
+            return response
+
+        @app.teardown_request
+        def stop_profile(exc):
+            # Teardown runs after streamed bodies finish, so streams are profiled end to end
+            if '_profile_started' in g:
+                profiler.stop(g.pop('_profile_status', 500))
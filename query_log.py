@@ -0,0 +1,281 @@
+# SQLite query instrumentation and slow-query log.
+#
+# connect() returns a connection whose cursors time every statement from execute
+# through the last fetch, count the rows it returned or changed, and note the
+# route (or background thread) that ran it. All timings feed the Prometheus
+# histogram in metrics.py. Statements slower than SLOW_QUERY_MS are aggregated in
+# a `slow_queries` table in the shared state database, so the report covers every
+# worker, together with their EXPLAIN QUERY PLAN; plans that scan a whole table
+# are flagged. The PostgreSQL backend (pg_database.py) reports through the same
+# new_query()/observe() pair, with EXPLAIN and Seq Scan instead.
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+
+from flask import has_request_context, request
+
+import metrics
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 25))
+EXPLAIN_INTERVAL = 600           # Re-capture a statement's plan at most this often (per process)
+EXPLAINABLE = {'SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH', 'REPLACE'}
+
+_store = None
+_explained = {}
+
+
+def init(store):
+    # store: SharedStateStore whose database holds the slow-query table
+    global _store
+    _store = store
+    store.connection().execute('''CREATE TABLE IF NOT EXISTS slow_queries
+                                  (sql TEXT NOT NULL,
+                                   route TEXT NOT NULL,
+                                   count INTEGER NOT NULL DEFAULT 0,
+                                   total_ms REAL NOT NULL DEFAULT 0,
+                                   max_ms REAL NOT NULL DEFAULT 0,
+                                   last_rows INTEGER,
+                                   max_rows INTEGER NOT NULL DEFAULT 0,
+                                   plan TEXT,
+                                   full_scan INTEGER NOT NULL DEFAULT 0,
+                                   last_seen REAL,
+                                   PRIMARY KEY (sql, route)) WITHOUT ROWID''')
+
+
+def connect(path, **kwargs):
+    return sqlite3.connect(path, factory=InstrumentedConnection, **kwargs)
+
+
+# --- Helpers ---
+
+def operation(sql):
+    words = sql.lstrip().split(None, 1)
+    return words[0].upper() if words else 'OTHER'
+
+
+def normalize(sql):
+    # One entry per statement shape: collapse whitespace and IN (?, ?, ...) lists
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    return re.sub(r'\bIN\s*\(\s*\?(\s*,\s*\?)*\s*\)', 'IN (?...)', sql, flags=re.IGNORECASE)
+
+
+def _route():
+    if has_request_context():
+        return request.endpoint or request.path
+    return threading.current_thread().name
+
+
+def _is_full_scan(detail):
+    # "SCAN ideas" / "SCAN TABLE ideas" read every row; index and FTS scans don't
+    return (detail.startswith('SCAN') and 'USING' not in detail
+            and 'VIRTUAL TABLE' not in detail and 'CONSTANT ROW' not in detail)
+
+
+def _explain(conn, sql, params):
+    plain = conn.cursor(sqlite3.Cursor)
+    try:
+        rows = plain.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    finally:
+        plain.close()
+    plan = '\n'.join(row[3] for row in rows)
+    return plan, any(_is_full_scan(row[3]) for row in rows)
+
+
+def _record_slow(explain, query, seconds):
+    sql = normalize(query['sql'])
+    plan, full_scan = None, False
+    now = time.time()
+    if operation(sql) in EXPLAINABLE and now - _explained.get(sql, 0) > EXPLAIN_INTERVAL:
+        _explained[sql] = now
+        try:
+            plan, full_scan = explain()
+        except Exception as e:
+            plan = f"(plan unavailable: {e})"
+    ms = seconds * 1000
+    print(f"Slow query ({ms:.1f} ms, {query['rows']} rows, {query['route']}): {sql}")
+    if _store is None:
+        return
+    _store.connection().execute('''INSERT INTO slow_queries
+                                       (sql, route, count, total_ms, max_ms, last_rows, max_rows, plan, full_scan, last_seen)
+                                   VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?)
+                                   ON CONFLICT(sql, route) DO UPDATE SET
+                                       count = count + 1,
+                                       total_ms = total_ms + excluded.total_ms,
+                                       max_ms = MAX(max_ms, excluded.max_ms),
+                                       last_rows = excluded.last_rows,
+                                       max_rows = MAX(max_rows, excluded.max_rows),
+                                       plan = COALESCE(excluded.plan, plan),
+                                       full_scan = CASE WHEN excluded.plan IS NULL THEN full_scan
+                                                        ELSE excluded.full_scan END,
+                                       last_seen = excluded.last_seen''',
+                                (sql, query['route'], ms, ms, query['rows'], query['rows'],
+                                 plan, int(full_scan), now))
+
+
+def new_query(sql, params):
+    return {'sql': sql, 'params': params, 'rows': 0, 'elapsed': 0.0, 'route': _route()}
+
+
+def observe(query, explain):
+    # A finished statement; explain() -> (plan, full_scan) is only called for slow ones
+    seconds = query['elapsed']
+    metrics.DB_QUERY_LATENCY.labels(operation(query['sql'])).observe(seconds)
+    if seconds * 1000 < SLOW_QUERY_MS:
+        return
+    try:
+        _record_slow(explain, query, seconds)
+    except Exception as e:
+        print(f"Slow query log error: {e}")
+
+
+# --- Report ---
+
+def report(limit=100):
+    if _store is None:
+        return []
+    conn = _store.connection()
+    rows = conn.execute('''SELECT sql, route, count, total_ms, max_ms, last_rows, max_rows, plan, full_scan, last_seen
+                           FROM slow_queries ORDER BY full_scan DESC, total_ms DESC LIMIT ?''', (limit,)).fetchall()
+    columns = ('sql', 'route', 'count', 'total_ms', 'max_ms', 'last_rows', 'max_rows', 'plan', 'full_scan', 'last_seen')
+    entries = [dict(zip(columns, row)) for row in rows]
+    for entry in entries:
+        entry['avg_ms'] = entry['total_ms'] / entry['count'] if entry['count'] else 0
+    return entries
+
+
+def reset():
+    if _store is not None:
+        _store.connection().execute("DELETE FROM slow_queries")
+    _explained.clear()
+
+
+# --- Instrumented connection ---
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _query = None
+
+    def _run(self, method, sql, params):
+        self._finish()
+        self.connection._settle_dropped()
+        query = new_query(sql, params)
+        started = time.perf_counter()
+        try:
+            result = method(sql, params)
+        except sqlite3.Error:
+            metrics.DB_QUERY_ERRORS.labels(operation(sql)).inc()
+            raise
+        query['elapsed'] = time.perf_counter() - started
+        self._query = query
+        if self.description is None:
+            # No result set (DML/DDL): done, rowcount is what it changed
+            query['rows'] = max(self.rowcount, 0)
+            self._finish()
+        return result
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Timed as one statement; a slow batch is explained with its first parameter set
+        seq_of_parameters = list(seq_of_parameters)
+        return self._run(lambda s, _: super(InstrumentedCursor, self).executemany(s, seq_of_parameters),
+                         sql, seq_of_parameters[0] if seq_of_parameters else ())
+
+    def _fetched(self, started, rows, exhausted):
+        query = self._query
+        if query is None:
+            return
+        query['elapsed'] += time.perf_counter() - started
+        query['rows'] += rows
+        if exhausted:
+            self._finish()
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(started, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows), True)
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(started, 0, True)
+            raise
+        self._fetched(started, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # A lookup cursor dropped without being read to the end or closed. No I/O
+        # here (this may run inside GC or at shutdown): the connection settles the
+        # statement on its next execute or on close.
+        query = self._query
+        if query is not None:
+            self._query = None
+            self.connection._dropped.append(query)
+
+    def _finish(self):
+        query = self._query
+        if query is None:
+            return
+        self._query = None
+        self.connection._observe(query)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cursors = weakref.WeakSet()
+        self._dropped = []                # Pending statements of collected cursors
+
+    # The C implementations of execute()/executemany() bypass cursor(), so route them through it
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def cursor(self, factory=InstrumentedCursor):
+        cursor = super().cursor(factory)
+        if factory is InstrumentedCursor:
+            # Single-row lookups are never read to the end: settled by close() or, once
+            # the cursor is collected, by the next execute. Weak, so a long-lived
+            # connection doesn't keep every cursor it ever made.
+            self._cursors.add(cursor)
+        return cursor
+
+    def close(self):
+        for cursor in list(self._cursors):
+            cursor._finish()
+        self._cursors.clear()
+        self._settle_dropped()
+        super().close()
+
+    def _observe(self, query):
+        observe(query, lambda: _explain(self, query['sql'], query['params']))
+
+    def _settle_dropped(self):
+        while self._dropped:
+            self._observe(self._dropped.pop(0))
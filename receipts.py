@@ -0,0 +1,137 @@
+# Payment receipt pipeline.
+#
+# submit_payment only stages the screenshot: it is downscaled/recompressed into the
+# local uploads folder and the submission row points at the local file, so the
+# user gets their confirmation immediately. A background thread then pushes the
+# file to Cloudinary and swaps submissions.screenshot_path to the hosted URL.
+# Until then admins view the local copy through the /uploads/ route.
+
+import os
+import queue
+import threading
+import time
+import uuid
+
+import cloudinary.uploader
+from PIL import Image, ImageOps, UnidentifiedImageError
+from werkzeug.utils import secure_filename
+
+import http_client
+
+MAX_EDGE = int(os.getenv('RECEIPT_MAX_EDGE', 1600))      # Long edge cap in pixels
+QUALITY = int(os.getenv('RECEIPT_QUALITY', 80))          # WebP quality target
+MAX_ATTEMPTS = 5
+CLAIM_TTL = 600                                          # Seconds a worker owns a pending upload
+
+
+class InvalidReceipt(ValueError):
+    pass
+
+
+def stage_receipt(file_storage, upload_folder):
+    # Returns the staged filename inside upload_folder
+    try:
+        image = Image.open(file_storage.stream)
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((MAX_EDGE, MAX_EDGE))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        filename = f"receipt_{uuid.uuid4().hex}.webp"
+        image.save(os.path.join(upload_folder, filename), 'WEBP', quality=QUALITY, method=4)
+        return filename
+    except Image.DecompressionBombError as e:
+        # Far more pixels than any screenshot: never stage or forward it
+        print(f"Receipt rejected ({e}).")
+        raise InvalidReceipt('That image is too large to be a receipt screenshot. Please upload a smaller image.')
+    except (UnidentifiedImageError, OSError) as e:
+        # Formats Pillow can't decode (e.g. HEIC) go through untouched; Cloudinary handles them
+        print(f"Receipt not recompressed ({e}); staging original.")
+        file_storage.stream.seek(0)
+        filename = f"receipt_{uuid.uuid4().hex}_{secure_filename(file_storage.filename or 'upload')}"
+        file_storage.save(os.path.join(upload_folder, filename))
+        return filename
+
+
+class ReceiptUploader:
+    def __init__(self, connect, upload_folder, shared_state):
+        self.connect = connect      # The app's connect_db (SQLite or PostgreSQL)
+        self.upload_folder = upload_folder
+        self.shared_state = shared_state
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Lazily started per process (threads don't survive a fork)
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name='receipt-uploader', daemon=True)
+            self._thread.start()
+        self.recover_pending()
+
+    def enqueue(self, submission_id, filename):
+        self.start()
+        self._queue.put((submission_id, filename, 1))
+
+    def recover_pending(self):
+        # Re-queue receipts left behind by a restart (local paths, not yet hosted)
+        conn = self.connect()
+        try:
+            c = conn.cursor()
+            c.execute("SELECT id, screenshot_path FROM submissions WHERE screenshot_path NOT LIKE 'http%'")
+            rows = c.fetchall()
+        finally:
+            conn.close()
+        for submission_id, filename in rows:
+            if filename and os.path.exists(os.path.join(self.upload_folder, filename)):
+                self._queue.put((submission_id, filename, 1))
+
+    def _run(self):
+        while True:
+            submission_id, filename, attempt = self._queue.get()
+            # Only one worker process uploads a given receipt
+            claim_key = f"receipt_upload:{submission_id}"
+            if attempt == 1 and self.shared_state.incr(claim_key, CLAIM_TTL) > 1:
+                continue
+            try:
+                self._upload(submission_id, filename)
+                self.shared_state.clear(claim_key)
+            except Exception as e:
+                print(f"Receipt upload failed for submission {submission_id} (attempt {attempt}): {e}")
+                if attempt < MAX_ATTEMPTS:
+                    threading.Timer(min(2 ** attempt, 60), self._queue.put,
+                                    args=((submission_id, filename, attempt + 1),)).start()
+                else:
+                    # Stays available locally; recover_pending picks it up after a restart
+                    self.shared_state.clear(claim_key)
+
+    def _upload(self, submission_id, filename):
+        path = os.path.join(self.upload_folder, filename)
+        if not os.path.exists(path):
+            return
+        connect_timeout, read_timeout = http_client.SERVICE_TIMEOUTS['cloudinary']
+        started = time.perf_counter()
+        with http_client.track('cloudinary', 'api.cloudinary.com'):
+            result = cloudinary.uploader.upload(
+                path,
+                folder="manager_ai_payments/",
+                resource_type="image",
+                timeout=connect_timeout + read_timeout
+            )
+        url = result.get('secure_url')
+        if not url:
+            raise RuntimeError('Cloudinary returned no secure_url')
+
+        conn = self.connect()
+        try:
+            conn.execute("UPDATE submissions SET screenshot_path = ? WHERE id = ? AND screenshot_path = ?",
+                         (url, submission_id, filename))
+            conn.commit()
+        finally:
+            conn.close()
+        os.remove(path)
+        print(f"Receipt for submission {submission_id} uploaded in {time.perf_counter() - started:.1f}s.")
@@ -0,0 +1,144 @@
+# Cross-worker shared state (rate-limit counters, admin PIN lockouts, flags).
+#
+# Gunicorn workers don't share memory, so anything that must hold across workers
+# lives in a small SQLite database in WAL mode. Every key carries an expiry;
+# expired keys read as empty and are purged periodically so the file stays small.
+
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+from limits.storage import Storage
+
+PURGE_INTERVAL = 60  # Seconds between sweeps of expired keys (per process)
+
+
+class SharedStateStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._last_purge = 0
+        self._init_schema()
+
+    def _connect(self):
+        # One connection per thread, re-opened after fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def connection(self):
+        # For modules that keep their own tables in this database (e.g. query_log)
+        return self._connect()
+
+    def _init_schema(self):
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS shared_state
+                        (key TEXT PRIMARY KEY,
+                         value INTEGER NOT NULL DEFAULT 0,
+                         text_value TEXT,
+                         expires_at REAL NOT NULL) WITHOUT ROWID''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_shared_state_expiry ON shared_state(expires_at)")
+
+    def _maybe_purge(self, conn, now):
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        conn.execute("DELETE FROM shared_state WHERE expires_at <= ?", (now,))
+
+    # --- Counters ---
+
+    def incr(self, key, expiry, amount=1, elastic_expiry=False):
+        # Atomic increment; an expired counter restarts from `amount`.
+        # With elastic_expiry every hit pushes the expiry out again.
+        now = time.time()
+        conn = self._connect()
+        self._maybe_purge(conn, now)
+        row = conn.execute('''INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)
+                              ON CONFLICT(key) DO UPDATE SET
+                                  value = CASE WHEN expires_at <= ? THEN excluded.value
+                                               ELSE value + excluded.value END,
+                                  expires_at = CASE WHEN expires_at <= ? OR ? THEN excluded.expires_at
+                                                    ELSE expires_at END
+                              RETURNING value''',
+                           (key, amount, now + expiry, now, now, 1 if elastic_expiry else 0)).fetchone()
+        return row[0]
+
+    def get(self, key):
+        row = self._connect().execute("SELECT value FROM shared_state WHERE key = ? AND expires_at > ?",
+                                      (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._connect().execute("SELECT expires_at FROM shared_state WHERE key = ? AND expires_at > ?",
+                                      (key, now)).fetchone()
+        return row[0] if row else now
+
+    # --- Plain values ---
+
+    def set_value(self, key, value, expiry):
+        self._connect().execute('''INSERT INTO shared_state (key, text_value, expires_at) VALUES (?, ?, ?)
+                                   ON CONFLICT(key) DO UPDATE SET
+                                       text_value = excluded.text_value, expires_at = excluded.expires_at''',
+                                (key, value, time.time() + expiry))
+
+    def get_value(self, key, default=None):
+        row = self._connect().execute("SELECT text_value FROM shared_state WHERE key = ? AND expires_at > ?",
+                                      (key, time.time())).fetchone()
+        return row[0] if row else default
+
+    # --- Housekeeping ---
+
+    def clear(self, key):
+        self._connect().execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def clear_prefix(self, prefix):
+        cur = self._connect().execute("DELETE FROM shared_state WHERE key >= ? AND key < ?",
+                                      (prefix, prefix + '￿'))
+        return cur.rowcount
+
+    def check(self):
+        try:
+            self._connect().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+
+class SQLiteLimiterStorage(Storage):
+    # Flask-Limiter / limits backend: storage_uri="sqlite:////abs/path/to/state.db"
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.store = SharedStateStore(urlparse(uri).path)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key, expiry, amount=1):
+        return self.store.incr(f"limiter:{key}", expiry, amount)
+
+    def get(self, key):
+        return self.store.get(f"limiter:{key}")
+
+    def get_expiry(self, key):
+        return self.store.get_expiry(f"limiter:{key}")
+
+    def check(self):
+        return self.store.check()
+
+    def reset(self):
+        return self.store.clear_prefix("limiter:")
+
+    def clear(self, key):
+        self.store.clear(f"limiter:{key}")
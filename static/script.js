@@ -243,6 +243,28 @@ document.addEventListener('DOMContentLoaded', () => {
     const saveToneBtn = document.getElementById('save-tone-btn');
     const brandToneInput = document.getElementById('brand-tone-input');
 
+    // One key per action: if the connection drops, the retry carries the same
+    // key and the server replays the first result instead of generating (and
+    // charging) twice.
+    const newIdempotencyKey = () => (window.crypto && crypto.randomUUID)
+        ? crypto.randomUUID()
+        : Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+
+    const postWithRetry = (url, options, attempts = 3) =>
+        fetch(url, options)
+            .then(res => {
+                if (res.status === 409 && attempts > 1) {
+                    // The first attempt is still running on the server
+                    return new Promise(resolve => setTimeout(resolve, 2000))
+                        .then(() => postWithRetry(url, options, attempts - 1));
+                }
+                return res;
+            }, err => {
+                if (attempts <= 1) throw err;
+                return new Promise(resolve => setTimeout(resolve, 1000))
+                    .then(() => postWithRetry(url, options, attempts - 1));
+            });
+
     // Helper to call API
     const callAI = (mode, payload = {}) => {
         const loadingOverlay = document.getElementById('loading-overlay');
@@ -258,9 +280,9 @@ document.addEventListener('DOMContentLoaded', () => {
         };
         document.querySelector('.loading-text').innerText = modeLabels[mode] || "Working Magic...";
 
-        return fetch('/api/generate', {
+        return postWithRetry('/api/generate', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'Idempotency-Key': newIdempotencyKey() },
             body: JSON.stringify({
                 mode: mode,
                 businessType: businessInput.value.trim(),
@@ -288,6 +310,10 @@ document.addEventListener('DOMContentLoaded', () => {
                         }).then((result) => { if (result.isConfirmed) window.location.href = '/pricing'; });
                     } else if (data.error === "UPGRADE_REQUIRED") {
                         Swal.fire({ icon: 'warning', title: 'Upgrade Required', text: data.message });
+                    } else if (data.error === "SERVER_BUSY") {
+                        Swal.fire({ icon: 'info', title: 'Busy Right Now', text: data.message });
+                    } else if (data.error === "INPUT_TOO_LARGE") {
+                        Swal.fire({ icon: 'warning', title: 'Too Long', text: data.message });
                     } else {
                         Swal.fire({ icon: 'error', title: 'Error', text: data.error });
                     }
@@ -298,7 +324,7 @@ document.addEventListener('DOMContentLoaded', () => {
             .catch(err => {
                 loadingOverlay.classList.add('hidden');
                 console.error(err);
-                if (!err.message.includes("LIMIT_REACHED") && !err.message.includes("UPGRADE_REQUIRED")) {
+                if (!["LIMIT_REACHED", "UPGRADE_REQUIRED", "SERVER_BUSY", "INPUT_TOO_LARGE"].some(code => err.message.includes(code))) {
                     Swal.fire({ icon: 'error', title: 'Oops...', text: 'Something went wrong.' });
                 }
                 throw err;
@@ -0,0 +1,121 @@
+# Fingerprinted, precompressed static assets.
+#
+# Build step (run on deploy, after `git pull`):
+#     python static_assets.py
+# copies every file in static/ to static/dist/<name>.<hash><ext>, writes .gz/.br
+# variants for text assets and an asset-manifest.json mapping original names to
+# hashed ones. At runtime url_for('static', filename='style.css') resolves to the
+# hashed file, which is served with `Cache-Control: immutable` and the best
+# precompressed variant the browser accepts. The generated service worker (/sw.js)
+# uses the manifest for its cache version and precache list. Without a build,
+# everything falls back to the plain files so local development needs no extra step.
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+import brotli
+from flask import request, send_from_directory
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_NAME = 'asset-manifest.json'
+
+# Served from fixed URLs (/manifest.json, /robots.txt), so never renamed
+SKIP_FILES = {'manifest.json', 'robots.txt'}
+COMPRESSIBLE = {'.css', '.js', '.json', '.svg', '.txt', '.html', '.xml'}
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+
+# --- Build ---
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+
+    assets = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != dist_dir]
+        for name in sorted(files):
+            rel_path = os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, '/')
+            if rel_path in SKIP_FILES:
+                continue
+            with open(os.path.join(root, name), 'rb') as f:
+                data = f.read()
+
+            stem, ext = os.path.splitext(rel_path)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+            target = os.path.join(dist_dir, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+
+            if ext.lower() in COMPRESSIBLE:
+                with open(target + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                with open(target + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+
+            assets[rel_path] = f"dist/{hashed}"
+
+    version = hashlib.sha256(json.dumps(assets, sort_keys=True).encode()).hexdigest()[:12]
+    manifest = {'version': version, 'assets': assets}
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+# --- Runtime ---
+
+class AssetManifest:
+    def __init__(self, dist_dir=DIST_DIR):
+        self.dist_dir = dist_dir
+        self.version = 'dev'
+        self.assets = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.dist_dir, MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+            self.version = manifest['version']
+            self.assets = manifest['assets']
+        except (OSError, ValueError, KeyError):
+            print("No static asset manifest found; serving unfingerprinted assets.")
+
+    def resolve(self, filename):
+        return self.assets.get(filename, filename)
+
+    def init_app(self, app):
+        manifest = self
+
+        @app.url_defaults
+        def fingerprint_static_urls(endpoint, values):
+            # Makes url_for('static', filename='style.css') emit the hashed name
+            if endpoint == 'static' and 'filename' in values:
+                values['filename'] = manifest.resolve(values['filename'])
+
+        @app.route('/static/dist/<path:filename>')
+        def fingerprinted_asset(filename):
+            response = None
+            accepted = request.accept_encodings
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+                if accepted[encoding] > 0 and os.path.exists(os.path.join(manifest.dist_dir, filename + suffix)):
+                    response = send_from_directory(manifest.dist_dir, filename + suffix, mimetype=mimetype)
+                    response.headers['Content-Encoding'] = encoding
+                    break
+            if response is None:
+                response = send_from_directory(manifest.dist_dir, filename)
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE
+            response.headers['Vary'] = 'Accept-Encoding'
+            return response
+
+
+if __name__ == '__main__':
+    result = build()
+    print(f"Built {len(result['assets'])} assets (version {result['version']}) into {DIST_DIR}")
@@ -0,0 +1,94 @@
+// Generated by the /sw.js route from the Flask URL map; do not serve statically.
+// Each route gets a caching strategy: only public pages and assets are cached, so
+// API calls and per-user pages always go to the network, and fingerprinted assets
+// never hit the network twice.
+const CONFIG = {{ sw_config|tojson }};
+// "v2": caches from before per-user pages were excluded are dropped on activate
+const CACHE_NAME = 'manager-ai-v2-' + CONFIG.version;
+const ROUTES = CONFIG.routes.map((route) => ({ pattern: new RegExp(route.pattern), strategy: route.strategy }));
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(CACHE_NAME).then(async (cache) => {
+            for (const url of CONFIG.precache) {
+                // Hashed files are identical across versions: copy instead of re-downloading
+                const existing = url.includes('/static/dist/') ? await caches.match(url) : null;
+                if (existing) {
+                    await cache.put(url, existing);
+                    continue;
+                }
+                try {
+                    const response = await fetch(url, { credentials: 'same-origin' });
+                    // Don't pin redirects (e.g. the intro page bouncing a logged-in user to the dashboard)
+                    if (response.ok && !response.redirected) {
+                        await cache.put(url, response);
+                    }
+                } catch (e) { /* offline during install: cache on first use instead */ }
+            }
+        }).then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys().then((keys) => Promise.all(
+            keys.filter((key) => key.startsWith('manager-ai-') && key !== CACHE_NAME)
+                .map((key) => caches.delete(key))
+        )).then(() => self.clients.claim())
+    );
+});
+
+function strategyFor(request) {
+    if (request.method !== 'GET') return 'network-only';
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) {
+        return CONFIG.external_origins.includes(url.origin) ? 'cache-first' : 'network-only';
+    }
+    for (const route of ROUTES) {
+        if (route.pattern.test(url.pathname)) return route.strategy;
+    }
+    return 'network-only';
+}
+
+function cacheFirst(request) {
+    return caches.match(request).then((cached) => cached || fetch(request).then((response) => {
+        if (response.ok) {
+            const copy = response.clone();
+            caches.open(CACHE_NAME).then((cache) => cache.put(request, copy));
+        }
+        return response;
+    }));
+}
+
+function networkFirst(request) {
+    return fetch(request).then((response) => {
+        if (response.ok && !response.redirected) {
+            const copy = response.clone();
+            caches.open(CACHE_NAME).then((cache) => cache.put(request, copy));
+        }
+        return response;
+    }).catch(() => caches.match(request));
+}
+
+function staleWhileRevalidate(event) {
+    const request = event.request;
+    return caches.open(CACHE_NAME).then((cache) => cache.match(request).then((cached) => {
+        const network = fetch(request).then((response) => {
+            if (response.ok) cache.put(request, response.clone());
+            return response;
+        });
+        if (cached) {
+            event.waitUntil(network.catch(() => {}));
+            return cached;
+        }
+        return network;
+    }));
+}
+
+self.addEventListener('fetch', (event) => {
+    const strategy = strategyFor(event.request);
+    // network-only: don't intercept at all, the browser handles it with zero overhead
+    if (strategy === 'cache-first') event.respondWith(cacheFirst(event.request));
+    else if (strategy === 'network-first') event.respondWith(networkFirst(event.request));
+    else if (strategy === 'stale-while-revalidate') event.respondWith(staleWhileRevalidate(event));
+});
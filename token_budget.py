@@ -0,0 +1,160 @@
+# Token budgets for the user-supplied parts of AI prompts.
+#
+# Captions, refinements, brand tones, chat history and past ideas are pasted
+# into prompts verbatim; a 50 KB caption would otherwise become a slow,
+# expensive call. Every such segment goes through fit()/fit_list() before the
+# prompt is built, and the finished prompt through check_prompt() before the
+# call is queued, so nothing oversized ever reaches OpenRouter.
+#
+# - FIELD_BUDGETS caps each segment per mode. An oversized segment is trimmed
+#   in the middle (the opening hook and the closing call to action survive),
+#   or rejected with InputTooLarge when trimming would change the task (the
+#   content being scored, a refinement instruction, a support question).
+#   Lists (past ideas, chat history) keep their newest items.
+# - PROMPT_BUDGETS caps the whole prompt per mode; together with the policy's
+#   max_tokens it must also fit AI_CONTEXT_TOKENS.
+#
+# Token counts are estimates (about four ASCII characters per token, one per
+# other character), deliberately on the high side. No tokenizer is needed,
+# and the figure is close enough for every model behind OpenRouter.
+
+import math
+import os
+from collections import namedtuple
+
+import metrics
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD = 4            # Role and separators per chat message
+AI_CONTEXT_TOKENS = int(os.getenv('AI_CONTEXT_TOKENS', 32000))
+
+Budget = namedtuple('Budget', 'tokens overflow per_item', defaults=('trim', None))
+
+DEFAULT_FIELD_BUDGET = Budget(100)
+_GENERATE = {
+    'refinement': Budget(300, 'reject'),
+    'previous_idea': Budget(1200),
+    'past_ideas': Budget(1500, per_item=150),
+}
+FIELD_BUDGETS = {
+    '*': {
+        'brand_tone': Budget(150),
+        'business_type': Budget(40),
+        'location': Budget(40),
+        'link': Budget(100),
+        'handle': Budget(40),
+        'niche': Budget(60),
+        'content_type': Budget(20),
+        # Picked from dropdowns in the UI, but the API takes any string
+        'platform': Budget(20),
+        'mood': Budget(20),
+        'goal': Budget(40),
+        'people': Budget(20),
+        'language': Budget(10),
+    },
+    'idea': _GENERATE,
+    'script': _GENERATE,
+    'content_scorer': {'content': Budget(2000, 'reject')},
+    'optimize_cta': {'content': Budget(1500)},
+    'rewrite_hook': {'content': Budget(1500)},
+    'support': {
+        'question': Budget(500, 'reject'),
+        'history': Budget(1500, per_item=300),
+    },
+}
+PROMPT_BUDGETS = {
+    'idea': 4500,
+    'script': 4500,
+    'viral_analyzer': 1500,
+    'competitor_scanner': 2000,
+    'content_scorer': 3000,
+    'weekly_plan': 1500,
+    'optimize_cta': 2500,
+    'rewrite_hook': 2500,
+    'support': 3000,
+}
+DEFAULT_PROMPT_BUDGET = 3000
+
+FIELD_LABELS = {
+    'content': 'content',
+    'refinement': 'refinement request',
+    'question': 'question',
+}
+
+
+class InputTooLarge(Exception):
+    def __init__(self, field, tokens, limit):
+        label = FIELD_LABELS.get(field, field.replace('_', ' '))
+        super().__init__(f"Your {label} is too long (about {tokens:,} tokens; the limit is {limit:,}). "
+                         f"Please shorten it and try again.")
+        self.field, self.tokens, self.limit = field, tokens, limit
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return math.ceil(ascii_chars / CHARS_PER_TOKEN) + (len(text) - ascii_chars)
+
+
+def budget_for(mode, field):
+    return FIELD_BUDGETS.get(mode, {}).get(field) or FIELD_BUDGETS['*'].get(field) or DEFAULT_FIELD_BUDGET
+
+
+def trim(text, tokens):
+    # Keeps the first two thirds and the last third of what fits, marking the cut
+    estimate = estimate_tokens(text)
+    if estimate <= tokens:
+        return text
+    keep = int(len(text) * tokens / estimate)
+    while keep > 0:
+        head = keep * 2 // 3
+        tail = keep - head
+        trimmed = (text[:head].rstrip() + f"\n[... {len(text) - keep:,} characters trimmed ...]\n"
+                   + (text[-tail:].lstrip() if tail else ''))
+        if estimate_tokens(trimmed) <= tokens:
+            return trimmed
+        keep = int(keep * 0.9)
+    return ''
+
+
+def fit(mode, field, text):
+    if not text:
+        return text
+    budget = budget_for(mode, field)
+    tokens = estimate_tokens(text)
+    if tokens <= budget.tokens:
+        return text
+    if budget.overflow == 'reject':
+        metrics.AI_INPUT_BUDGET.labels(mode, field, 'rejected').inc()
+        raise InputTooLarge(field, tokens, budget.tokens)
+    metrics.AI_INPUT_BUDGET.labels(mode, field, 'trimmed').inc()
+    return trim(text, budget.tokens)
+
+
+def fit_list(mode, field, items):
+    # Newest (last) items first: each is trimmed to per_item, and older ones are
+    # dropped once the field's budget is spent. Returns the kept suffix in order.
+    budget = budget_for(mode, field)
+    kept = []
+    remaining = budget.tokens
+    for item in reversed(items):
+        item = trim(item, budget.per_item) if budget.per_item else item
+        tokens = estimate_tokens(item) + MESSAGE_OVERHEAD
+        if tokens > remaining:
+            break
+        kept.append(item)
+        remaining -= tokens
+    if len(kept) < len(items):
+        metrics.AI_INPUT_BUDGET.labels(mode, field, 'trimmed').inc()
+    return kept[::-1]
+
+
+def check_prompt(mode, messages, max_tokens):
+    # Last line of defence once the prompt is assembled, before the call is queued
+    tokens = sum(estimate_tokens(str(m.get('content') or '')) + MESSAGE_OVERHEAD for m in messages)
+    limit = min(PROMPT_BUDGETS.get(mode, DEFAULT_PROMPT_BUDGET), AI_CONTEXT_TOKENS - max_tokens)
+    if tokens > limit:
+        metrics.AI_INPUT_BUDGET.labels(mode, 'prompt', 'rejected').inc()
+        raise InputTooLarge('request', tokens, limit)
+    return tokens